@@ -1,17 +1,17 @@
 import os
-import google.generativeai as genai
 import re
 import json
-from handlers.expense import save_expense, get_today_expense, get_weekly_expense, get_monthly_expense, get_monthly_income
-
-# 設定 Gemini AI API 金鑰
-GOOGLE_API_KEY1 = os.getenv('GOOGLE_API_KEY1')
-genai.configure(api_key=GOOGLE_API_KEY1)
+from handlers.expense import save_expenses, get_today_expense, get_weekly_expense, get_monthly_expense, get_monthly_income
+from intent_classifier import classify_intent, NULL_INTENT
+import llm_cache
+import llm_gateway
 
 # 記帳類別
 EXPENSE_CATEGORIES = ["餐飲", "交通", "娛樂", "購物", "醫療", "日常"]
 INCOME_CATEGORIES = ["薪水", "獎金", "投資", "補助"]
 
+GOOGLE_API_KEY1 = os.getenv('GOOGLE_API_KEY1')     # 記帳解析使用自己的金鑰（未設定時使用 GOOGLE_API_KEY）
+
 # 清理 AI JSON 回應，避免解析錯誤
 def clean_json_response(response):
     """移除可能的 Markdown 標記，確保 JSON 可解析"""
@@ -19,11 +19,9 @@ def clean_json_response(response):
     response = re.sub(r"```json|```", "", response)  # 移除 ```json 和 ```
     return response
 
-# 更新主函數：允許同時處理「記帳」與「查詢」
-def process_user_input(user_id, input_text):
-    """利用 AI 判斷使用者輸入的意圖，並執行對應的動作（記帳與查詢皆可同時執行）"""
-
-    # **讓 AI 解析輸入，並回應 JSON 格式**
+# 利用 AI 解析意圖
+def parse_intent_with_ai(input_text):
+    """讓 AI 解析輸入並回應 JSON 格式，回傳解析結果 dict 或 "null"（JSON 格式錯誤時拋出 JSONDecodeError）"""
     prompt = f"""
     你是一個智慧財務助理，請幫助用戶解析記帳與查詢請求。
     
@@ -63,37 +61,89 @@ def process_user_input(user_id, input_text):
     "{input_text}"
     """
 
-    model = genai.GenerativeModel("gemini-1.5-pro")
-
-    try:
-        response = model.generate_content(prompt).text.strip()
-        response = clean_json_response(response)  # **清理 AI JSON**
-        result = json.loads(response)  # **解析 JSON**
-        
-        # ✅ **確保 result 不是 None**
-        if result is None or not isinstance(result, dict):
-            return "null"  # **如果 AI 沒有回應 JSON，則回傳 "null"**
+    response = llm_gateway.generate(prompt, api_key=GOOGLE_API_KEY1)
+    response = clean_json_response(response)  # **清理 AI JSON**
+    result = json.loads(response)  # **解析 JSON**
+
+    # ✅ **確保 result 不是 None**
+    if result is None or not isinstance(result, dict):
+        return "null"  # **如果 AI 沒有回應 JSON，則回傳 "null"**
+    return result
+
+# 將 AI 解析結果中的金額換成 {n0}、{n1}... 樣板（金額必須來自使用者輸入的數字，否則不快取）
+def _template_result(result, numbers):
+    if not isinstance(result, dict):
+        return result
+    templated = json.loads(json.dumps(result))
+    for transaction in templated.get("記帳", []):
+        amount = transaction.get("金額")
+        if not isinstance(amount, (int, float)) or float(amount) not in numbers:
+            return None
+        transaction["金額"] = f"{{n{numbers.index(float(amount))}}}"
+    return templated
+
+# 將快取樣板中的金額換回這次輸入的數字
+def _fill_result(templated, numbers):
+    if not isinstance(templated, dict):
+        return templated
+    result = json.loads(json.dumps(templated))
+    for transaction in result.get("記帳", []):
+        index = int(str(transaction["金額"]).strip("{n}"))
+        amount = numbers[index]
+        transaction["金額"] = int(amount) if amount.is_integer() else amount
+    return result
+
+# 有快取時不呼叫 AI（輸入正規化，數字以樣板取代，「午餐120」與「午餐80」共用同一筆快取）
+def parse_intent_cached(input_text):
+    key, numbers = llm_cache.template_numbers(llm_cache.normalize_text(input_text))
+    cached = llm_cache.lookup("intent", key)
+    if cached is not None:
+        return _fill_result(cached, numbers)
+
+    result = parse_intent_with_ai(input_text)
+    templated = _template_result(result, numbers)
+    if templated is not None:
+        llm_cache.store("intent", key, templated)
+    return result
 
-    except json.JSONDecodeError as e:
-        return f"⚠️ AI 解析 JSON 失敗：{str(e)}"
+# 更新主函數：允許同時處理「記帳」與「查詢」
+def process_user_input(user_id, input_text):
+    """判斷使用者輸入的意圖（先用本地規則，無法確定時才交給 AI），並執行對應的動作（記帳與查詢皆可同時執行）"""
+
+    # **明確的輸入直接在本地判斷，不必等 AI**
+    result = classify_intent(input_text)
+    if result == NULL_INTENT:
+        return "null"
+
+    if result is None:
+        try:
+            result = parse_intent_cached(input_text)
+        except json.JSONDecodeError as e:
+            return f"⚠️ AI 解析 JSON 失敗：{str(e)}"
+        except llm_gateway.LLMBusyError as e:
+            return str(e)   # AI 服務忙碌，回覆使用者稍後再試
+        if result == "null":
+            return "null"
 
     output_messages = []  # 存放 AI 回應的結果
     records = None  # 確保 records 變數存在
 
     # **處理「記帳模式」**
     if "記帳" in result:
+        transactions = []
         for transaction in result["記帳"]:
             record_type = transaction["類型"]
             category = transaction["類別"]
             amount = transaction["金額"]
 
-            # 確保金額是數字
+            # 確保金額是數字（之前解析成功的記帳仍會寫入）
             if not isinstance(amount, (int, float)):
+                save_expenses(user_id, transactions)
                 return "⚠️ 未偵測到金額，請確認輸入格式"
+            transactions.append((category, amount, record_type))
 
-            # 儲存記帳資料
-            save_result = save_expense(category, amount, user_id, record_type)
-            output_messages.append(save_result)
+        # 儲存記帳資料（多筆合併寫入）
+        output_messages.extend(save_expenses(user_id, transactions))
 
     # **處理「查詢模式」**
     if "查詢" in result:
@@ -116,8 +166,10 @@ def process_user_input(user_id, input_text):
 
     # **處理「使用者是否要求財務建議」**
     if result.get("建議") and records:
-        advice = generate_financial_advice(records)
-        output_messages.append(advice)
+        try:
+            output_messages.append(generate_financial_advice(records))
+        except llm_gateway.LLMBusyError as e:
+            output_messages.append(str(e))  # 查詢結果照常回覆，只有建議稍後再試
 
     return "\n\n".join(str(m) for m in output_messages if m)  # **確保結果不為 None**
 
@@ -135,15 +187,19 @@ def generate_financial_advice(records):
     else:
         records_str = str(records)
 
-    prompt = f"""
-    你是一位智慧財務顧問，以下是使用者的財務數據：
-    {records_str}
-    
-    請提供一段財務建議，幫助使用者更有效管理財務。
-    """
+    # 相同的財務數據直接使用快取的建議
+    cache_key = llm_cache.normalize_text(records_str)
+    response = llm_cache.lookup("advice", cache_key)
+    if response is None:
+        prompt = f"""
+        你是一位智慧財務顧問，以下是使用者的財務數據：
+        {records_str}
+        
+        請提供一段財務建議，幫助使用者更有效管理財務。
+        """
 
-    model = genai.GenerativeModel("gemini-1.5-pro")
-    response = model.generate_content(prompt).text.strip()
+        response = llm_gateway.generate(prompt, api_key=GOOGLE_API_KEY1)
+        llm_cache.store("advice", cache_key, response)
     
     return records_str + "\n\n💡 AI 理財建議：" + response
 
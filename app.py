@@ -1,8 +1,9 @@
 import re
 import os
-import cv2
+import time
+import threading
 import requests
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.webhooks import (
     FollowEvent,
@@ -13,10 +14,8 @@ from linebot.v3.webhooks import (
     ImageMessageContent
 )
 from linebot.v3.messaging import (
-    ApiClient,
-    Configuration,
-    MessagingApi,
     ReplyMessageRequest,
+    PushMessageRequest,
     TextMessage,
     ImageMessage,
     TextMessage,
@@ -25,41 +24,60 @@ from linebot.v3.messaging import (
     PostbackAction,
 )
 from linebot.v3.exceptions import InvalidSignatureError
-from get_username import get_line_username
-from handlers import news                                             # 新聞
-from handlers.news_wordcloud import fetch_google_news, generate_wordcloud  # 文字雲
-from handlers.horoscope import get_horoscope_content                  # 星座
-from handlers.earthquake import get_earthquake_info                   # 地震
-from handlers.weather import get_weather_info                         # 天氣
-from handlers.expense import (save_expense, get_today_expense,        # 記帳功能
-                              get_weekly_expense, get_monthly_expense,
-                              get_monthly_income, set_budget
-                            )  
-from handlers.image_utils import clear_old_images    
-from handlers.image_filters import (sketch_effect, emboss_effect, oilPaint_effect,
-                                    blackWhite_effect, softGlow_effect, bigEyes_effect
-                                )                                    # 圖片風格轉換功能
-from handlers.stock_prediction import predict_stock_price, get_stock_name,get_technical_indicators
-from handlers.stock_news import get_stock_news
-from handlers.stock_kchart import plot_stock_chart
-from handlers.stock_trend_chart import plot_stock_trend
-from handlers.stock_watchlist import get_watchlist
-from handlers.stock_watchlist import add_watchlist, remove_watchlist, get_watchlist
+from get_username import line_bot_api, refresh_line_username   # 與各模組共用同一個 LINE API client
 from quick_reply import expense_quickReply, stock_quickReply, image_quickReply
-from handlers.breed_classifier import predict_breed  
-from handlers.chat import chat_with_bard 
-import ai_expense
+from feature_registry import LazyModule, lazy, call_if_loaded, get_import_profile, warmup_from_env
+import dispatcher
+from session_store import get_state, set_state, clear_state
+
+# 功能模組延遲載入：第一次使用時才 import（TensorFlow、mediapipe、OpenCV 等不會拖慢啟動）
+cv2 = LazyModule("cv2")
+news = LazyModule("handlers.news")                                                      # 新聞
+ai_expense = LazyModule("ai_expense")
+llm_gateway = LazyModule("llm_gateway")
+fetch_google_news = lazy("handlers.news_wordcloud", "fetch_google_news")                # 文字雲
+generate_wordcloud = lazy("handlers.news_wordcloud", "generate_wordcloud")
+get_horoscope_content = lazy("handlers.horoscope", "get_horoscope_content")             # 星座
+get_earthquake_info = lazy("handlers.earthquake", "get_earthquake_info")                # 地震
+get_weather_info = lazy("handlers.weather", "get_weather_info")                         # 天氣
+save_expense = lazy("handlers.expense", "save_expense")                                 # 記帳功能
+get_today_expense = lazy("handlers.expense", "get_today_expense")
+get_weekly_expense = lazy("handlers.expense", "get_weekly_expense")
+get_monthly_expense = lazy("handlers.expense", "get_monthly_expense")
+get_monthly_income = lazy("handlers.expense", "get_monthly_income")
+set_budget = lazy("handlers.expense", "set_budget")
+clear_old_images = lazy("handlers.image_utils", "clear_old_images")
+sketch_effect = lazy("handlers.image_filters", "sketch_effect")                         # 圖片風格轉換功能
+emboss_effect = lazy("handlers.image_filters", "emboss_effect")
+oilPaint_effect = lazy("handlers.image_filters", "oilPaint_effect")
+blackWhite_effect = lazy("handlers.image_filters", "blackWhite_effect")
+softGlow_effect = lazy("handlers.image_filters", "softGlow_effect")
+bigEyes_effect = lazy("handlers.image_filters", "bigEyes_effect")
+get_stock_name = lazy("handlers.stock_prediction", "get_stock_name")
+iter_stock_quotes = lazy("handlers.stock_quote", "iter_stock_quotes")
+get_stock_news = lazy("handlers.stock_news", "get_stock_news")
+plot_stock_chart = lazy("handlers.stock_kchart", "plot_stock_chart")
+plot_stock_trend = lazy("handlers.stock_trend_chart", "plot_stock_trend")
+get_watchlist = lazy("handlers.stock_watchlist", "get_watchlist")
+add_watchlist = lazy("handlers.stock_watchlist", "add_watchlist")
+remove_watchlist = lazy("handlers.stock_watchlist", "remove_watchlist")
+handle_alert_command = lazy("handlers.price_alerts", "handle_alert_command")
+predict_breed = lazy("handlers.breed_classifier", "predict_breed")
+chat_with_bard = lazy("handlers.chat", "chat_with_bard")
+chat = LazyModule("handlers.chat")
 
 
 app = Flask(__name__)
 
 
-configuration = Configuration(access_token=os.getenv('ACCESS_TOKEN'))
-line_handler = WebhookHandler(os.getenv('CHANNEL_SECRET'))
-api_client = ApiClient(configuration)  
-line_bot_api = MessagingApi(api_client) 
+CHANNEL_SECRET = os.getenv('CHANNEL_SECRET')
+line_handler = WebhookHandler(CHANNEL_SECRET)
 CWA_TOKEN = os.getenv('CWA_TOKEN')
-user_state = {}
+warmup_from_env()   # 依 WARMUP_FEATURES 在背景預先載入功能模組
+
+# 關注股票報價快照（QUOTE_REFRESHER=thread 時在背景更新，模組於背景執行緒中載入）
+if os.getenv("QUOTE_REFRESHER", "off").lower() == "thread":
+    threading.Thread(target=lazy("handlers.quote_refresher", "run_forever"), name="quote-refresher", daemon=True).start()
 
 
 @app.route("/callback", methods=['POST'])
@@ -68,6 +86,21 @@ def callback():
     body = request.get_data(as_text=True)
     app.logger.info(f"Received request body: {body}")  # Debug 
 
+    # 非同步模式：驗證簽章後把事件丟給 worker，立即回應 LINE
+    if dispatcher.is_async():
+        if not line_handler.parser.signature_validator.validate(body, signature):
+            app.logger.info("Invalid signature. Please check your channel access token/channel secret.")
+            abort(400)
+
+        events = dispatcher.split_events(body, CHANNEL_SECRET)
+        if not dispatcher.reserve(len(events)):
+            # 佇列已滿：不在 request thread 上處理（會延遲回應，也可能比同一使用者較早的事件先完成），交由 LINE 重送
+            app.logger.warning("Webhook queue is full, asking LINE to redeliver.")
+            abort(503)
+        for user_key, event_body, event_signature in events:
+            dispatcher.submit(user_key, process_webhook, event_body, event_signature, request.url_root)
+        return 'OK'
+
     try:
         line_handler.handle(body, signature)
     except InvalidSignatureError:
@@ -76,11 +109,36 @@ def callback():
 
     return 'OK'
 
+
+def process_webhook(body, signature, url_root):
+    """在 worker 中處理事件（建立 request context，讓 handler 可以使用 request.url_root）"""
+    with app.test_request_context("/callback", base_url=url_root):
+        line_handler.handle(body, signature)
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """回傳背景佇列深度與延遲等統計"""
+    return jsonify({
+        "dispatcher": dispatcher.get_metrics(),
+        "market_data": call_if_loaded("handlers.market_data", "get_cache_stats", {}),
+        "model_registry": call_if_loaded("handlers.model_registry", "get_stats", {}),
+        "intent": call_if_loaded("intent_classifier", "get_intent_stats", {}),
+        "llm_cache": call_if_loaded("llm_cache", "get_stats", {}),
+        "llm": call_if_loaded("llm_gateway", "get_stats", {}),
+        "sessions": call_if_loaded("session_store", "get_stats", {}),
+        "profiles": call_if_loaded("get_username", "get_stats", {}),
+        "expense_writes": call_if_loaded("handlers.expense", "get_write_stats", {}),
+        "mysql_pool": call_if_loaded("handlers.expense", "get_pool_stats", {}),
+        "quote_refresher": call_if_loaded("handlers.quote_refresher", "get_stats", {}),
+        "imports": get_import_profile(),
+    })
+
 # 加入好友時發送歡迎訊息
 @line_handler.add(FollowEvent)
 def handler_follow(event):
     user_id = event.source.user_id  # 取得使用者 ID
-    user_name = get_line_username(user_id)  
+    user_name = refresh_line_username(user_id)  # 加入好友時更新名稱快取
     
     # 歡迎訊息
     welcome_message = TextMessage(text=(
@@ -114,9 +172,13 @@ def handle_message(event):
     user_id = event.source.user_id
     msg = str(event.message.text).strip()
     reply_messages = []
+    state = get_state(user_id) or ""
     
     # 直接讓 AI 分析（AI 會自己回應null避免誤判）
-    ai_expense_response = ai_expense.process_user_input(user_id, msg)
+    try:
+        ai_expense_response = ai_expense.process_user_input(user_id, msg)
+    except llm_gateway.LLMBusyError as e:
+        ai_expense_response = str(e)    # AI 服務忙碌（排隊逾時），直接告知使用者
     print(f"🛠 記帳 AI 回應: {ai_expense_response}")  # Debug 訊息
 
     if ai_expense_response and ai_expense_response.strip() and ai_expense_response != "null":
@@ -135,17 +197,17 @@ def handle_message(event):
 
         # 星座運勢
         elif re.match(r"^(今日星座運勢|星座|運勢)$", msg):
-            user_state[user_id] = "awaiting_zodiac"
+            set_state(user_id, "awaiting_zodiac")
             reply_messages.append(TextMessage(text="🔎請輸入您要查詢的星座名稱（如：摩羯座、獅子座）"))
 
-        elif user_id in user_state and user_state[user_id] == "awaiting_zodiac":
+        elif state == "awaiting_zodiac":
             user_zodiac = msg
             reply_text = get_horoscope_content(user_zodiac)
 
             if "⚠️ 找不到" in reply_text or "請檢查輸入的星座名稱" in reply_text:
                 reply_messages.append(TextMessage(text=f"⚠️ 查無 {user_zodiac} 星座，請重新輸入正確的星座名稱（如：魔羯座、獅子座）"))
             else:
-                del user_state[user_id]  # 正確輸入後移除狀態
+                clear_state(user_id)  # 正確輸入後移除狀態
                 reply_messages.append(TextMessage(text=reply_text))
 
         # 地震
@@ -191,13 +253,13 @@ def handle_message(event):
                 )
             )
 
-        elif user_id in user_state and user_state[user_id].startswith("awaiting_budget"):
-            period = "monthly" if "monthly" in user_state[user_id] else "weekly"
+        elif state.startswith("awaiting_budget"):
+            period = "monthly" if "monthly" in state else "weekly"
 
             if msg.isdigit():
                 response_text = set_budget(user_id, int(msg), period)
                 reply_messages.append(TextMessage(text=response_text))
-                del user_state[user_id]  # 清除狀態
+                clear_state(user_id)  # 清除狀態
             else:
                 reply_messages.append(TextMessage(text="⚠️ 請輸入有效的數字金額！"))
 
@@ -225,11 +287,19 @@ def handle_message(event):
             success_results = []  # 成功的查詢結果
             error_results = []  # 失敗的查詢結果
 
-            for stock_code in stock_codes:
+            stock_messages = {}  # 依完成順序組好訊息，最後再依輸入順序回覆
+
+            for stock_code, quote, errors in iter_stock_quotes(stock_codes):
                 try:
-                    stock_name = get_stock_name(stock_code)  # 取得中文股票名稱
-                    tech_data = get_technical_indicators(stock_code)  # 取得技術指標
-                    predicted_price = predict_stock_price(stock_code)  # 預測股價
+                    # 名稱或技術指標失敗才視為代碼錯誤；只有預測失敗時照常顯示其他資料
+                    if "name" in errors or "tech" in errors:
+                        raise RuntimeError(errors.get("name") or errors.get("tech"))
+
+                    stock_name = quote["name"]  # 取得中文股票名稱
+                    tech_data = quote["tech"]  # 取得技術指標
+                    predicted_price = quote["prediction"]  # 預測股價
+                    if "prediction" in errors:
+                        predicted_price = "查詢逾時" if errors["prediction"] == "查詢逾時" else "暫時無法預測"
 
                     if "error" in tech_data:
                         error_results.append(f"⚠️ {stock_code} 查詢失敗：{tech_data['error']}")
@@ -238,7 +308,10 @@ def handle_message(event):
                     # 組合技術指標
                     stock_result = f"🔹 {stock_code} {stock_name}\n"
                     stock_result += f"📌 最新股價：{tech_data['latest_price']} 元\n"
-                    stock_result += f"📈 預測股價：{predicted_price:.2f} 元\n"
+                    if isinstance(predicted_price, str):  # 尚無模型或非交易日無預測數據
+                        stock_result += f"📈 預測股價：{predicted_price}\n"
+                    else:
+                        stock_result += f"📈 預測股價：{predicted_price:.2f} 元\n"
                     stock_result += f"——————————————\n"
 
                     # 技術指標訊號
@@ -246,11 +319,13 @@ def handle_message(event):
 
                     # 添加Quick Reply
                     quick_reply = stock_quickReply(stock_code, stock_name)
-                    success_results.append(TextMessage(text=stock_result, quick_reply=quick_reply))
+                    stock_messages[stock_code] = TextMessage(text=stock_result, quick_reply=quick_reply)
 
                 except Exception as e:
                     error_results.append(f"⚠️ {stock_code} 查詢失敗，請輸入正確股票代碼")
 
+            success_results = [stock_messages[code] for code in dict.fromkeys(stock_codes) if code in stock_messages]
+
             # 確保回應
             if success_results:
                 reply_messages.extend(success_results)  # 讓多支股票的結果分開顯示
@@ -269,10 +344,17 @@ def handle_message(event):
             reply_messages = []
             reply_messages.append(TextMessage(text=response))
 
+        # 到價提醒：提醒 2330 > 600 / 取消提醒 2330 / 查詢提醒
+        elif re.match(r"^(提醒\s*\d{4,6}|取消提醒\s*\d{0,6}$|查詢提醒$|我的提醒$)", msg):
+            reply_messages.append(TextMessage(text=handle_alert_command(user_id, msg)))
+
         # 如果沒有匹配到任何已知指令，則使用Gemini
         else:
-            bard_reply = chat_with_bard(msg)                    # 呼叫 Google Bard
-            reply_messages.append(TextMessage(text=bard_reply))
+            if chat.CHAT_REPLY_MODE == "stream":
+                reply_chat_stream(event, msg)                   # 串流回答：先回覆第一段，其餘推播
+                return
+            reply_chat_full(event, chat_with_bard(msg))         # 呼叫 Google Bard，超過 5 段的部分以推播補送
+            return
                     
     # 統一回應所有訊息
     if reply_messages:
@@ -283,6 +365,54 @@ def handle_message(event):
             )
         )
 
+def push_messages(event, messages):
+    """推播到原本的對話（群組 / 聊天室 / 個人），每次請求最多 5 則；失敗時回傳 False"""
+    source = event.source
+    push_to = getattr(source, "group_id", None) or getattr(source, "room_id", None) or source.user_id
+    for start in range(0, len(messages), chat.LINE_MESSAGES_LIMIT):
+        try:
+            line_bot_api.push_message(
+                PushMessageRequest(to=push_to, messages=messages[start:start + chat.LINE_MESSAGES_LIMIT])
+            )
+        except Exception as e:
+            print(f"❌ 推播 Gemini 回答失敗: {e}")
+            return False
+    return True
+
+def reply_chat_full(event, text):
+    """完整 Gemini 回答：前 5 段用 reply token 回覆，其餘段落以推播補送（不會截掉長回答）"""
+    messages = [TextMessage(text=segment) for segment in chat.split_text(text)]
+    if not messages:
+        return
+    line_bot_api.reply_message(
+        ReplyMessageRequest(reply_token=event.reply_token, messages=messages[:chat.LINE_MESSAGES_LIMIT])
+    )
+    push_messages(event, messages[chat.LINE_MESSAGES_LIMIT:])
+
+def reply_chat_stream(event, user_input):
+    """
+    串流 Gemini 回答：第一段用 reply token 盡快回覆（避免逾時），之後的段落累積起來推播，
+    滿 5 則、或新段落產生時最早的段落已等待超過 CHAT_PUSH_MAX_DELAY 秒就送出，回答結束時送出剩餘段落，減少推播次數
+    """
+    segments = chat.stream_chat(user_input)
+    first = next(segments, None)
+    if first is None:
+        return
+    line_bot_api.reply_message(
+        ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=first)])
+    )
+
+    pending, oldest = [], None
+    for segment in segments:
+        pending.append(TextMessage(text=segment))
+        oldest = oldest or time.monotonic()
+        if len(pending) >= chat.LINE_MESSAGES_LIMIT or time.monotonic() - oldest >= chat.CHAT_PUSH_MAX_DELAY:
+            if not push_messages(event, pending):
+                segments.close()
+                return
+            pending, oldest = [], None
+    push_messages(event, pending)
+
 #=================================================================================================圖片處理
 #=================================================================================================圖片處理
 @line_handler.add(MessageEvent, message=ImageMessageContent)
@@ -358,8 +488,8 @@ def handle_location(event):
     else:
         reply_messages = [TextMessage(text="❌ 無法獲取您的位置資訊，請再試一次")]
     
-    if user_id in user_state and user_state[user_id] == "awaiting_location":
-        del user_state[user_id]
+    if get_state(user_id) == "awaiting_location":
+        clear_state(user_id)
 
     line_bot_api.reply_message(
         ReplyMessageRequest(
@@ -387,11 +517,11 @@ def handle_postback(event):
         reply_messages.append(ImageMessage(original_content_url=image_url, preview_image_url=image_url))
 
     elif postback_data == "查詢今日星座運勢":
-        user_state[user_id] = "awaiting_zodiac"  # ✅ 設定用戶狀態，等待輸入星座
+        set_state(user_id, "awaiting_zodiac")  # ✅ 設定用戶狀態，等待輸入星座
         reply_messages.append(TextMessage(text="🔎請輸入您要查詢的星座名稱（如：摩羯座、獅子座）"))
 
     elif postback_data == "查詢目前天氣資訊":
-        user_state[user_id] = "awaiting_location"  # ✅ 設定狀態，等待用戶提供位置信息
+        set_state(user_id, "awaiting_location")  # ✅ 設定狀態，等待用戶提供位置信息
         reply_messages.append(TextMessage(text="📍 請傳送您的 位置資訊，我會告訴你現在的天氣！ 🌦"))
 
     # 選擇 ConfirmTemplate 收入/支出
@@ -450,7 +580,7 @@ def handle_postback(event):
         # 設定預算功能
         elif postback_data in ["設定月預算", "設定週預算"]:
             period = "monthly" if postback_data == "設定月預算" else "weekly"
-            user_state[user_id] = f"awaiting_budget_{period}"
+            set_state(user_id, f"awaiting_budget_{period}")
             reply_messages.append(TextMessage(text=f"💰 請輸入你的{postback_data}金額，例如：5000"))
 
     # 查詢關注股票清單
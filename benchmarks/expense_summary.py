@@ -0,0 +1,109 @@
+"""
+記帳摘要查詢：每次請求的資料庫來回次數與延遲
+
+比較舊流程（GROUP BY + SUM 兩次查詢 expenses，再用另一個連線查 budgets）
+與 get_expense_summary（一個連線、一個 SQL）
+
+使用方式（需要 MYSQL_* 環境變數，並已執行 python -m handlers.expense --backfill）：
+    python -m benchmarks.expense_summary <user_id> [--runs 50]
+"""
+import time
+import argparse
+import statistics
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from handlers import expense
+
+
+class CountingCursor:
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter["statements"] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+
+class CountingConnection:
+    def __init__(self, conn, counter):
+        self._conn = conn
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def __getattr__(self, attr):
+        return getattr(self._conn, attr)
+
+
+def legacy_weekly_summary(user_id):
+    """舊流程：expenses 上兩次彙總查詢 + 另一個連線查預算"""
+    monday = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
+    params = (monday, user_id, "支出")
+    with expense.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT category, SUM(amount) FROM expenses WHERE DATE(date) >= %s AND user_id = %s AND type = %s GROUP BY category",
+            params
+        )
+        records = cursor.fetchall()
+        cursor.execute("SELECT SUM(amount) FROM expenses WHERE DATE(date) >= %s AND user_id = %s AND type = %s", params)
+        total = cursor.fetchone()[0]
+    with expense.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT amount, period FROM budgets WHERE user_id = %s AND period = %s", (user_id, "weekly"))
+        budgets = cursor.fetchall()
+    return records, total, budgets
+
+
+def summary_weekly(user_id):
+    return expense.get_expense_summary(user_id, "week", "支出")
+
+
+def measure(func, user_id, runs):
+    """執行 runs 次，回傳每次請求的連線數、SQL 數與延遲"""
+    counter = {"connections": 0, "statements": 0}
+    original = expense.get_db_connection
+
+    @contextmanager
+    def counting_connection():
+        counter["connections"] += 1
+        with original() as conn:
+            yield CountingConnection(conn, counter)
+
+    expense.get_db_connection = counting_connection
+    latencies = []
+    try:
+        func(user_id)   # 暖機（建立連線池）
+        counter.update(connections=0, statements=0)
+        for _ in range(runs):
+            started = time.perf_counter()
+            func(user_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        expense.get_db_connection = original
+
+    latencies.sort()
+    return {
+        "connections": counter["connections"] / runs,
+        "statements": counter["statements"] / runs,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[max(0, int(runs * 0.95) - 1)],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較記帳摘要查詢的來回次數與延遲")
+    parser.add_argument("user_id", help="要查詢的 LINE user_id")
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"📊 本週支出摘要（{args.runs} 次）")
+    for name, func in (("舊流程", legacy_weekly_summary), ("get_expense_summary", summary_weekly)):
+        stats = measure(func, args.user_id, args.runs)
+        print(f"   {name:<20} 連線 {stats['connections']:.0f}  SQL {stats['statements']:.0f}  "
+              f"p50 {stats['p50_ms']:.1f} ms  p95 {stats['p95_ms']:.1f} ms")
@@ -0,0 +1,49 @@
+"""
+關注清單報價：逐檔 yf.Ticker().history 與一次 yf.download 批次下載的耗時比較
+
+使用方式（需要網路）：
+    python -m benchmarks.watchlist_quotes [--sizes 1 10 50]
+"""
+import time
+import argparse
+import yfinance as yf
+from handlers import market_data
+from handlers.stock_watchlist import get_stockdata_bulk
+
+# 上市股票代碼（依市值排序，取前 N 檔測試）
+SAMPLE_CODES = [
+    "2330", "2317", "2454", "2308", "2382", "2881", "2412", "2882", "2891", "3711",
+    "2303", "2886", "2884", "1216", "2885", "2892", "3231", "2357", "2002", "2880",
+    "5880", "1303", "2887", "2890", "3045", "2883", "2345", "2207", "1301", "2912",
+    "2603", "4904", "2395", "1326", "3034", "2379", "6505", "5871", "2327", "3008",
+    "2801", "1101", "2609", "2301", "4938", "2408", "2615", "9910", "2376", "1590",
+]
+
+
+def per_ticker(codes):
+    """舊流程：每檔一次 HTTP 請求"""
+    for code in codes:
+        yf.Ticker(f"{code}.TW").history(period="6d")
+
+
+def bulk(codes):
+    """新流程：清空快取後以一次 yf.download 取得並計算所有股票"""
+    with market_data._cache_lock:
+        market_data._cache.clear()
+    get_stockdata_bulk(codes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較關注清單逐檔與批次下載的耗時")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    print("📊 關注清單報價耗時")
+    for size in args.sizes:
+        codes = SAMPLE_CODES[:size]
+        results = {}
+        for name, func in (("逐檔 history", per_ticker), ("批次 download", bulk)):
+            started = time.perf_counter()
+            func(codes)
+            results[name] = time.perf_counter() - started
+        print(f"   {size:>3} 檔  " + "  ".join(f"{name} {seconds:.2f} 秒" for name, seconds in results.items()))
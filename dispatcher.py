@@ -0,0 +1,168 @@
+"""
+Webhook 非同步分派：/callback 驗證簽章後立即回 200，事件交給背景 worker 處理
+
+- WEBHOOK_DISPATCH_MODE：sync（預設，維持原本同步處理）/ thread
+- WEBHOOK_WORKERS：worker 數量（每個 worker 為單一執行緒，同一使用者固定分到同一個 worker，確保處理順序）
+- 只提供執行緒 worker：模型、股價快取、LLM 同時呼叫數與 token 預算、session、記帳批次寫入都是行程內共用的狀態，
+  分到多個行程後就不再共用（/metrics 也只看得到主行程）；需要多核心時以 gunicorn 多個 worker 行程搭配 SESSION_BACKEND=redis
+- WEBHOOK_QUEUE_SIZE：等待中事件上限；佇列已滿時最多等待 WEBHOOK_QUEUE_WAIT 秒，仍滿載則回 503，
+  由 LINE 重送（需在 LINE Developers 開啟 Webhook redelivery），不在 request thread 上處理，以免延遲回應與打亂同一使用者的順序
+"""
+import os
+import json
+import time
+import zlib
+import hmac
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DISPATCH_MODE = os.getenv("WEBHOOK_DISPATCH_MODE", "sync").lower()
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+QUEUE_WAIT = float(os.getenv("WEBHOOK_QUEUE_WAIT", "1"))
+
+if DISPATCH_MODE == "process":
+    print("⚠️ WEBHOOK_DISPATCH_MODE=process 已不支援（各行程無法共用快取、模型與 LLM 額度），改用 thread")
+    DISPATCH_MODE = "thread"
+
+_lanes = []                      # 每條 lane 只有一個 worker，同一使用者的事件依序執行
+_lock = threading.Lock()
+_not_full = threading.Condition(_lock)
+_metrics = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "rejected": 0,               # 佇列持續滿載、回 503 讓 LINE 重送的 webhook 數
+    "queue_depth": 0,
+    "max_queue_depth": 0,
+    "total_wait_ms": 0.0,        # 進佇列 → 開始處理
+    "max_wait_ms": 0.0,
+    "total_run_ms": 0.0,         # 實際處理時間
+    "max_run_ms": 0.0,
+}
+
+
+def is_async():
+    """是否啟用非同步分派"""
+    return DISPATCH_MODE == "thread"
+
+
+def _init_lanes():
+    """建立 worker（第一次送出事件時才建立，避免 import 時就開執行緒）"""
+    if _lanes:
+        return
+    for i in range(max(WORKERS, 1)):
+        _lanes.append(ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"webhook-{i}"))
+
+
+def split_events(body, channel_secret):
+    """
+    將 webhook body 拆成「一個事件一份」的 body，並以 channel secret 重新簽章，
+    讓 worker 可以直接交給 WebhookHandler.handle 處理
+    :return: [(user_key, event_body, event_signature), ...]
+    """
+    payload = json.loads(body)
+    results = []
+    for event in payload.get("events", []):
+        source = event.get("source", {})
+        user_key = source.get("userId") or source.get("groupId") or source.get("roomId") or ""
+        event_body = json.dumps({"destination": payload.get("destination"), "events": [event]}, ensure_ascii=False)
+        digest = hmac.new(channel_secret.encode("utf-8"), event_body.encode("utf-8"), hashlib.sha256).digest()
+        results.append((user_key, event_body, base64.b64encode(digest).decode("utf-8")))
+    return results
+
+
+def _run_timed(func, args):
+    """在 worker 內執行並回傳 (開始時間, 結束時間, 錯誤訊息)"""
+    started_at = time.time()
+    error = None
+    try:
+        func(*args)
+    except Exception as e:
+        error = str(e)
+    return started_at, time.time(), error
+
+
+def _on_done(future, enqueued_at):
+    """事件處理完成後更新統計"""
+    try:
+        started_at, finished_at, error = future.result()
+    except Exception as e:  # 例如行程異常結束
+        started_at = finished_at = time.time()
+        error = str(e)
+
+    if error:
+        print(f"❌ 背景處理事件失敗: {error}")
+
+    wait_ms = max(started_at - enqueued_at, 0) * 1000
+    run_ms = (finished_at - started_at) * 1000
+    with _lock:
+        _metrics["queue_depth"] -= 1
+        _metrics["failed" if error else "completed"] += 1
+        _metrics["total_wait_ms"] += wait_ms
+        _metrics["total_run_ms"] += run_ms
+        _metrics["max_wait_ms"] = max(_metrics["max_wait_ms"], wait_ms)
+        _metrics["max_run_ms"] = max(_metrics["max_run_ms"], run_ms)
+        _not_full.notify_all()
+
+
+def reserve(count):
+    """
+    為同一個 webhook 的所有事件一次保留佇列位置（全部排入或全部不排入，避免 LINE 重送時重複處理）
+    佇列已滿時最多等待 QUEUE_WAIT 秒
+    :return: True 表示已保留，接著對每個事件呼叫 submit；False 表示佇列持續滿載，呼叫端應回 503
+    """
+    deadline = time.monotonic() + QUEUE_WAIT
+    with _not_full:
+        # 單一 webhook 的事件數超過 QUEUE_SIZE 時，等佇列清空後仍可排入
+        while _metrics["queue_depth"] > 0 and _metrics["queue_depth"] + count > QUEUE_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _metrics["rejected"] += 1
+                return False
+            _not_full.wait(remaining)
+        _metrics["queue_depth"] += count
+        _metrics["max_queue_depth"] = max(_metrics["max_queue_depth"], _metrics["queue_depth"])
+    return True
+
+
+def submit(user_key, func, *args):
+    """
+    將事件送進對應使用者的 worker（需先以 reserve 保留位置）
+    :return: True 表示已排入佇列；False 表示 worker 無法接受工作（已記為失敗）
+    """
+    with _lock:
+        _init_lanes()
+        _metrics["submitted"] += 1
+
+    lane = _lanes[zlib.crc32(user_key.encode("utf-8")) % len(_lanes)]
+    enqueued_at = time.time()
+    try:
+        future = lane.submit(_run_timed, func, args)
+    except Exception as e:
+        print(f"❌ 無法送出背景工作: {e}")
+        with _not_full:
+            _metrics["queue_depth"] -= 1
+            _metrics["failed"] += 1
+            _not_full.notify_all()
+        return False
+    future.add_done_callback(lambda f: _on_done(f, enqueued_at))
+    return True
+
+
+def get_metrics():
+    """回傳佇列深度與延遲統計"""
+    with _lock:
+        metrics = dict(_metrics)
+    finished = metrics["completed"] + metrics["failed"]
+    metrics["mode"] = DISPATCH_MODE
+    metrics["workers"] = WORKERS
+    metrics["queue_size"] = QUEUE_SIZE
+    metrics["queue_wait_s"] = QUEUE_WAIT
+    metrics["avg_wait_ms"] = round(metrics.pop("total_wait_ms") / finished, 2) if finished else 0.0
+    metrics["avg_run_ms"] = round(metrics.pop("total_run_ms") / finished, 2) if finished else 0.0
+    metrics["max_wait_ms"] = round(metrics["max_wait_ms"], 2)
+    metrics["max_run_ms"] = round(metrics["max_run_ms"], 2)
+    return metrics
@@ -0,0 +1,86 @@
+"""
+將 Keras 模型匯出為 TFLite，並比較兩種推論後端的冷啟動成本
+
+使用方式：
+    python export_models.py                 # 匯出 models/ 下所有使用中的 LSTM 模型與貓狗品種模型
+    python export_models.py models/2330_lstm_model.h5
+    python export_models.py --benchmark     # 比較 keras / tflite 的 import + 載入時間與記憶體（RSS）
+
+匯出後設定 INFERENCE_BACKEND=tflite 即可使用 TFLite 推論
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import subprocess
+from handlers.inference_backend import export_tflite, get_tflite_path
+
+BREED_MODEL_PATH = "dog_cat_breeds_resnet50v2.h5"
+
+# 在全新的子行程中量測：import 後端 + 載入模型的時間，以及最高 RSS
+BENCHMARK_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+from handlers.inference_backend import load_model
+model = load_model(sys.argv[1])
+elapsed = time.perf_counter() - started
+try:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:  # Windows 沒有 resource 模組
+    rss_mb = None
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb, "type": type(model).__name__}))
+"""
+
+
+def get_default_models():
+    """使用中的 LSTM 模型（不含版本檔）與貓狗品種模型"""
+    paths = sorted(glob.glob("models/*_lstm_model.h5"))
+    if os.path.exists(BREED_MODEL_PATH):
+        paths.append(BREED_MODEL_PATH)
+    return paths
+
+
+def export_all(model_paths):
+    for model_path in model_paths:
+        try:
+            tflite_path = export_tflite(model_path)
+            size_mb = os.path.getsize(tflite_path) / 1024 / 1024
+            print(f"✅ {model_path} → {tflite_path}（{size_mb:.1f} MB）")
+        except Exception as e:
+            print(f"❌ {model_path} 匯出失敗：{e}")
+
+
+def benchmark(model_paths):
+    """分別以 keras / tflite 後端在子行程中載入模型，比較冷啟動時間與記憶體"""
+    for model_path in model_paths:
+        print(f"📊 {model_path}")
+        for backend in ("keras", "tflite"):
+            if backend == "tflite" and not os.path.exists(get_tflite_path(model_path)):
+                print(f"   {backend:<7} 尚未匯出 .tflite，略過")
+                continue
+
+            env = dict(os.environ, INFERENCE_BACKEND=backend, TF_CPP_MIN_LOG_LEVEL="3")
+            result = subprocess.run([sys.executable, "-c", BENCHMARK_SCRIPT, model_path],
+                                    env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"   {backend:<7} 失敗：{result.stderr.strip().splitlines()[-1:]}")
+                continue
+
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            rss = f"{stats['rss_mb']:.0f} MB" if stats["rss_mb"] is not None else "N/A"
+            print(f"   {backend:<7} {stats['seconds']:.2f} 秒  RSS {rss}  ({stats['type']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="匯出 TFLite 模型並比較冷啟動成本")
+    parser.add_argument("models", nargs="*", help="要匯出的 .h5 模型（預設為所有使用中的模型）")
+    parser.add_argument("--benchmark", action="store_true", help="比較 keras / tflite 的載入時間與記憶體")
+    args = parser.parse_args()
+
+    paths = args.models or get_default_models()
+    if args.benchmark:
+        benchmark(paths)
+    else:
+        export_all(paths)
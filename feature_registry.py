@@ -0,0 +1,145 @@
+"""
+功能模組延遲載入：app.py 啟動時不 import 任何功能模組（TensorFlow、mediapipe、OpenCV、jieba、
+wordcloud、mplfinance、資料庫連線、貓狗品種模型...），第一次用到時才載入
+
+- WARMUP_FEATURES：啟動後在背景執行緒預先載入的模組，以逗號分隔，或填 all 載入全部
+- get_import_profile()：各模組實際載入耗時（/metrics 會顯示）
+
+量測每個模組單獨載入的耗時：
+    python feature_registry.py
+"""
+import os
+import sys
+import time
+import importlib
+import threading
+import subprocess
+
+# app.py 會用到的功能模組
+FEATURES = [
+    "ai_expense",
+    "handlers.news",
+    "handlers.news_wordcloud",
+    "handlers.horoscope",
+    "handlers.earthquake",
+    "handlers.weather",
+    "handlers.expense",
+    "handlers.image_utils",
+    "handlers.image_filters",
+    "handlers.stock_prediction",
+    "handlers.stock_quote",
+    "handlers.stock_news",
+    "handlers.stock_kchart",
+    "handlers.stock_trend_chart",
+    "handlers.stock_watchlist",
+    "handlers.breed_classifier",
+    "handlers.chat",
+    "cv2",
+]
+WARMUP_FEATURES = os.getenv("WARMUP_FEATURES", "")
+
+_lock = threading.Lock()
+_import_profile = {}        # module_name -> {"seconds", "thread", "error"}
+
+
+def get_feature(module_name):
+    """取得功能模組，第一次呼叫時才 import 並記錄耗時"""
+    module = sys.modules.get(module_name)
+    if module is not None and module_name in _import_profile:
+        return module
+
+    started = time.perf_counter()
+    try:
+        module = importlib.import_module(module_name)
+        error = None
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        with _lock:
+            if module_name not in _import_profile or _import_profile[module_name]["error"]:
+                _import_profile[module_name] = {
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "thread": threading.current_thread().name,
+                    "error": error,
+                }
+    return module
+
+
+class LazyModule:
+    """存取屬性時才載入模組，例如 cv2 = LazyModule("cv2")"""
+
+    def __init__(self, module_name):
+        self._module_name = module_name
+
+    def __getattr__(self, attr):
+        return getattr(get_feature(self._module_name), attr)
+
+
+def lazy(module_name, attr):
+    """延遲載入的函式：呼叫時才載入模組並轉呼叫"""
+    def wrapper(*args, **kwargs):
+        return getattr(get_feature(module_name), attr)(*args, **kwargs)
+    wrapper.__name__ = attr
+    wrapper.__qualname__ = f"{module_name}.{attr}"
+    return wrapper
+
+
+def call_if_loaded(module_name, attr, default=None):
+    """模組已載入時才呼叫（例如 /metrics 不應該為了統計而載入重量級模組）"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        return default
+    return getattr(module, attr)()
+
+
+def warmup(module_names=None):
+    """在背景執行緒依序預先載入模組（模型也會一併載入）"""
+    module_names = module_names or FEATURES
+
+    def run():
+        for module_name in module_names:
+            try:
+                get_feature(module_name)
+            except Exception as e:
+                print(f"⚠️ 預先載入 {module_name} 失敗: {e}")
+        print(f"🔥 預先載入完成：{', '.join(module_names)}")
+
+    thread = threading.Thread(target=run, name="feature-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def warmup_from_env():
+    """依 WARMUP_FEATURES 設定啟動背景預先載入"""
+    if not WARMUP_FEATURES:
+        return None
+    if WARMUP_FEATURES.strip().lower() == "all":
+        return warmup(FEATURES)
+    return warmup([name.strip() for name in WARMUP_FEATURES.split(",") if name.strip()])
+
+
+def get_import_profile():
+    """回傳已載入模組的耗時（由慢到快）"""
+    with _lock:
+        profile = dict(_import_profile)
+    return dict(sorted(profile.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+
+def profile_imports(module_names=None):
+    """每個模組在全新的子行程中單獨 import，量測冷啟動耗時"""
+    results = {}
+    for module_name in ["app"] + list(module_names or FEATURES):
+        script = f"import time; t = time.perf_counter(); import {module_name}; print(time.perf_counter() - t)"
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+        if result.returncode == 0:
+            results[module_name] = float(result.stdout.strip().splitlines()[-1])
+        else:
+            results[module_name] = None
+    return results
+
+
+if __name__ == "__main__":
+    print("📊 各模組冷啟動 import 耗時：")
+    for module_name, seconds in sorted(profile_imports().items(), key=lambda item: -(item[1] or 0)):
+        print(f"   {module_name:<28} {f'{seconds:.2f} 秒' if seconds is not None else '載入失敗'}")
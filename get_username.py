@@ -1,24 +1,109 @@
 """
 取得使用者 LINE 名稱
+
+- 名稱快取在記憶體中（LRU + TTL），記帳、加入關注股票時不必每次呼叫 get_profile
+- PROFILE_CACHE_PATH：設定時另外存到 SQLite，重啟後或多個 worker 之間也能沿用
+- 加入好友（FollowEvent）時以 refresh_line_username 重新取得最新名稱
+- 所有模組共用同一個 ApiClient / MessagingApi（app.py 也使用這裡的 line_bot_api）
 """
 import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
 from linebot.v3.messaging import ApiClient, MessagingApi, Configuration
 
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", str(7 * 24 * 3600)))
+PROFILE_CACHE_MAX_USERS = int(os.getenv("PROFILE_CACHE_MAX_USERS", "10000"))
+PROFILE_CACHE_PATH = os.getenv("PROFILE_CACHE_PATH", "")
+
 configuration = Configuration(access_token=os.getenv('ACCESS_TOKEN'))
+api_client = ApiClient(configuration)
+line_bot_api = MessagingApi(api_client)
 
-def get_line_username(user_id):
+_names = OrderedDict()          # user_id -> (expires_at, display_name)
+_lock = threading.Lock()
+_stats = {"hits": 0, "db_hits": 0, "api_calls": 0, "api_errors": 0}
+_db = None
+
+
+def _get_db():
+    """SQLite 永久快取（未設定 PROFILE_CACHE_PATH 時不使用）"""
+    global _db
+    if _db is None and PROFILE_CACHE_PATH:
+        _db = sqlite3.connect(PROFILE_CACHE_PATH, check_same_thread=False, timeout=5)
+        _db.execute("CREATE TABLE IF NOT EXISTS line_profiles (user_id TEXT PRIMARY KEY, display_name TEXT, expires_at REAL)")
+        _db.commit()
+    return _db
+
+
+def _remember(user_id, display_name, expires_at):
+    """寫入記憶體快取（呼叫時需持有 _lock）"""
+    _names[user_id] = (expires_at, display_name)
+    _names.move_to_end(user_id)
+    while len(_names) > PROFILE_CACHE_MAX_USERS:
+        _names.popitem(last=False)
+
+
+def _cached_name(user_id):
+    now = time.time()
+    with _lock:
+        item = _names.get(user_id)
+        if item and item[0] > now:
+            _names.move_to_end(user_id)
+            _stats["hits"] += 1
+            return item[1]
+
+        db = _get_db()
+        if db is not None:
+            row = db.execute(
+                "SELECT display_name, expires_at FROM line_profiles WHERE user_id = ? AND expires_at > ?", (user_id, now)
+            ).fetchone()
+            if row:
+                _remember(user_id, row[0], row[1])
+                _stats["db_hits"] += 1
+                return row[0]
+    return None
+
+
+def _store_name(user_id, display_name):
+    expires_at = time.time() + PROFILE_CACHE_TTL
+    with _lock:
+        _remember(user_id, display_name, expires_at)
+        db = _get_db()
+        if db is not None:
+            db.execute("INSERT OR REPLACE INTO line_profiles (user_id, display_name, expires_at) VALUES (?, ?, ?)",
+                       (user_id, display_name, expires_at))
+            db.commit()
+
+
+def refresh_line_username(user_id):
     """
-    透過 Line Messaging API 獲取用戶名稱
+    透過 Line Messaging API 獲取用戶名稱，並更新快取
     """
     try:
-        # 確保 API 物件正確初始化
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-
-            # 取得用戶資料
-            profile = line_bot_api.get_profile(user_id)
-            return profile.display_name  # 回傳用戶名稱
+        with _lock:
+            _stats["api_calls"] += 1
+        profile = line_bot_api.get_profile(user_id)
+        _store_name(user_id, profile.display_name)
+        return profile.display_name  # 回傳用戶名稱
 
     except Exception as e:
-        print(f"❌ 獲取用戶名稱失敗: {e}") 
-        return f"UnknownUser-{user_id[:6]}"  # 如果 API 失敗，回傳部分 user_id 以避免資料混亂
+        with _lock:
+            _stats["api_errors"] += 1
+        print(f"❌ 獲取用戶名稱失敗: {e}")
+        return f"UnknownUser-{user_id[:6]}"  # 如果 API 失敗，回傳部分 user_id 以避免資料混亂（不快取，下次重試）
+
+
+def get_line_username(user_id):
+    """
+    取得用戶名稱：優先使用快取，沒有或過期時才呼叫 API
+    """
+    return _cached_name(user_id) or refresh_line_username(user_id)
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["cached_users"] = len(_names)
+    return stats
@@ -2,11 +2,10 @@
 
 import os
 import numpy as np
-import tensorflow as tf
 import json
 import gdown
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.models import load_model
+from PIL import Image
+from handlers.inference_backend import load_model, get_tflite_path, INFERENCE_BACKEND   # 依 INFERENCE_BACKEND 使用 Keras 或 TFLite
 
 # 設定基礎路徑
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))  
@@ -18,14 +17,14 @@ TRANSLATION_PATH = os.path.join(BASE_DIR, "breeds_translation.json")
 GDRIVE_MODEL_ID = os.getenv("GDRIVE_MODEL_ID")
 GDRIVE_URL = f"https://drive.google.com/uc?id={GDRIVE_MODEL_ID}"
 
-# 確保模型檔案存在
-if not os.path.exists(MODEL_PATH):
+# 確保模型檔案存在（tflite 模式且已匯出 .tflite 時不需要 .h5）
+if not os.path.exists(MODEL_PATH) and not (INFERENCE_BACKEND == "tflite" and os.path.exists(get_tflite_path(MODEL_PATH))):
     print(f"⚠️ 模型檔案找不到！正在從 Google Drive 下載...")
     gdown.download(GDRIVE_URL, MODEL_PATH, quiet=False)
     print(f"✅ 下載完成！模型已儲存至：{MODEL_PATH}")
     
 # 載入訓練好的模型
-model = load_model(MODEL_PATH, compile=False)
+model = load_model(MODEL_PATH)
 
 # 載入品種名稱
 try:
@@ -47,8 +46,8 @@ except FileNotFoundError:
 # 處理用戶傳來的圖片
 def preprocess_image(img_path):
     """ 處理圖片，調整大小至 (224, 224) 並正規化 """
-    img = image.load_img(img_path, target_size=(224, 224))  # 轉換大小
-    img_array = image.img_to_array(img)  # 轉為數組
+    img = Image.open(img_path).convert("RGB").resize((224, 224), Image.NEAREST)  # 轉換大小（與 Keras load_img 相同的插值方式）
+    img_array = np.asarray(img, dtype=np.float32)  # 轉為數組
     img_array = np.expand_dims(img_array, axis=0)  # 增加批次維度
     img_array = img_array / 255.0  # 標準化
     return img_array
@@ -1,18 +1,106 @@
 """Google Bard 回應用戶輸入其它問題"""
 
-import google.generativeai as genai
 import os
+import re
+import llm_cache
+import llm_gateway
 
+# full：等完整回答後一次回覆（預設）/ stream：串流回答，先回覆第一段，其餘以推播送出
+CHAT_REPLY_MODE = os.getenv("CHAT_REPLY_MODE", "full").lower()
+CHAT_FIRST_SEGMENT_CHARS = int(os.getenv("CHAT_FIRST_SEGMENT_CHARS", "100"))     # 第一段累積到這個長度就先回覆
+CHAT_SEGMENT_CHARS = int(os.getenv("CHAT_SEGMENT_CHARS", "1000"))                # 之後每段的最小長度（減少推播次數）
+CHAT_PUSH_MAX_DELAY = float(os.getenv("CHAT_PUSH_MAX_DELAY", "3"))             # 串流時累積的段落最多等幾秒就推播
+LINE_TEXT_LIMIT = 5000                                                           # LINE 單則文字訊息上限
+LINE_MESSAGES_LIMIT = 5                                                          # LINE 每次回覆 / 推播最多 5 則訊息
+ERROR_REPLY = "❌ 抱歉，我現在無法回應您的問題。"
+GOOGLE_API_KEY2 = os.getenv('GOOGLE_API_KEY2')                                   # 聊天使用自己的金鑰（未設定時使用 GOOGLE_API_KEY）
+
+SENTENCE_END = re.compile(r"[。！？!?\n]")
 
-# 設定 Google Gemini API
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY2'))
 
 def chat_with_bard(user_input):
     """使用 Google Gemini 1.5 Pro 回應用戶問題"""
+    # 相同的問題（正規化後）直接使用快取的回答
+    cache_key = llm_cache.normalize_text(user_input)
+    cached = llm_cache.lookup("chat", cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        response = model.generate_content(user_input)
-        return response.text.strip() if response and hasattr(response, 'text') else "❌ 抱歉，我現在無法回應您的問題。"
+        reply = llm_gateway.generate(user_input, api_key=GOOGLE_API_KEY2)
+        if not reply:
+            return ERROR_REPLY
+        llm_cache.store("chat", cache_key, reply)
+        return reply
+    except llm_gateway.LLMBusyError as e:
+        return str(e)
     except Exception as e:
         print(f"Google Bard API 錯誤: {e}")
-        return "❌ 抱歉，我現在無法回應您的問題。"
+        return ERROR_REPLY
+
+
+def _cut_position(buffer, min_chars):
+    """
+    找出可以送出的位置：累積超過 min_chars 後在最後一個句尾切開，
+    超過 LINE 上限時直接切在上限
+    """
+    if len(buffer) >= LINE_TEXT_LIMIT:
+        ends = [m.end() for m in SENTENCE_END.finditer(buffer, 0, LINE_TEXT_LIMIT)]
+        return ends[-1] if ends and ends[-1] >= min_chars else LINE_TEXT_LIMIT
+    if len(buffer) < min_chars:
+        return None
+    ends = [m.end() for m in SENTENCE_END.finditer(buffer)]
+    return ends[-1] if ends and ends[-1] >= min_chars else None
+
+
+def split_text(text):
+    """將長文字切成不超過 LINE 上限的段落（盡量切在句尾）"""
+    segments = []
+    while text:
+        cut = _cut_position(text, 1) if len(text) > LINE_TEXT_LIMIT else len(text)
+        segments.append(text[:cut].strip())
+        text = text[cut:]
+    return [segment for segment in segments if segment]
+
+
+def stream_chat(user_input):
+    """
+    串流版的 chat_with_bard：邊產生邊回傳可以直接送出的段落
+    第一段盡快送出，之後每段至少 CHAT_SEGMENT_CHARS 字，且不超過 LINE 單則訊息上限
+    """
+    cache_key = llm_cache.normalize_text(user_input)
+    cached = llm_cache.lookup("chat", cache_key)
+    if cached is not None:
+        yield from split_text(cached)
+        return
+
+    full_text, buffer, sent = "", "", 0
+    min_chars = CHAT_FIRST_SEGMENT_CHARS
+    try:
+        for chunk in llm_gateway.stream(user_input, api_key=GOOGLE_API_KEY2):
+            full_text += chunk
+            buffer += chunk
+            cut = _cut_position(buffer, min_chars)
+            while cut:
+                segment, buffer = buffer[:cut].strip(), buffer[cut:]
+                if segment:
+                    sent += 1
+                    yield segment
+                    min_chars = CHAT_SEGMENT_CHARS
+                cut = _cut_position(buffer, min_chars)
+    except llm_gateway.LLMBusyError as e:
+        # 排隊逾時一定發生在收到任何片段之前
+        yield str(e)
+        return
+    except Exception as e:
+        print(f"Google Bard API 錯誤: {e}")
+        yield ERROR_REPLY if not sent else "⚠️ 回答中斷，請再問一次"
+        return
+
+    for segment in split_text(buffer):
+        sent += 1
+        yield segment
+    if not sent:
+        yield ERROR_REPLY
+        return
+    llm_cache.store("chat", cache_key, full_text.strip())
@@ -7,9 +7,20 @@
 1. 當已記錄該筆帳務,回傳帳務資訊不包含小數點
 2. 加入 ConfirmTemplate, 讓用戶點選收入或支出
 3. 簡化函數
+4. 新增每日彙總表 expense_daily_totals，記帳時同步累加，查詢時只需讀取彙總（不必掃描全部記錄）；
+   彙總表由部署時執行 python -m handlers.expense [--backfill] 建立，執行前查詢沿用原本直接加總 expenses 的方式
+5. 批次寫入（EXPENSE_WRITE_MODE=batch）：同一段時間內的記帳合併成一次 executemany 交易，
+   寫入成功（commit）後才回覆使用者；批次失敗時改為逐筆寫入，只有出錯的那筆失敗
+6. 連線池包裝：池滿時排隊等待（不直接拋出 PoolError）、閒置連線先 ping、舊連線定期重連，並提供使用量統計
 """
 import os
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import Counter, defaultdict
 from mysql.connector import pooling, Error
+from mysql.connector.errors import PoolError
 from datetime import datetime, timedelta
 import logging
 from get_username import get_line_username
@@ -19,9 +30,144 @@ CATEGORIES = ["餐飲", "交通", "娛樂", "購物", "醫療", "日常", "其
 INCOME_CATEGORIES = ["薪水", "獎金", "投資", "其他"]
 BUDGET_PERIODS = ["週預算", "月預算"]
 
+# 記帳寫入：direct（預設，每筆一個交易）/ batch（背景合併成批次寫入）
+EXPENSE_WRITE_MODE = os.getenv("EXPENSE_WRITE_MODE", "direct").lower()
+EXPENSE_BATCH_SIZE = int(os.getenv("EXPENSE_BATCH_SIZE", "50"))                 # 累積到這個筆數立即寫入
+EXPENSE_FLUSH_INTERVAL = float(os.getenv("EXPENSE_FLUSH_INTERVAL", "0.05"))     # 最多等待秒數
+EXPENSE_WRITE_TIMEOUT = float(os.getenv("EXPENSE_WRITE_TIMEOUT", "10"))         # 等待寫入完成的上限
+
+# 連線池設定
+MYSQL_POOL_NAME = os.getenv("MYSQL_POOL_NAME", "expense_pool")
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))                        # mysql-connector 上限為 32
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))               # 池滿時最多等待秒數
+MYSQL_POOL_PING_IDLE = float(os.getenv("MYSQL_POOL_PING_IDLE", "30"))           # 閒置超過此秒數，使用前先 ping
+MYSQL_POOL_RECYCLE = float(os.getenv("MYSQL_POOL_RECYCLE", "3600"))             # 連線建立超過此秒數就重新連線
+
+# 每日彙總表：(使用者, 日期, 類型, 類別) → 金額合計，主鍵順序讓查詢可以直接用日期區間掃描
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS expense_daily_totals (
+        user_id VARCHAR(64) NOT NULL,
+        day DATE NOT NULL,
+        type VARCHAR(10) NOT NULL,
+        category VARCHAR(32) NOT NULL,
+        total BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, type, day, category)
+    )
+"""
+# 原始記錄的查詢索引（日期區間查詢可用）
+EXPENSES_INDEX_SQL = "CREATE INDEX idx_expenses_user_type_date ON expenses (user_id, type, date)"
+EXPENSE_INSERT_SQL = """
+    INSERT INTO expenses (category, amount, user_id, user_name, type, date)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO expense_daily_totals (user_id, day, type, category, total)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE total = total + VALUES(total)
+"""
+ROLLUP_EXISTS_SQL = """
+    SELECT COUNT(*) FROM information_schema.tables
+    WHERE table_schema = DATABASE() AND table_name = 'expense_daily_totals'
+"""
+ROLLUP_RECHECK_INTERVAL = float(os.getenv("ROLLUP_RECHECK_INTERVAL", "300"))    # 彙總表不存在時多久再檢查一次
+ROLLUP_BACKFILL_SQL = """
+    INSERT INTO expense_daily_totals (user_id, day, type, category, total)
+    SELECT user_id, DATE(date), type, category, SUM(amount)
+    FROM expenses
+    GROUP BY user_id, DATE(date), type, category
+    ON DUPLICATE KEY UPDATE total = VALUES(total)
+"""
+
+
+class ExpenseConnectionPool:
+    """
+    MySQL 連線池包裝
+    - 以 semaphore 控制借出數量，池滿時排隊等待，逾時才拋出 PoolError
+    - 閒置過久的連線先 ping（斷線時自動重連），建立過久的連線直接重連，避免使用到已被伺服器關閉的連線
+    """
+
+    def __init__(self, pool_name, pool_size, timeout, ping_idle, recycle, **connect_args):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ping_idle = ping_idle
+        self.recycle = recycle
+        self._pool = pooling.MySQLConnectionPool(pool_name=pool_name, pool_size=pool_size, **connect_args)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._connections = {}      # id(底層連線) -> {"created": 建立時間, "last_used": 上次歸還時間}
+        self._stats = {"in_use": 0, "waiting": 0, "acquired": 0, "timeouts": 0, "pings": 0, "reconnects": 0,
+                       "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    def _check(self, conn):
+        """依閒置 / 建立時間決定是否 ping 或重新連線"""
+        now = time.time()
+        raw = getattr(conn, "_cnx", conn)
+        with self._lock:
+            info = self._connections.setdefault(id(raw), {"created": now, "last_used": now})
+        if now - info["created"] > self.recycle:
+            conn.reconnect(attempts=3, delay=0)
+            info["created"] = info["last_used"] = now
+            self._count("reconnects")
+        elif now - info["last_used"] > self.ping_idle:
+            conn.ping(reconnect=True, attempts=3, delay=0)
+            self._count("pings")
+        return info
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    @contextmanager
+    def connection(self):
+        """借出一條連線，離開 with 區塊時歸還"""
+        started = time.perf_counter()
+        with self._lock:
+            self._stats["waiting"] += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        wait_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["waiting"] -= 1
+            if acquired:
+                self._stats["in_use"] += 1
+                self._stats["acquired"] += 1
+                self._stats["total_wait_ms"] += wait_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+            else:
+                self._stats["timeouts"] += 1
+        if not acquired:
+            raise PoolError(f"MySQL 連線池已滿，等待 {self.timeout} 秒仍無可用連線")
+
+        conn = None
+        try:
+            conn = self._pool.get_connection()
+            info = self._check(conn)
+            yield conn
+        finally:
+            if conn is not None:
+                info = self._connections.get(id(getattr(conn, "_cnx", conn)))
+                if info:
+                    info["last_used"] = time.time()
+                conn.close()    # 歸還連線池
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        acquired = stats["acquired"]
+        stats.update({
+            "size": self.pool_size,
+            "idle": self.pool_size - stats["in_use"],
+            "avg_wait_ms": round(stats.pop("total_wait_ms") / acquired, 2) if acquired else 0.0,
+            "max_wait_ms": round(stats["max_wait_ms"], 2),
+        })
+        return stats
+
 
 # 建立 MySQL 連線池
-pool = pooling.MySQLConnectionPool(
+pool = ExpenseConnectionPool(
+    MYSQL_POOL_NAME, MYSQL_POOL_SIZE, MYSQL_POOL_TIMEOUT, MYSQL_POOL_PING_IDLE, MYSQL_POOL_RECYCLE,
     host=os.getenv('MYSQL_HOST'),  
     port=os.getenv('MYSQL_PORT'),  
     user=os.getenv('MYSQL_USER'),
@@ -29,75 +175,335 @@ pool = pooling.MySQLConnectionPool(
     database=os.getenv('MYSQL_DATABASE')
 )
 
+_rollup_state = {"available": False, "checked_at": None, "warned": False}
+_rollup_lock = threading.Lock()
+
 def get_db_connection():
-    """取得 MySQL 連線"""
-    return pool.get_connection()
+    """取得 MySQL 連線（with get_db_connection() as conn: ...，池滿時排隊等待）"""
+    return pool.connection()
+
+def rollup_available():
+    """
+    彙總表是否已建立（只讀取 information_schema，不在服務中建立資料表）
+    存在後不再檢查；不存在時每 ROLLUP_RECHECK_INTERVAL 秒重新檢查，只記錄一次警告
+    """
+    with _rollup_lock:
+        if _rollup_state["available"]:
+            return True
+        checked_at = _rollup_state["checked_at"]
+        if checked_at is not None and time.monotonic() - checked_at < ROLLUP_RECHECK_INTERVAL:
+            return False
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(ROLLUP_EXISTS_SQL)
+                _rollup_state["available"] = bool(cursor.fetchone()[0])
+        except Error as e:
+            logging.error(f"Database error in rollup_available: {e}")
+            return False
+        _rollup_state["checked_at"] = time.monotonic()
+        if not _rollup_state["available"] and not _rollup_state["warned"]:
+            logging.warning("expense_daily_totals 不存在，查詢改為直接加總 expenses（請執行 python -m handlers.expense）")
+            _rollup_state["warned"] = True
+        return _rollup_state["available"]
+
+def get_pool_stats():
+    """連線池使用中 / 閒置數量與等待時間"""
+    return pool.get_stats()
+
+# 批次寫入
+def write_expense_rows(rows):
+    """
+    在同一個交易中寫入多筆記帳，並依 (使用者, 日期, 類型, 類別) 合併後累加每日彙總
+    :param rows: [(category, amount, user_id, user_name, record_type, date), ...]
+    """
+    totals = defaultdict(int)
+    for category, amount, user_id, _, record_type, date in rows:
+        totals[(user_id, date.date(), record_type, category)] += amount
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(EXPENSE_INSERT_SQL, rows)
+            try:
+                cursor.executemany(ROLLUP_UPSERT_SQL, [key + (total,) for key, total in totals.items()])
+            except Error as e:
+                if e.errno != 1146:     # 彙總表尚未建立：只寫入原始記錄，建立時由 expenses 回填
+                    raise
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def write_expense_rows_isolated(rows):
+    """
+    先以一個交易寫入全部記帳；失敗時改為逐筆寫入，避免一筆錯誤讓其他記帳一起失敗
+    :return: 每筆是否寫入成功
+    """
+    try:
+        write_expense_rows(rows)
+        return [True] * len(rows)
+    except Exception as e:
+        logging.error(f"Database error in expense write ({len(rows)} rows): {e}")
+        if len(rows) == 1:
+            return [False]
+
+    ok = []
+    for row in rows:
+        try:
+            write_expense_rows([row])
+            ok.append(True)
+        except Exception as e:
+            logging.error(f"Database error in expense row write: {e}")
+            ok.append(False)
+    return ok
+
+
+class _PendingWrite:
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.ok = False
+
+
+class ExpenseWriteBuffer:
+    """
+    背景批次寫入：累積到 batch_size 筆或等待 interval 秒後，以一個交易寫入
+    呼叫端會等到所屬批次 commit 後才返回，寫入失敗時可以照常回覆錯誤
+    """
+
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = []
+        self._pending_users = Counter()     # 尚未寫入的筆數（讀取前等待同一使用者的寫入）
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {"batches": 0, "rows": 0, "failed_rows": 0, "cancelled": 0, "max_batch": 0, "total_write_ms": 0.0}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="expense-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, rows):
+        """加入待寫入佇列，回傳每筆的 _PendingWrite"""
+        pending = [_PendingWrite(row) for row in rows]
+        with self._cond:
+            self._ensure_thread()
+            self._queue.extend(pending)
+            for item in pending:
+                self._pending_users[item.row[2]] += 1
+            self._cond.notify_all()
+        return pending
+
+    def _release(self, items):
+        """更新尚未寫入的筆數（呼叫時需持有 _cond）"""
+        for item in items:
+            self._pending_users[item.row[2]] -= 1
+            if self._pending_users[item.row[2]] <= 0:
+                del self._pending_users[item.row[2]]
+        self._cond.notify_all()
+
+    def cancel(self, item):
+        """
+        從佇列移除還沒開始寫入的記帳（等待逾時時使用，避免之後才寫入、使用者重試時重複記帳）
+        :return: True 表示已移除（確定不會寫入）；False 表示已在寫入中或已完成
+        """
+        with self._cond:
+            if item not in self._queue:
+                return False
+            self._queue.remove(item)
+            self._stats["cancelled"] += 1
+            self._release([item])
+        return True
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # 第一筆進來後最多再等 interval 秒，讓同時間的記帳合併
+            deadline = time.monotonic() + self.interval
+            while len(self._queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            ok = write_expense_rows_isolated([item.row for item in batch])
+
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["rows"] += len(batch)
+                self._stats["failed_rows"] += ok.count(False)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                self._stats["total_write_ms"] += (time.perf_counter() - started) * 1000
+                self._release(batch)
+            for item, success in zip(batch, ok):
+                item.ok = success
+                item.done.set()
+
+    def wait_for_user(self, user_id, timeout=EXPENSE_WRITE_TIMEOUT):
+        """等待該使用者尚未寫入的記帳完成（確保接下來的查詢看得到剛記的帳）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending_users.get(user_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._queue)
+        stats["avg_batch"] = round(stats["rows"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["avg_write_ms"] = round(stats.pop("total_write_ms") / stats["batches"], 1) if stats["batches"] else 0.0
+        return stats
+
+
+_write_buffer = ExpenseWriteBuffer(EXPENSE_BATCH_SIZE, EXPENSE_FLUSH_INTERVAL) if EXPENSE_WRITE_MODE == "batch" else None
+
 
 # 儲存帳務訊息
-def save_expense(category, amount, user_id, record_type):
-    """儲存收入或支出記錄"""
+def save_expenses(user_id, transactions):
+    """
+    儲存多筆收入或支出記錄（AI 一次解析出多筆記帳時合併寫入）
+    :param transactions: [(category, amount, record_type), ...]
+    :return: 每筆的回覆訊息
+    """
+    if not transactions:
+        return []
     try:
-        amount = int(float(amount))  
         user_name = get_line_username(user_id)
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO expenses (category, amount, user_id, user_name, type, date) VALUES (%s, %s, %s, %s, %s, NOW())",
-                (category, amount, user_id, user_name, record_type)
-            )
-            conn.commit()
-            return f"✅ 已記錄：{record_type} - {category} {amount} 元"
-    except Error as e:
-        logging.error(f"Database error in save_expense: {e}")
-        return "⚠️ 記帳失敗，請稍後再試"
+        now = datetime.now()    # 記帳時間以收到訊息的時間為準，不受批次等待影響
+        rows = [(category, int(float(amount)), user_id, user_name, record_type, now)
+                for category, amount, record_type in transactions]
+    except ValueError:
+        return ["⚠️ 記帳失敗，請稍後再試"] * len(transactions)
+
+    if _write_buffer is None:
+        status = write_expense_rows_isolated(rows)
+    else:
+        status = _wait_for_writes(_write_buffer.submit(rows))
+
+    messages = {
+        True: "✅ 已記錄：{0} - {1} {2} 元",
+        False: "⚠️ 記帳失敗，請稍後再試",
+        "processing": "⏳ 記帳處理中：{0} - {1} {2} 元，稍後可查詢確認，請勿重複記帳",
+    }
+    return [messages[ok].format(row[4], row[0], row[1]) for row, ok in zip(rows, status)]
 
-# 通用查詢函數
-def fetch_financial_records(user_id, period, record_type):
-    """查詢指定時間範圍的財務記錄，並回傳總支出"""
-    now = datetime.now()
-    conditions = {
-        'today': ("DATE(date) = %s", [now.strftime("%Y-%m-%d")]),
-        'week': ("DATE(date) >= %s", [(now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")]),
-        'month': ("YEAR(date) = %s AND MONTH(date) = %s", [now.year, now.month])
+
+def _wait_for_writes(pending):
+    """
+    等待批次寫入結果：True 成功 / False 失敗（含逾時時仍在佇列中、已移除不會寫入）/
+    "processing"（逾時時已在寫入中，結果未知，不能告訴使用者失敗以免重複記帳）
+    """
+    deadline = time.monotonic() + EXPENSE_WRITE_TIMEOUT
+    status = []
+    for item in pending:
+        if item.done.wait(max(deadline - time.monotonic(), 0)):
+            status.append(item.ok)
+        elif _write_buffer.cancel(item):
+            status.append(False)
+        elif item.done.is_set():
+            status.append(item.ok)
+        else:
+            status.append("processing")
+    return status
+
+
+def save_expense(category, amount, user_id, record_type):
+    """儲存收入或支出記錄"""
+    return save_expenses(user_id, [(category, amount, record_type)])[0]
+
+def get_write_stats():
+    """批次寫入統計（direct 模式為空）"""
+    return _write_buffer.get_stats() if _write_buffer is not None else {}
+
+# 查詢區間 [開始日, 結束日)
+def get_period_range(period, now=None):
+    """今日 / 本週（週一起算）/ 本月的日期區間，結束日不包含在內"""
+    today = (now or datetime.now()).date()
+    starts = {
+        'today': today,
+        'week': today - timedelta(days=today.weekday()),
+        'month': today.replace(day=1),
     }
-    condition = conditions.get(period)
-    if not condition:
-        return None, "⚠️ 不支援的時間範圍"
+    if period not in starts:
+        return None
+    return starts[period], today + timedelta(days=1)
+
+SUMMARY_SQL = """
+    SELECT d.category, SUM(d.total) AS total, MAX(b.amount) AS budget
+    FROM expense_daily_totals d
+    LEFT JOIN (
+        SELECT MAX(amount) AS amount FROM budgets WHERE user_id = %s AND period = %s
+    ) b ON TRUE
+    WHERE d.user_id = %s
+      AND d.type = %s
+      AND d.day >= %s AND d.day < %s
+    GROUP BY d.category WITH ROLLUP
+"""
+# 彙總表尚未建立時直接加總原始記錄
+LEGACY_SUMMARY_SQL = """
+    SELECT e.category, SUM(e.amount) AS total, MAX(b.amount) AS budget
+    FROM expenses e
+    LEFT JOIN (
+        SELECT MAX(amount) AS amount FROM budgets WHERE user_id = %s AND period = %s
+    ) b ON TRUE
+    WHERE e.user_id = %s
+      AND e.type = %s
+      AND e.date >= %s AND e.date < %s
+    GROUP BY e.category WITH ROLLUP
+"""
 
-    query = f"""
-        SELECT category, SUM(amount) as total
-        FROM expenses
-        WHERE {condition[0]} 
-          AND user_id = %s 
-          AND type = %s
-        GROUP BY category
+# 通用查詢函數
+def get_expense_summary(user_id, period, record_type):
+    """
+    一次查詢取得各類別合計、總計與對應的預算（同一個連線、同一個 SQL）
+    WITH ROLLUP 的最後一列（category 為 NULL）即為總計；今日支出與收入不需要預算
+    :return: (各類別 [(category, total), ...], 總計, 預算或 None)，查詢失敗時為 (None, 錯誤訊息, None)
     """
-    params = condition[1] + [user_id, record_type]
+    date_range = get_period_range(period)
+    if not date_range:
+        return None, "⚠️ 不支援的時間範圍", None
+    budget_period = {'week': 'weekly', 'month': 'monthly'}.get(period) if record_type == '支出' else None
+    if _write_buffer is not None:
+        _write_buffer.wait_for_user(user_id)    # 先等同一使用者尚未寫入的記帳
+
+    query = SUMMARY_SQL if rollup_available() else LEGACY_SUMMARY_SQL
+    params = (user_id, budget_period, user_id, record_type, date_range[0], date_range[1])
 
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
-            records = cursor.fetchall()
-
-            # ✅ 取得該時段的總支出，並確保轉換為 int
-            cursor.execute(f"""
-                SELECT SUM(amount) FROM expenses
-                WHERE {condition[0]} 
-                  AND user_id = %s 
-                  AND type = %s
-            """, params)
-            total_expense = cursor.fetchone()[0]
-            total_expense = int(total_expense) if total_expense else 0  # **確保是 int**
-            
-            return records, total_expense  # ✅ 回傳「各類支出」+「總支出」
+            rows = cursor.fetchall()
+
+            # ✅ category 為 NULL 的列是 ROLLUP 總計
+            records = [(category, total) for category, total, _ in rows if category is not None]
+            summary = next((row for row in rows if row[0] is None), None)
+            total_expense = int(summary[1]) if summary and summary[1] else 0  # **確保是 int**
+            budget = int(summary[2]) if summary and summary[2] is not None else None
+
+            return records, total_expense, budget
     except Error as e:
-        logging.error(f"Database error in fetch_financial_records: {e}")
-        return None, "⚠️ 查詢失敗，請稍後重試"
+        logging.error(f"Database error in get_expense_summary: {e}")
+        return None, "⚠️ 查詢失敗，請稍後重試", None
 
 
 # 格式化回應
-def format_response(result, period, record_type, user_id, total_expense):
+def format_response(result, period, record_type, total_expense, budget=None):
     """格式化查詢結果，並附加預算提醒（但今日支出不顯示預算）"""
     if not isinstance(result, list):
         return "⚠️ 資料庫查詢異常"
@@ -121,29 +527,29 @@ def format_response(result, period, record_type, user_id, total_expense):
 
     # ✅ 查詢「今日支出」時不顯示預算提醒
     if record_type == '支出' and period != 'today':
-        response = add_budget_alerts(response, user_id, period, total_expense)
+        response = add_budget_alerts(response, period, total_expense, budget)
 
     return response
 
 
 # 查詢支出 / 收入
 def get_today_expense(user_id):
-    result, total_expense = fetch_financial_records(user_id, 'today', '支出')
-    return format_response(result, 'today', '支出', user_id, total_expense)
+    result, total_expense, budget = get_expense_summary(user_id, 'today', '支出')
+    return format_response(result, 'today', '支出', total_expense, budget)
 
 def get_weekly_expense(user_id):
-    records, total_expense = fetch_financial_records(user_id, 'week', '支出')
-    return format_response(records, 'week', '支出', user_id, total_expense)  
+    records, total_expense, budget = get_expense_summary(user_id, 'week', '支出')
+    return format_response(records, 'week', '支出', total_expense, budget)
 
 def get_monthly_expense(user_id):
-    result, total_expense = fetch_financial_records(user_id, 'month', '支出')
-    return format_response(result, 'month', '支出', user_id, total_expense)
+    result, total_expense, budget = get_expense_summary(user_id, 'month', '支出')
+    return format_response(result, 'month', '支出', total_expense, budget)
 
 def get_monthly_income(user_id):
-    result, total_income = fetch_financial_records(user_id, 'month', '收入')
+    result, total_income, _ = get_expense_summary(user_id, 'month', '收入')
     if not result:  # 如果沒有任何收入紀錄
         return "📅 本月尚未取得收入"
-    return format_response(result, 'month', '收入', user_id, total_income)
+    return format_response(result, 'month', '收入', total_income)
 
 #=====================================================================================================預算
 #=====================================================================================================預算
@@ -208,15 +614,13 @@ def get_budgets(user_id, period=None):
         return None
 
 # 預算提醒
-def add_budget_alerts(response, user_id, period, total_expense):
-    """在查詢結果中追加預算提醒"""
+def add_budget_alerts(response, period, total_expense, total_budget):
+    """在查詢結果中追加預算提醒（預算由 get_expense_summary 一併查出）"""
     budget_period = '本月' if period == 'month' else '本週'  
-    budgets = get_budgets(user_id, 'monthly' if period == 'month' else 'weekly')
 
-    if not budgets:
+    if total_budget is None:
         return response  # ✅ 沒有設定預算，直接返回
 
-    total_budget = budgets[0][0]  # 獲取預算金額
     percentage_used = int((total_expense / total_budget) * 100) if total_budget else 0  # ✅ 轉整數
     alerts = [f"📊 {budget_period}已使用 {total_expense:,}/{total_budget:,} 元（{percentage_used}%）"]  # ✅ 加千分位 & 無小數點
 
@@ -230,3 +634,34 @@ def add_budget_alerts(response, user_id, period, total_expense):
 
     response += "\n——————————————\n🔔 預算提醒：\n" + "\n".join(alerts)
     return response
+
+
+#=====================================================================================================彙總表
+#=====================================================================================================彙總表
+
+# 建立彙總表
+def init_rollup_table(backfill=False):
+    """
+    建立每日彙總表與 expenses 的查詢索引（部署時執行，需要 CREATE / INDEX 權限）
+    彙總表原本不存在時（第一次部署）自動回填；backfill=True 時一律由既有記錄重新計算
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(ROLLUP_EXISTS_SQL)
+        backfill = backfill or not cursor.fetchone()[0]
+        cursor.execute(ROLLUP_TABLE_SQL)
+        try:
+            cursor.execute(EXPENSES_INDEX_SQL)
+        except Error as e:
+            if e.errno != 1061:     # 索引已存在
+                raise
+        if backfill:
+            cursor.execute(ROLLUP_BACKFILL_SQL)
+        conn.commit()
+    print(f"✅ 已建立 expense_daily_totals{'（已回填既有記錄）' if backfill else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建立記帳每日彙總表")
+    parser.add_argument("--backfill", action="store_true", help="由 expenses 既有記錄回填彙總")
+    init_rollup_table(parser.parse_args().backfill)
@@ -0,0 +1,272 @@
+"""
+技術指標計算（NumPy 向量化）：MA、RSI、MACD、布林通道、成交量均線
+
+- get_technical_indicators / 到價提醒（calculate_indicators）與 LSTM 特徵（add_feature_columns）共用同一套計算
+- 輸入可為一維（單一股票的日 K）或二維（股票 × 天數）陣列，一律沿最後一軸計算；多檔股票一次呼叫即可
+- 移動平均、標準差以 sliding window 一次算完；EMA 類指標（MACD、Wilder RSI）以 scipy.signal.lfilter 沿時間軸一次算完
+- 新的一根 K 棒進來時，以 IndicatorState.update 增量更新，不必重算整段歷史
+- 收盤價缺值沿用前一日（與 Close.ffill() 相同）；最前面尚未上市的 NaN 不計入
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+MA_WINDOWS = (5, 20)
+RSI_WINDOW = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+BOLLINGER_WINDOW, BOLLINGER_K = 20, 2
+VOLUME_WINDOW = 5
+HISTORY = max(MA_WINDOWS + (RSI_WINDOW + 1, BOLLINGER_WINDOW, VOLUME_WINDOW))   # 增量更新需保留的 K 棒數
+
+INDICATOR_COLUMNS = ["MA5", "MA20", "RSI", "MACD", "MACD_SIGNAL", "MACD_HIST",
+                     "BB_UPPER", "BB_LOWER", "Volume_MA5"]
+
+
+def _as_array(values):
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def ffill(values):
+    """沿最後一軸以前一個有效值補缺值（最前面的 NaN 保留）"""
+    values = _as_array(values)
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(index, axis=-1, out=index)
+    return np.take_along_axis(values, index, axis=-1)
+
+
+def sma(values, window):
+    """簡單移動平均（視窗內有 NaN 或資料不足時為 NaN，同 rolling(window).mean()）"""
+    values = _as_array(values)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(values, window, axis=-1).mean(axis=-1)
+    return out
+
+
+def rolling_std(values, window):
+    """移動標準差（母體標準差 ddof=0，同 ta 的布林通道）"""
+    values = _as_array(values)
+    out = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(values, window, axis=-1).std(axis=-1)
+    return out
+
+
+def ema(values, alpha):
+    """
+    指數移動平均（adjust=False，同 ewm(alpha=alpha, adjust=False)），從第一個有效值起算
+    只處理最前面的 NaN（輸出同樣為 NaN）；中間不可有缺值（先以 ffill 補值）
+    """
+    values = _as_array(values)
+    started = np.logical_or.accumulate(~np.isnan(values), axis=-1)
+    first = np.take_along_axis(values, started.argmax(axis=-1)[..., None], axis=-1)
+    # 開始前的位置先填入第一個有效值：EMA 在這段維持不變，算完再遮回 NaN
+    filled = np.where(started, values, first)
+    out = lfilter([alpha], [1.0, alpha - 1.0], filled, axis=-1, zi=(1.0 - alpha) * first)[0]
+    return np.where(started, out, np.nan)
+
+
+def gain_loss(close):
+    """
+    每日漲幅與跌幅（皆為正值）；第一個有效收盤價當天視為 0，收盤價缺值的位置為 NaN
+    """
+    close = _as_array(close)
+    delta = np.diff(close, axis=-1, prepend=np.nan)
+    valid = ~np.isnan(close)
+    gain = np.where(valid, np.where(delta > 0, delta, 0.0), np.nan)
+    loss = np.where(valid, np.where(delta < 0, -delta, 0.0), np.nan)
+    return gain, loss
+
+
+def rsi_from_averages(avg_gain, avg_loss, method="sma"):
+    """
+    :param method: "sma"（簡單平均，原 get_technical_indicators 算法，平盤時為 NaN）
+                   "wilder"（Wilder 平滑，同 ta.momentum.RSIIndicator，平均跌幅為 0 時為 100）
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    if method == "wilder":
+        rsi = np.where(avg_loss == 0, 100.0, rsi)
+    return rsi
+
+
+def _ema_step(value, x, alpha):
+    """EMA 遞推一步（adjust=False）：尚未開始時以第一個有效值起算"""
+    return np.where(np.isnan(value), x, value + alpha * (x - value))
+
+
+class IndicatorState:
+    """
+    指標的遞推狀態與最近 HISTORY 根 K 棒，可為單一股票（shape=()）或多檔股票（shape=(股票數,)）
+    以 init_state 從歷史資料建立，之後每根新 K 棒呼叫 update
+    """
+
+    def __init__(self, shape=(), rsi_method="sma", warmup=False):
+        """
+        :param rsi_method: "sma" 或 "wilder"（見 rsi_from_averages）
+        :param warmup: True 時 MACD / 信號線需累積 26 / 34 根 K 棒才有值（同 ta），False 時從第一根起算（同 ewm(adjust=False)）
+        """
+        self.rsi_method = rsi_method
+        self.warmup = warmup
+        self.count = np.zeros(shape, dtype=np.int64)     # 已有的有效 K 棒數
+        self.closes = np.full(shape + (HISTORY,), np.nan)
+        self.volumes = np.full(shape + (VOLUME_WINDOW,), np.nan)
+        self.ema_fast = np.full(shape, np.nan)
+        self.ema_slow = np.full(shape, np.nan)
+        self.ema_signal = np.full(shape, np.nan)
+        self.avg_gain = np.full(shape, np.nan)
+        self.avg_loss = np.full(shape, np.nan)
+
+    @property
+    def macd_periods(self):
+        return MACD_SLOW if self.warmup else 1
+
+    @property
+    def signal_periods(self):
+        return MACD_SLOW + MACD_SIGNAL - 1 if self.warmup else 1
+
+    def _step(self, close, gain, loss):
+        """
+        EMA 類指標遞推一根 K 棒（close 已補值）
+        :return: (macd, signal, avg_gain, avg_loss)，資料不足時為 NaN
+        """
+        self.count += ~np.isnan(close)
+        self.ema_fast = _ema_step(self.ema_fast, close, 2 / (MACD_FAST + 1))
+        self.ema_slow = _ema_step(self.ema_slow, close, 2 / (MACD_SLOW + 1))
+        macd = np.where(self.count >= self.macd_periods, self.ema_fast - self.ema_slow, np.nan)
+        self.ema_signal = _ema_step(self.ema_signal, macd, 2 / (MACD_SIGNAL + 1))
+        self.avg_gain = _ema_step(self.avg_gain, gain, 1 / RSI_WINDOW)
+        self.avg_loss = _ema_step(self.avg_loss, loss, 1 / RSI_WINDOW)
+
+        ready = self.count >= RSI_WINDOW
+        return (macd,
+                np.where(self.count >= self.signal_periods, self.ema_signal, np.nan),
+                np.where(ready, self.avg_gain, np.nan),
+                np.where(ready, self.avg_loss, np.nan))
+
+    def update(self, close, volume=None):
+        """
+        加入一根新的 K 棒並回傳最新的指標值
+        :param close: 收盤價（純量或每檔股票一個值；NaN 時沿用前一日收盤價）
+        :param volume: 成交量（可省略）
+        :return: {指標名稱: 純量或陣列}，欄位同 INDICATOR_COLUMNS
+        """
+        close = np.asarray(close, dtype=np.float64)
+        close = np.where(np.isnan(close), self.closes[..., -1], close)
+        gain, loss = (values[..., -1] for values in gain_loss(np.stack([self.closes[..., -1], close], axis=-1)))
+        macd, signal, avg_gain, avg_loss = self._step(close, gain, loss)
+
+        self.closes = np.concatenate([self.closes[..., 1:], close[..., None]], axis=-1)
+        volume = np.full(close.shape, np.nan) if volume is None else np.asarray(volume, dtype=np.float64)
+        self.volumes = np.concatenate([self.volumes[..., 1:], volume[..., None]], axis=-1)
+
+        if self.rsi_method == "sma":
+            gains, losses = gain_loss(self.closes[..., -(RSI_WINDOW + 1):])
+            avg_gain, avg_loss = gains[..., 1:].mean(axis=-1), losses[..., 1:].mean(axis=-1)
+        middle = self.closes[..., -BOLLINGER_WINDOW:].mean(axis=-1)
+        band = BOLLINGER_K * self.closes[..., -BOLLINGER_WINDOW:].std(axis=-1)
+        return {
+            "MA5": self.closes[..., -MA_WINDOWS[0]:].mean(axis=-1),
+            "MA20": self.closes[..., -MA_WINDOWS[1]:].mean(axis=-1),
+            "RSI": rsi_from_averages(avg_gain, avg_loss, self.rsi_method),
+            "MACD": macd,
+            "MACD_SIGNAL": signal,
+            "MACD_HIST": macd - signal,
+            "BB_UPPER": middle + band,
+            "BB_LOWER": middle - band,
+            "Volume_MA5": self.volumes.mean(axis=-1),
+        }
+
+
+def _run(close, volume, rsi_method, warmup):
+    close = ffill(close)
+    days = close.shape[-1]
+    state = IndicatorState(close.shape[:-1], rsi_method, warmup)
+    gain, loss = gain_loss(close)
+
+    # 移動視窗類指標：整個矩陣一次計算
+    ma_short, ma_long = (sma(close, window) for window in MA_WINDOWS)
+    middle = sma(close, BOLLINGER_WINDOW)
+    band = BOLLINGER_K * rolling_std(close, BOLLINGER_WINDOW)
+
+    # EMA 類指標：整個矩陣沿時間軸一次計算，資料不足的位置再遮成 NaN（與 IndicatorState.update 相同）
+    count = np.cumsum(~np.isnan(close), axis=-1)
+    ema_fast, ema_slow = ema(close, 2 / (MACD_FAST + 1)), ema(close, 2 / (MACD_SLOW + 1))
+    macd = np.where(count >= state.macd_periods, ema_fast - ema_slow, np.nan)
+    ema_signal = ema(macd, 2 / (MACD_SIGNAL + 1))
+    signal = np.where(count >= state.signal_periods, ema_signal, np.nan)
+    ema_gain, ema_loss = ema(gain, 1 / RSI_WINDOW), ema(loss, 1 / RSI_WINDOW)
+
+    if rsi_method == "sma":
+        avg_gain, avg_loss = sma(gain, RSI_WINDOW), sma(loss, RSI_WINDOW)
+    else:
+        ready = count >= RSI_WINDOW
+        avg_gain, avg_loss = np.where(ready, ema_gain, np.nan), np.where(ready, ema_loss, np.nan)
+    volume = np.full(close.shape, np.nan) if volume is None else _as_array(volume)
+
+    # 增量更新從最後一天的遞推狀態與最近 K 棒接著算
+    if days:
+        state.count = count[..., -1]
+        state.ema_fast, state.ema_slow, state.ema_signal = ema_fast[..., -1], ema_slow[..., -1], ema_signal[..., -1]
+        state.avg_gain, state.avg_loss = ema_gain[..., -1], ema_loss[..., -1]
+    keep = min(days, HISTORY)
+    state.closes[..., HISTORY - keep:] = close[..., days - keep:]
+    keep = min(days, VOLUME_WINDOW)
+    state.volumes[..., VOLUME_WINDOW - keep:] = volume[..., days - keep:]
+
+    indicators = {
+        "MA5": ma_short,
+        "MA20": ma_long,
+        "RSI": rsi_from_averages(avg_gain, avg_loss, rsi_method),
+        "MACD": macd,
+        "MACD_SIGNAL": signal,
+        "MACD_HIST": macd - signal,
+        "BB_UPPER": middle + band,
+        "BB_LOWER": middle - band,
+        "Volume_MA5": sma(volume, VOLUME_WINDOW),
+    }
+    return indicators, state
+
+
+def compute_all(close, volume=None, rsi_method="sma", warmup=False):
+    """
+    一次計算所有指標
+    :param close: 收盤價，一維（天數）或二維（股票 × 天數），天數不同的股票在前面補 NaN 對齊最新一天
+    :param volume: 與 close 相同形狀的成交量（可省略，此時 Volume_MA5 為 NaN）
+    :return: {指標名稱: 與 close 相同形狀的陣列}，欄位同 INDICATOR_COLUMNS
+    """
+    return _run(close, volume, rsi_method, warmup)[0]
+
+
+def init_state(close, volume=None, rsi_method="sma", warmup=False):
+    """從歷史資料建立 IndicatorState，之後以 update 逐根加入新的 K 棒"""
+    return _run(close, volume, rsi_method, warmup)[1]
+
+
+def calculate_indicators(df):
+    """
+    計算技術指標欄位：MA5、MA20、RSI、MACD、MACD_SIGNAL、MACD_HIST、BB_UPPER、BB_LOWER、Volume_MA5
+    （get_technical_indicators 與到價提醒共用）
+    :param df: 含 Close / Volume 欄位的日 K 資料，會直接新增欄位
+    :return: 同一個 DataFrame
+    """
+    df["Close"] = df["Close"].ffill()
+    indicators = compute_all(df["Close"].to_numpy(), df["Volume"].to_numpy())
+    for column in INDICATOR_COLUMNS:
+        df[column] = indicators[column]
+    return df
+
+
+def add_feature_columns(df):
+    """
+    LSTM 特徵欄位：RSI、MACD、MACD_signal、Bollinger_High、Bollinger_Low（算法同 ta 函式庫，與既有模型一致）
+    :param df: 含 close 欄位的訓練資料，會直接新增欄位
+    :return: 同一個 DataFrame
+    """
+    indicators = compute_all(df["close"].to_numpy(), rsi_method="wilder", warmup=True)
+    df["RSI"] = indicators["RSI"]
+    df["MACD"] = indicators["MACD"]
+    df["MACD_signal"] = indicators["MACD_SIGNAL"]
+    df["Bollinger_High"] = indicators["BB_UPPER"]
+    df["Bollinger_Low"] = indicators["BB_LOWER"]
+    return df
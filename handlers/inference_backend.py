@@ -0,0 +1,108 @@
+"""
+模型推論後端：INFERENCE_BACKEND=keras（預設）/ tflite
+
+tflite 模式使用 .h5 同名的 .tflite 檔（由 export_models.py 匯出），
+只需要 tflite_runtime（或 tensorflow.lite），冷啟動不必載入完整的 TensorFlow / Keras
+"""
+import os
+import threading
+import numpy as np
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+
+
+def get_tflite_path(model_path):
+    """.h5 對應的 .tflite 檔路徑"""
+    return os.path.splitext(model_path)[0] + ".tflite"
+
+
+def _interpreter_class():
+    """優先使用輕量的 tflite_runtime，沒有安裝時才使用 TensorFlow 內建的 Interpreter"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """包裝 TFLite Interpreter，提供與 Keras 模型相同的 predict 介面"""
+
+    def __init__(self, tflite_path):
+        self.path = tflite_path
+        self.interpreter = _interpreter_class()(model_path=tflite_path)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self._lock = threading.Lock()   # Interpreter 不可同時被多個執行緒使用
+
+    def _match_inputs(self, x):
+        """將輸入依 Keras 的輸入名稱（dict）或順序（list / array）對應到 TFLite 的輸入"""
+        if isinstance(x, dict):
+            matched = []
+            for detail in self.input_details:
+                key = next((k for k in x if k in detail["name"]), None)
+                if key is None:
+                    raise ValueError(f"找不到模型輸入 {detail['name']} 對應的資料")
+                matched.append(x[key])
+            return matched
+        if isinstance(x, (list, tuple)):
+            return list(x)
+        return [x]
+
+    def predict(self, x, batch_size=None, verbose=0):
+        inputs = self._match_inputs(x)
+        with self._lock:
+            # 依本次的 batch 大小調整輸入維度
+            for detail, value in zip(self.input_details, inputs):
+                value = np.asarray(value)
+                if list(detail["shape"]) != list(value.shape):
+                    self.interpreter.resize_tensor_input(detail["index"], value.shape)
+            self.interpreter.allocate_tensors()
+
+            for detail, value in zip(self.input_details, inputs):
+                self.interpreter.set_tensor(detail["index"], np.asarray(value, dtype=detail["dtype"]))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_details[0]["index"]).copy()
+
+
+def load_model(model_path):
+    """
+    依 INFERENCE_BACKEND 載入推論用模型
+    tflite 模式下若找不到 .tflite 檔，退回使用 Keras
+    """
+    tflite_path = get_tflite_path(model_path)
+    if INFERENCE_BACKEND == "tflite":
+        if os.path.exists(tflite_path):
+            return TFLiteModel(tflite_path)
+        print(f"⚠️ 找不到 {tflite_path}，改用 Keras 載入")
+
+    from tensorflow.keras.models import load_model as keras_load_model
+    return keras_load_model(model_path, compile=False)
+
+
+def export_tflite(model_path, tflite_path=None):
+    """
+    將 Keras .h5 模型匯出為 .tflite
+    LSTM 優先轉成內建運算子；無法轉換時才加入 TensorFlow 運算子（需要完整 TensorFlow 才能推論）
+    """
+    import tensorflow as tf
+
+    tflite_path = tflite_path or get_tflite_path(model_path)
+    model = tf.keras.models.load_model(model_path, compile=False)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS]
+    try:
+        tflite_model = converter.convert()
+    except Exception as e:
+        print(f"⚠️ {model_path} 無法只用內建運算子轉換（{e}），改用 SELECT_TF_OPS")
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        converter._experimental_lower_tensor_list_ops = False
+        tflite_model = converter.convert()
+
+    tmp_path = f"{tflite_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, tflite_path)
+    return tflite_path
@@ -0,0 +1,224 @@
+"""
+共用股價資料層：同一檔股票只下載一次最長區間的日 K（OHLCV），
+各功能需要的區間（6d / 3mo / 6mo / 12mo）都從記憶體切出
+
+- 盤中：超過 MARKET_DATA_TTL 秒才重新抓取
+- 盤後：收盤後只補抓一次最新資料（增量更新），之後直到下個交易時段都不再連網
+- 依 LRU 淘汰，限制快取的股票數量與記憶體大小
+- prefetch()：多檔股票以一次 yf.download 批次下載（例如關注清單），之後的查詢都從快取取得
+- 兩種下載方式都統一為 Open / High / Low / Close / Volume 欄位；下載失敗時沿用舊資料但不更新抓取時間，下次查詢會重試
+"""
+import os
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+import pandas as pd
+import yfinance as yf
+
+BASE_PERIOD = os.getenv("MARKET_DATA_BASE_PERIOD", "1y")               # 一次下載的最長區間
+MARKET_DATA_TTL = int(os.getenv("MARKET_DATA_TTL", "60"))                # 盤中快取秒數
+MAX_TICKERS = int(os.getenv("MARKET_DATA_MAX_TICKERS", "128"))
+MAX_BYTES = int(os.getenv("MARKET_DATA_MAX_BYTES", str(64 * 1024 * 1024)))
+FETCH_LOCK_STRIPES = 64
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+TAIPEI_TZ = ZoneInfo("Asia/Taipei")
+MARKET_OPEN = datetime.time(9, 0)
+MARKET_CLOSE = datetime.time(13, 30)
+
+_cache = OrderedDict()          # stock_code -> {"df", "fetched_at", "bytes"}
+_cache_lock = threading.Lock()
+# 同一檔股票同時只有一個執行緒在下載（依代碼分配到固定數量的鎖，不會隨股票數增加）
+_fetch_locks = [threading.Lock() for _ in range(FETCH_LOCK_STRIPES)]
+_stats = {"hits": 0, "misses": 0, "refreshes": 0, "evictions": 0, "fetch_errors": 0, "bulk_downloads": 0, "prefetched": 0}
+
+
+def taipei_now():
+    """台北時間"""
+    return datetime.datetime.now(TAIPEI_TZ)
+
+
+def is_market_open(now=None):
+    """目前是否為台股交易時段（週一至週五 09:00–13:30）"""
+    now = now or taipei_now()
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() <= MARKET_CLOSE
+
+
+def last_market_close(now=None):
+    """最近一次收盤時間（週末往前推到週五）"""
+    now = now or taipei_now()
+    close = datetime.datetime.combine(now.date(), MARKET_CLOSE, tzinfo=TAIPEI_TZ)
+    if now < close:
+        close -= datetime.timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= datetime.timedelta(days=1)
+    return close
+
+
+def _ticker(stock_code):
+    return f"{stock_code}.TW"
+
+
+def _is_stale(entry, now):
+    """判斷快取是否需要更新"""
+    fetched_at = entry["fetched_at"]
+    if is_market_open(now):
+        return (now - fetched_at).total_seconds() > MARKET_DATA_TTL
+    # 盤後：上次抓取若早於最近一次收盤，需補抓收盤資料
+    return fetched_at < last_market_close(now)
+
+
+def _slice_period(df, period):
+    """從完整資料切出指定區間（與 yfinance period 參數相同格式）"""
+    if df.empty or not period:
+        return df
+    if period.endswith("d"):
+        return df.tail(int(period[:-1]))
+    if period.endswith("mo"):
+        start = df.index[-1] - pd.DateOffset(months=int(period[:-2]))
+    elif period.endswith("y"):
+        start = df.index[-1] - pd.DateOffset(years=int(period[:-1]))
+    else:
+        return df
+    return df[df.index > start]
+
+
+def _normalize(df):
+    """統一欄位（history 另有 Dividends / Stock Splits，yf.download 沒有），同一檔股票的快取只有一種格式"""
+    return df.reindex(columns=COLUMNS)
+
+
+def _download(stock_code, entry):
+    """下載完整區間，或在已有快取時只補抓最後一筆之後的資料"""
+    stock = yf.Ticker(_ticker(stock_code))
+    if entry is None:
+        return _normalize(stock.history(period=BASE_PERIOD))
+
+    old_df = entry["df"]
+    new_df = _normalize(stock.history(start=old_df.index[-1].strftime("%Y-%m-%d")))
+    if new_df.empty:
+        return old_df
+
+    # 以新資料覆蓋重疊的日期（盤中的最後一根 K 棒會被收盤資料取代）
+    df = pd.concat([old_df[old_df.index < new_df.index[0]], new_df])
+    return _slice_period(df, BASE_PERIOD)
+
+
+def _store(stock_code, df, now):
+    """寫入快取並依 LRU 淘汰"""
+    size = int(df.memory_usage(deep=True).sum())
+    with _cache_lock:
+        _cache[stock_code] = {"df": df, "fetched_at": now, "bytes": size}
+        _cache.move_to_end(stock_code)
+        total_bytes = sum(entry["bytes"] for entry in _cache.values())
+        while len(_cache) > 1 and (len(_cache) > MAX_TICKERS or total_bytes > MAX_BYTES):
+            _, evicted = _cache.popitem(last=False)
+            total_bytes -= evicted["bytes"]
+            _stats["evictions"] += 1
+
+
+def get_price_history(stock_code, period="6mo"):
+    """
+    取得股票日 K 資料（欄位：Open / High / Low / Close / Volume）
+    :param stock_code: 股票代碼（如 "2330"）
+    :param period: 需要的區間，如 "6d"、"3mo"、"6mo"、"12mo"、"1y"
+    :return: DataFrame 副本，呼叫端可直接修改；查無資料時回傳空的 DataFrame
+    """
+    now = taipei_now()
+    with _cache_lock:
+        entry = _cache.get(stock_code)
+        if entry and not _is_stale(entry, now):
+            _cache.move_to_end(stock_code)
+            _stats["hits"] += 1
+            return _slice_period(entry["df"], period).copy()
+        fetch_lock = _fetch_locks[hash(stock_code) % FETCH_LOCK_STRIPES]
+
+    with fetch_lock:
+        # 其他執行緒可能已經更新完畢
+        with _cache_lock:
+            entry = _cache.get(stock_code)
+            if entry and not _is_stale(entry, now):
+                _stats["hits"] += 1
+                return _slice_period(entry["df"], period).copy()
+            _stats["refreshes" if entry else "misses"] += 1
+
+        try:
+            df = _download(stock_code, entry)
+        except Exception as e:
+            print(f"⚠️ 下載 {stock_code} 股價資料失敗: {e}")
+            with _cache_lock:
+                _stats["fetch_errors"] += 1
+            # 沿用舊資料，但不更新 fetched_at，下次查詢會再重試
+            return _slice_period(entry["df"], period).copy() if entry else pd.DataFrame()
+
+        if df.empty:
+            return df
+
+        _store(stock_code, df, now)
+        return _slice_period(df, period).copy()
+
+
+def _ticker_frame(data, ticker):
+    """從 yf.download 的多檔結果取出單一股票（欄位統一為 COLUMNS）"""
+    if isinstance(data.columns, pd.MultiIndex):
+        if ticker not in data.columns.get_level_values(0):
+            return pd.DataFrame()
+        data = data[ticker]
+    return _normalize(data).dropna(how="all")
+
+
+def prefetch(stock_codes):
+    """
+    以一次 yf.download 下載多檔股票，更新快取中缺少或已過期的股票
+    :return: 實際下載到資料的股票代碼
+    """
+    now = taipei_now()
+    with _cache_lock:
+        stale = [code for code in dict.fromkeys(stock_codes)
+                 if code not in _cache or _is_stale(_cache[code], now)]
+    if not stale:
+        return []
+
+    try:
+        data = yf.download([_ticker(code) for code in stale], period=BASE_PERIOD, group_by="ticker",
+                           auto_adjust=True, ignore_tz=False, progress=False)
+    except Exception as e:
+        print(f"⚠️ 批次下載股價資料失敗: {e}")
+        with _cache_lock:
+            _stats["fetch_errors"] += 1
+        return []
+
+    fetched = []
+    for code in stale:
+        df = _ticker_frame(data, _ticker(code))
+        if df.empty:
+            continue
+        _store(code, df, now)
+        fetched.append(code)
+
+    with _cache_lock:
+        _stats["bulk_downloads"] += 1
+        _stats["prefetched"] += len(fetched)
+    return fetched
+
+
+def get_cache_stats():
+    """回傳快取命中率與使用量"""
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["tickers"] = len(_cache)
+        stats["bytes"] = sum(entry["bytes"] for entry in _cache.values())
+    lookups = stats["hits"] + stats["misses"] + stats["refreshes"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+# 測試
+if __name__ == "__main__":
+    start = time.perf_counter()
+    print(len(get_price_history("2330", "6mo")))
+    print(len(get_price_history("2330", "3mo")))
+    print(len(get_price_history("2330", "6d")))
+    print(f"耗時 {time.perf_counter() - start:.2f} 秒", get_cache_stats())
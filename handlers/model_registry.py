@@ -0,0 +1,100 @@
+"""
+模型快取：常用的 Keras 模型保留在記憶體中，不必每次請求都重新載入 .h5
+
+- 依 LRU 淘汰，限制模型數量（MODEL_CACHE_MAX_MODELS）與約略記憶體大小（MODEL_CACHE_MAX_BYTES）
+- 模型檔案的修改時間改變（離線訓練更新模型）時自動重新載入
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from handlers.inference_backend import load_model as load_inference_model, get_tflite_path
+
+MAX_MODELS = int(os.getenv("MODEL_CACHE_MAX_MODELS", "16"))
+MAX_BYTES = int(os.getenv("MODEL_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_models = OrderedDict()         # model_path -> {"model", "mtime", "bytes"}
+_lock = threading.Lock()
+_load_locks = {}                # 同一個模型同時只載入一次
+_stats = {"hits": 0, "misses": 0, "reloads": 0, "evictions": 0, "loads": 0, "total_load_ms": 0.0, "max_load_ms": 0.0}
+
+
+def _mtime(model_path):
+    """模型檔（含匯出的 .tflite）最後修改時間"""
+    mtime = os.path.getmtime(model_path)
+    tflite_path = get_tflite_path(model_path)
+    if os.path.exists(tflite_path):
+        mtime = max(mtime, os.path.getmtime(tflite_path))
+    return mtime
+
+
+def _estimate_bytes(model, model_path):
+    """以參數量估計模型佔用的記憶體（float32），無法估計時以檔案大小代替"""
+    try:
+        return int(model.count_params()) * 4
+    except Exception:
+        return os.path.getsize(model_path)
+
+
+def _evict():
+    """超過數量或大小上限時，淘汰最久未使用的模型（至少保留一個）"""
+    total_bytes = sum(entry["bytes"] for entry in _models.values())
+    while len(_models) > 1 and (len(_models) > MAX_MODELS or total_bytes > MAX_BYTES):
+        _, evicted = _models.popitem(last=False)
+        total_bytes -= evicted["bytes"]
+        _stats["evictions"] += 1
+
+
+def get_model(model_path, loader=None):
+    """
+    取得模型（優先使用記憶體中的模型）
+    :param model_path: 模型檔路徑
+    :param loader: 載入函式，預設依 INFERENCE_BACKEND 載入 Keras 或 TFLite 模型
+    :raises FileNotFoundError: 模型檔不存在
+    """
+    mtime = _mtime(model_path)
+
+    with _lock:
+        entry = _models.get(model_path)
+        if entry and entry["mtime"] == mtime:
+            _models.move_to_end(model_path)
+            _stats["hits"] += 1
+            return entry["model"]
+        load_lock = _load_locks.setdefault(model_path, threading.Lock())
+
+    with load_lock:
+        # 其他執行緒可能已經載入完成
+        with _lock:
+            entry = _models.get(model_path)
+            if entry and entry["mtime"] == mtime:
+                _models.move_to_end(model_path)
+                _stats["hits"] += 1
+                return entry["model"]
+            _stats["reloads" if entry else "misses"] += 1
+
+        started = time.perf_counter()
+        model = (loader or load_inference_model)(model_path)
+        load_ms = (time.perf_counter() - started) * 1000
+
+        with _lock:
+            _models[model_path] = {"model": model, "mtime": mtime, "bytes": _estimate_bytes(model, model_path)}
+            _models.move_to_end(model_path)
+            _stats["loads"] += 1
+            _stats["total_load_ms"] += load_ms
+            _stats["max_load_ms"] = max(_stats["max_load_ms"], load_ms)
+            _evict()
+        print(f"📦 已載入模型 {model_path}（{load_ms:.0f} ms）")
+        return model
+
+
+def get_stats():
+    """回傳命中率與載入時間統計"""
+    with _lock:
+        stats = dict(_stats)
+        stats["models"] = len(_models)
+        stats["bytes"] = sum(entry["bytes"] for entry in _models.values())
+    lookups = stats["hits"] + stats["misses"] + stats["reloads"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["avg_load_ms"] = round(stats.pop("total_load_ms") / stats["loads"], 2) if stats["loads"] else 0.0
+    stats["max_load_ms"] = round(stats["max_load_ms"], 2)
+    return stats
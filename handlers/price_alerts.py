@@ -0,0 +1,264 @@
+"""
+關注股票到價提醒
+
+使用者以文字設定規則（存在 MongoDB alert_rules 集合）：
+    提醒 2330 > 600          股價高於（含）600
+    提醒 2330 < 550          股價低於（含）550
+    提醒 2330 漲 3%          單日漲幅達 3%
+    提醒 2330 跌 3%          單日跌幅達 3%
+    提醒 2330 RSI > 70       RSI 高於 70（RSI < 30 同理）
+    提醒 2330 黃金交叉       MA5 上穿 MA20（死亡交叉同理）
+    取消提醒 2330            取消該股票的所有提醒（取消提醒 → 全部取消）
+    查詢提醒                 列出目前的提醒
+
+報價快照（handlers/quote_refresher.py）更新後，所有規則與快照合併成一張表一次判斷，
+相同內容的提醒以 multicast 一次送給最多 500 位使用者；每條規則每天最多提醒一次
+"""
+import re
+import datetime
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+from linebot.v3.messaging import MulticastRequest, TextMessage
+from get_username import line_bot_api
+from handlers.stock_watchlist import db, collection as watchlist, quotes
+from handlers.market_data import taipei_now, last_market_close
+
+MULTICAST_LIMIT = 500           # LINE multicast 單次最多 500 位使用者
+MAX_RULES_PER_USER = 20
+
+alert_rules = db["alert_rules"]
+try:
+    alert_rules.create_index([("user_id", ASCENDING), ("stock_code", ASCENDING), ("rule", ASCENDING)],
+                             unique=True, name="user_stock_rule_unique")
+    alert_rules.create_index("stock_code", name="stock_code")
+except PyMongoError as e:
+    print(f"⚠️ 建立提醒規則索引失敗: {e}")
+
+RULE_TEXT = {
+    "price_above": "股價高於 {threshold:g} 元",
+    "price_below": "股價低於 {threshold:g} 元",
+    "change_up": "單日漲幅達 {threshold:g}%",
+    "change_down": "單日跌幅達 {threshold:g}%",
+    "rsi_above": "RSI 高於 {threshold:g}",
+    "rsi_below": "RSI 低於 {threshold:g}",
+    "ma_golden": "MA5 上穿 MA20（黃金交叉）",
+    "ma_death": "MA5 下穿 MA20（死亡交叉）",
+}
+
+RULE_PATTERNS = [
+    (re.compile(r"^提醒(?P<code>\d{4,6})RSI(?P<op>[><])(?P<value>\d+(\.\d+)?)$", re.IGNORECASE), "rsi"),
+    (re.compile(r"^提醒(?P<code>\d{4,6})(?P<op>[><])(?P<value>\d+(\.\d+)?)$"), "price"),
+    (re.compile(r"^提醒(?P<code>\d{4,6})(?P<op>漲|跌)(?P<value>\d+(\.\d+)?)%?$"), "change"),
+    (re.compile(r"^提醒(?P<code>\d{4,6})(?P<op>黃金交叉|死亡交叉)$"), "ma"),
+]
+USAGE = ("📌 提醒設定方式：\n"
+         "提醒 2330 > 600\n提醒 2330 < 550\n提醒 2330 漲 3%\n提醒 2330 跌 3%\n"
+         "提醒 2330 RSI > 70\n提醒 2330 黃金交叉\n取消提醒 2330\n查詢提醒")
+
+
+def parse_rule(text):
+    """
+    解析提醒指令
+    :return: (stock_code, rule, threshold)，格式不符時回傳 None
+    """
+    compact = re.sub(r"\s+", "", text)
+    for pattern, kind in RULE_PATTERNS:
+        match = pattern.match(compact)
+        if not match:
+            continue
+        code, op = match.group("code"), match.group("op")
+        if kind == "ma":
+            return code, "ma_golden" if op == "黃金交叉" else "ma_death", None
+        value = float(match.group("value"))
+        if kind == "change":
+            return code, "change_up" if op == "漲" else "change_down", value
+        return code, f"{kind}_{'above' if op == '>' else 'below'}", value
+    return None
+
+
+def _stock_name(user_id, stock_code):
+    """優先使用關注清單中的名稱，沒有時才查詢證交所"""
+    stock = watchlist.find_one({"user_id": user_id, "stock_code": stock_code}, {"_id": 0, "stock_name": 1})
+    if stock:
+        return stock["stock_name"]
+    from handlers.stock_prediction import get_stock_name
+    return get_stock_name(stock_code)
+
+
+def _describe(rule, threshold):
+    return RULE_TEXT[rule].format(threshold=threshold or 0)
+
+
+def add_rule(user_id, text):
+    parsed = parse_rule(text)
+    if not parsed:
+        return USAGE
+    stock_code, rule, threshold = parsed
+    if alert_rules.count_documents({"user_id": user_id}, limit=MAX_RULES_PER_USER) >= MAX_RULES_PER_USER:
+        return f"⚠️ 最多只能設定 {MAX_RULES_PER_USER} 個提醒，請先取消部分提醒"
+
+    stock_name = _stock_name(user_id, stock_code)
+    # 同一股票的同一種規則只保留一個（更新門檻並重新開始提醒）
+    alert_rules.update_one(
+        {"user_id": user_id, "stock_code": stock_code, "rule": rule},
+        {"$set": {"threshold": threshold, "stock_name": stock_name, "last_triggered": None},
+         "$setOnInsert": {"created_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True
+    )
+    return f"✅ 已設定提醒：{stock_name}（{stock_code}）{_describe(rule, threshold)}"
+
+
+def remove_rules(user_id, stock_code=None):
+    query = {"user_id": user_id}
+    if stock_code:
+        query["stock_code"] = stock_code
+    deleted = alert_rules.delete_many(query).deleted_count
+    if not deleted:
+        return "⚠️ 沒有可以取消的提醒"
+    return f"✅ 已取消 {deleted} 個提醒"
+
+
+def list_rules(user_id):
+    rules = list(alert_rules.find({"user_id": user_id},
+                                  {"_id": 0, "stock_code": 1, "stock_name": 1, "rule": 1, "threshold": 1}))
+    if not rules:
+        return "⚠️ 你目前沒有設定任何提醒！\n\n" + USAGE
+    lines = [f"🔔 {r['stock_name']}（{r['stock_code']}）{_describe(r['rule'], r['threshold'])}" for r in rules]
+    return "📋 你的提醒：\n" + "\n".join(lines)
+
+
+def handle_alert_command(user_id, text):
+    """處理「提醒 / 取消提醒 / 查詢提醒」指令，回傳回覆文字"""
+    compact = re.sub(r"\s+", "", text)
+    try:
+        if compact in ("查詢提醒", "我的提醒"):
+            return list_rules(user_id)
+        if compact.startswith("取消提醒"):
+            return remove_rules(user_id, compact[len("取消提醒"):] or None)
+        return add_rule(user_id, text)
+    except Exception as e:
+        return f"❌ 提醒設定失敗：{str(e)}"
+
+
+def find_triggered(rules, snapshot, today):
+    """
+    將所有規則與報價快照合併後一次判斷
+    :param rules: DataFrame（_id, user_id, stock_code, stock_name, rule, threshold, last_triggered）
+    :param snapshot: DataFrame（stock_code, latest_price, percentage_change, rsi, ma5, ma20, ma5_prev, ma20_prev）
+    :return: 觸發的規則列（含報價欄位）
+    """
+    merged = rules.merge(snapshot, on="stock_code", how="inner")
+    if merged.empty:
+        return merged
+
+    columns = ["threshold", "latest_price", "percentage_change", "rsi", "ma5", "ma20", "ma5_prev", "ma20_prev"]
+    values = {col: pd.to_numeric(merged[col], errors="coerce").to_numpy(dtype=float)
+              for col in columns if col in merged}
+    nan = np.full(len(merged), np.nan)
+    threshold, price, change = values["threshold"], values.get("latest_price", nan), values.get("percentage_change", nan)
+    rsi, ma5, ma20 = values.get("rsi", nan), values.get("ma5", nan), values.get("ma20", nan)
+    ma5_prev, ma20_prev = values.get("ma5_prev", nan), values.get("ma20_prev", nan)
+
+    # NaN 的比較結果為 False，資料不足的規則不會觸發
+    with np.errstate(invalid="ignore"):
+        conditions = {
+            "price_above": price >= threshold,
+            "price_below": price <= threshold,
+            "change_up": change >= threshold,
+            "change_down": change <= -threshold,
+            "rsi_above": rsi >= threshold,
+            "rsi_below": rsi <= threshold,
+            "ma_golden": (ma5 > ma20) & (ma5_prev <= ma20_prev),
+            "ma_death": (ma5 < ma20) & (ma5_prev >= ma20_prev),
+        }
+    rule = merged["rule"].to_numpy()
+    triggered = np.zeros(len(merged), dtype=bool)
+    for name, condition in conditions.items():
+        triggered |= (rule == name) & condition
+
+    # 今天已經提醒過的不再重複
+    triggered &= (merged["last_triggered"].fillna("") != today).to_numpy()
+    return merged[triggered]
+
+
+def drop_stale(snapshot, now):
+    """
+    移除上次收盤前就沒再更新的快照（報價更新失敗時會保留舊快照，不能拿來觸發提醒）
+    :param snapshot: DataFrame（含 updated_at；MongoDB 讀出的時間為不含時區的 UTC）
+    """
+    if "updated_at" not in snapshot:
+        return snapshot.iloc[0:0]
+    updated_at = pd.to_datetime(snapshot["updated_at"], utc=True)
+    return snapshot[(updated_at >= last_market_close(now)).to_numpy()]
+
+
+def _message(row):
+    change = pd.to_numeric(row.percentage_change, errors="coerce")
+    change_text = f"{change:+.2f}%" if not np.isnan(change) else "N/A"
+    return (f"🔔 到價提醒：{row.stock_name}（{row.stock_code}）{_describe(row.rule, row.threshold)}\n"
+            f"🔹 最新價格：{row.latest_price:.2f} 元（{change_text}）")
+
+
+def send_multicast(user_ids, text):
+    """相同內容一次送給多位使用者（每次最多 MULTICAST_LIMIT 位），回傳 API 呼叫次數"""
+    calls = 0
+    for start in range(0, len(user_ids), MULTICAST_LIMIT):
+        line_bot_api.multicast(MulticastRequest(to=user_ids[start:start + MULTICAST_LIMIT],
+                                                messages=[TextMessage(text=text)]))
+        calls += 1
+    return calls
+
+
+def evaluate_alerts():
+    """
+    以目前的報價快照判斷所有提醒規則並推播
+    :return: {"rules", "triggered", "api_calls"}
+    """
+    rules = pd.DataFrame(list(alert_rules.find(
+        {}, {"user_id": 1, "stock_code": 1, "stock_name": 1, "rule": 1, "threshold": 1, "last_triggered": 1}
+    )))
+    if rules.empty:
+        return {"rules": 0, "triggered": 0, "api_calls": 0}
+    if "last_triggered" not in rules:
+        rules["last_triggered"] = None
+    if "threshold" not in rules:
+        rules["threshold"] = np.nan
+
+    snapshot = pd.DataFrame(list(quotes.find({"_id": {"$in": rules["stock_code"].unique().tolist()}})))
+    if snapshot.empty:
+        return {"rules": len(rules), "triggered": 0, "api_calls": 0}
+    now = taipei_now()
+    snapshot = drop_stale(snapshot.rename(columns={"_id": "stock_code"}), now)
+    if snapshot.empty:
+        return {"rules": len(rules), "triggered": 0, "api_calls": 0}
+
+    today = now.date().isoformat()
+    triggered = find_triggered(rules, snapshot, today)
+    if triggered.empty:
+        return {"rules": len(rules), "triggered": 0, "api_calls": 0}
+
+    # 相同股票、相同規則與門檻的訊息內容一樣，合併成一次 multicast
+    api_calls = 0
+    sent_ids = []
+    for _, group in triggered.groupby(["stock_code", "rule", triggered["threshold"].fillna(-1)], sort=False):
+        try:
+            api_calls += send_multicast(group["user_id"].tolist(), _message(group.iloc[0]))
+            sent_ids.extend(group["_id"].tolist())
+        except Exception as e:
+            print(f"❌ 推播提醒失敗: {e}")
+
+    if sent_ids:
+        alert_rules.update_many({"_id": {"$in": sent_ids}}, {"$set": {"last_triggered": today}})
+    print(f"🔔 {len(sent_ids)} 個提醒已送出（{api_calls} 次 API 呼叫）")
+    return {"rules": len(rules), "triggered": len(sent_ids), "api_calls": api_calls}
+
+
+def get_alert_codes():
+    """有設定提醒的股票代碼（報價快照也需要更新這些股票）"""
+    return alert_rules.distinct("stock_code")
+
+
+if __name__ == "__main__":
+    print(evaluate_alerts())
@@ -0,0 +1,125 @@
+"""
+股價歷史資料本地儲存（twstock 日成交資訊），每檔股票一個 CSV 檔
+
+- 第一次使用時補齊近兩年資料（backfill）
+- 之後只補抓最後一筆資料所在月份到本月的資料，通常只需要 1 次請求
+- 收盤後已更新過就不再連網
+
+補齊歷史資料：
+    python -m handlers.price_store 2330 2317 0050
+"""
+import os
+import sys
+import datetime
+import threading
+import pandas as pd
+import twstock
+from handlers.market_data import taipei_now, last_market_close
+
+PRICE_DIR = os.getenv("PRICE_STORE_DIR", "data/prices")
+HISTORY_YEARS = int(os.getenv("PRICE_STORE_YEARS", "2"))
+COLUMNS = ['Date', 'capacity', 'turnover', 'open', 'high', 'low', 'close', 'change', 'transaction']
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _path(stock_code):
+    return os.path.join(PRICE_DIR, f"{stock_code}.csv")
+
+
+def _lock(stock_code):
+    with _locks_guard:
+        return _locks.setdefault(stock_code, threading.Lock())
+
+
+def _month_range(start, end):
+    """產生 start ~ end（含）之間的 (年, 月)，不會超過本月"""
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+
+def _fetch_months(stock_code, start, end):
+    """逐月向證交所抓取資料"""
+    stock = twstock.Stock(stock_code, initial_fetch=False)
+    data = []
+    for year, month in _month_range(start, end):
+        monthly_data = stock.fetch(year, month)
+        if monthly_data:
+            data.extend(monthly_data)
+    df = pd.DataFrame(data, columns=COLUMNS)
+    return df.set_index('Date')
+
+
+def load_prices(stock_code):
+    """讀取本地資料（不連網），沒有資料時回傳空的 DataFrame"""
+    path = _path(stock_code)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=COLUMNS).set_index('Date')
+    return pd.read_csv(path, index_col='Date', parse_dates=['Date'])
+
+
+def _save(stock_code, df):
+    """先寫暫存檔再置換，避免讀到寫一半的檔案"""
+    os.makedirs(PRICE_DIR, exist_ok=True)
+    path = _path(stock_code)
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _is_fresh(stock_code):
+    """最近一次收盤後是否已更新過"""
+    path = _path(stock_code)
+    return os.path.exists(path) and os.path.getmtime(path) >= last_market_close().timestamp()
+
+
+def backfill(stock_code, years=HISTORY_YEARS):
+    """重新抓取近 N 年完整資料並覆蓋本地檔案"""
+    today = taipei_now().date()
+    with _lock(stock_code):
+        df = _fetch_months(stock_code, datetime.date(today.year - years, 1, 1), today)
+        if not df.empty:
+            _save(stock_code, df)
+        return df
+
+
+def update_prices(stock_code):
+    """
+    補抓本地資料缺少的最新交易日並回傳完整資料
+    :return: DataFrame（index 為 Date，欄位同 twstock），查無資料時回傳空的 DataFrame
+    """
+    with _lock(stock_code):
+        df = load_prices(stock_code)
+        if not df.empty:
+            if _is_fresh(stock_code):
+                return df
+
+            today = taipei_now().date()
+            new_df = _fetch_months(stock_code, df.index[-1].date(), today)
+            if not new_df.empty:
+                df = pd.concat([df[df.index < new_df.index[0]], new_df])
+            _save(stock_code, df)  # 沒有新資料也更新時間，避免重複請求
+            return df
+
+    # 沒有本地資料，先補齊歷史資料
+    return backfill(stock_code)
+
+
+def get_training_data(stock_code, years=HISTORY_YEARS):
+    """取得訓練用的近 N 年資料（自 N 年前的 1 月 1 日起）"""
+    df = update_prices(stock_code)
+    if df.empty:
+        return df
+    start = pd.Timestamp(taipei_now().year - years, 1, 1)
+    return df[df.index >= start]
+
+
+if __name__ == "__main__":
+    for code in sys.argv[1:]:
+        result = backfill(code)
+        print(f"✅ {code} 已儲存 {len(result)} 筆資料" if not result.empty else f"❌ {code} 查無資料")
@@ -0,0 +1,138 @@
+"""
+關注股票報價快照：定期把所有使用者關注的股票（去除重複）一次批次更新，
+寫入 MongoDB quotes 集合，get_watchlist 直接讀取快照，不必每位使用者各自下載
+
+- 盤中每 QUOTE_REFRESH_INTERVAL 秒更新一次；收盤後再更新一次收盤資料，之後到下個交易時段都不再連網
+- 快照另外包含 RSI / MA5 / MA20（含前一日）供到價提醒使用，每次更新後判斷提醒規則（handlers/price_alerts.py）
+- 常駐執行：python -m handlers.quote_refresher
+- 只更新一次：python -m handlers.quote_refresher --once
+- 也可以設定 QUOTE_REFRESHER=thread 由 app.py 在背景執行緒執行（多個 worker 時建議改用獨立行程）
+"""
+import os
+import time
+import datetime
+import argparse
+import threading
+import numpy as np
+from pymongo import ReplaceOne
+from handlers.market_data import taipei_now, is_market_open, last_market_close, get_price_history
+from handlers.stock_watchlist import collection, quotes, get_stockdata_bulk
+from handlers.indicators import compute_all
+from handlers.price_alerts import evaluate_alerts, get_alert_codes
+
+QUOTE_REFRESH_INTERVAL = int(os.getenv("QUOTE_REFRESH_INTERVAL", "60"))
+
+_lock = threading.Lock()
+_stats = {"refreshes": 0, "tickers": 0, "errors": 0, "last_refresh": None, "last_seconds": 0.0}
+
+
+def get_watched_codes():
+    """所有使用者關注中、或設定提醒的股票代碼（去除重複）"""
+    return sorted(set(collection.distinct("stock_code")) | set(get_alert_codes()))
+
+
+def _float_or_none(value):
+    return None if value is None or np.isnan(value) else round(float(value), 4)
+
+
+def get_indicator_snapshots(stock_codes):
+    """
+    最新與前一日的 RSI / MA5 / MA20（股價資料已由批次下載放入快取）
+    所有股票的收盤價排成矩陣（股票 × 天數，靠右對齊最新一天）一次計算
+    :return: {股票代碼: 指標 dict}
+    """
+    closes = {}
+    for code in stock_codes:
+        # 單一股票取不到歷史資料時只略過該股票的指標，報價快照照常更新
+        try:
+            closes[code] = get_price_history(code, period="6mo")["Close"].to_numpy(dtype=float)
+        except Exception as e:
+            print(f"⚠️ {code} 歷史股價取得失敗，略過技術指標: {e}")
+    codes = [code for code, values in closes.items() if len(values) >= 2]
+    if not codes:
+        return {}
+
+    matrix = np.full((len(codes), max(len(closes[code]) for code in codes)), np.nan)
+    for i, code in enumerate(codes):
+        matrix[i, -len(closes[code]):] = closes[code]
+    indicators = compute_all(matrix)
+    rsi, ma5, ma20 = indicators["RSI"], indicators["MA5"], indicators["MA20"]
+    return {
+        code: {
+            "rsi": _float_or_none(rsi[i, -1]),
+            "ma5": _float_or_none(ma5[i, -1]),
+            "ma20": _float_or_none(ma20[i, -1]),
+            "ma5_prev": _float_or_none(ma5[i, -2]),
+            "ma20_prev": _float_or_none(ma20[i, -2]),
+        }
+        for i, code in enumerate(codes)
+    }
+
+
+def refresh_quotes(stock_codes=None):
+    """
+    批次更新報價並寫入快照（一次下載、一次 bulk_write）
+    :return: 成功更新的股票數
+    """
+    started = time.perf_counter()
+    stock_codes = stock_codes or get_watched_codes()
+    if not stock_codes:
+        return 0
+
+    updated_at = datetime.datetime.now(datetime.timezone.utc)
+    results = get_stockdata_bulk(stock_codes)
+    # 查詢失敗的股票保留舊快照
+    succeeded = [code for code, data in results.items() if "error" not in data]
+    try:
+        snapshots = get_indicator_snapshots(succeeded)
+    except Exception as e:
+        print(f"⚠️ 技術指標計算失敗，本次只更新報價: {e}")
+        snapshots = {}
+    operations = [
+        ReplaceOne({"_id": code}, dict(results[code], **snapshots.get(code, {}), updated_at=updated_at), upsert=True)
+        for code in succeeded
+    ]
+    if operations:
+        quotes.bulk_write(operations, ordered=False)
+
+    with _lock:
+        _stats["refreshes"] += 1
+        _stats["tickers"] = len(operations)
+        _stats["errors"] += len(results) - len(operations)
+        _stats["last_refresh"] = updated_at.isoformat()
+        _stats["last_seconds"] = round(time.perf_counter() - started, 2)
+    print(f"🔄 已更新 {len(operations)}/{len(stock_codes)} 檔股票報價快照")
+    return len(operations)
+
+
+def run_forever(interval=QUOTE_REFRESH_INTERVAL):
+    """常駐更新：盤中定期更新，收盤後補一次收盤資料；每次更新後判斷到價提醒"""
+    last_refresh = None
+    while True:
+        now = taipei_now()
+        if is_market_open(now) or last_refresh is None or last_refresh < last_market_close(now):
+            try:
+                refresh_quotes()
+                last_refresh = now
+                evaluate_alerts()
+            except Exception as e:
+                print(f"⚠️ 更新報價快照失敗: {e}")
+        time.sleep(interval)
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="更新關注股票的共用報價快照")
+    parser.add_argument("--once", action="store_true", help="只更新一次")
+    parser.add_argument("--interval", type=int, default=QUOTE_REFRESH_INTERVAL, help="盤中更新間隔（秒）")
+    args = parser.parse_args()
+
+    if args.once:
+        refresh_quotes()
+        evaluate_alerts()
+    else:
+        run_forever(args.interval)
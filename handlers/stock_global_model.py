@@ -0,0 +1,136 @@
+"""
+所有股票共用的 LSTM 預測模型（STOCK_MODEL_MODE=global 時使用）
+
+輸入為 60 天的技術指標視窗（與單檔模型相同的欄位）加上股票代碼的 embedding：
+- 只需訓練一次、保存一個模型，記憶體與訓練成本不會隨股票數量增加
+- 沒訓練過的股票使用「未知股票」的 embedding（編號 0），同樣可以預測
+- 多檔股票可以在一次 forward pass 中同時預測
+"""
+import os
+import json
+import numpy as np
+from handlers.stock_prediction import (
+    MODEL_DIR, TIME_STEP, FEATURE_COLUMNS, prepare_features, prepare_latest_windows, make_windows,
+    inverse_close, get_model_path, save_model_version, save_last_prediction,
+)
+from handlers.model_registry import get_model
+
+GLOBAL_MODEL_NAME = "global"
+VOCAB_PATH = os.path.join(MODEL_DIR, "global_lstm_vocab.json")
+EMBEDDING_DIM = 8
+UNKNOWN_TICKER = 0
+TICKER_DROPOUT = 0.1        # 訓練時隨機將部分樣本視為未知股票，讓編號 0 學到通用的表示
+
+
+def load_vocab():
+    """股票代碼 → embedding 編號（編號只會新增，不會重新分配）"""
+    try:
+        with open(VOCAB_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_vocab(vocab):
+    tmp_path = f"{VOCAB_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    os.replace(tmp_path, VOCAB_PATH)
+
+
+def build_global_model(vocab_size, n_features=len(FEATURE_COLUMNS)):
+    """建立共用模型：技術指標視窗 + 股票 embedding"""
+    from tensorflow.keras import Model
+    from tensorflow.keras.layers import (
+        Input, Embedding, Flatten, RepeatVector, Concatenate, LSTM, Dense, Dropout, Bidirectional
+    )
+
+    window = Input(shape=(TIME_STEP, n_features), name="window")
+    ticker = Input(shape=(1,), dtype="int32", name="ticker")
+
+    # 每個時間點都接上股票 embedding
+    embedding = Embedding(vocab_size, EMBEDDING_DIM)(ticker)
+    embedding = RepeatVector(TIME_STEP)(Flatten()(embedding))
+    x = Concatenate()([window, embedding])
+
+    x = Bidirectional(LSTM(128, return_sequences=True))(x)
+    x = Dropout(0.2)(x)
+    x = Bidirectional(LSTM(128, return_sequences=True))(x)
+    x = Dropout(0.2)(x)
+    x = Bidirectional(LSTM(64, return_sequences=True))(x)
+    x = Dropout(0.2)(x)
+    x = Bidirectional(LSTM(64, return_sequences=False))(x)
+    x = Dropout(0.2)(x)
+    x = Dense(64, activation='relu')(x)
+    output = Dense(1)(x)
+
+    model = Model(inputs=[window, ticker], outputs=output)
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+
+def train_global_model(stock_codes, epochs=10):
+    """
+    以所有股票的資料訓練共用模型，並更新每檔股票最後一次的預測價格
+    :return: {stock_code: 預測價格}
+    """
+    vocab = load_vocab()
+    for stock_code in sorted(stock_codes):
+        if stock_code not in vocab:
+            vocab[stock_code] = len(vocab) + 1  # 0 保留給未知股票
+
+    windows, ticker_ids, targets = [], [], []
+    for stock_code in stock_codes:
+        prepared = prepare_features(stock_code)
+        if prepared is None:
+            print(f"⚠️ {stock_code} 股價數據不足，略過")
+            continue
+        _, _, scaled_data = prepared
+        X = make_windows(scaled_data)
+        windows.append(X)
+        ticker_ids.append(np.full(len(X), vocab[stock_code], dtype="int32"))
+        targets.append(scaled_data[TIME_STEP:, 0])
+
+    if not windows:
+        raise ValueError("沒有可用的訓練資料")
+
+    X = np.concatenate(windows)
+    ids = np.concatenate(ticker_ids)
+    y = np.concatenate(targets)
+    ids = np.where(np.random.rand(len(ids)) < TICKER_DROPOUT, UNKNOWN_TICKER, ids)
+
+    model = build_global_model(len(vocab) + 1)
+    model.fit({"window": X, "ticker": ids.reshape(-1, 1)}, y, epochs=epochs, batch_size=64, shuffle=True, verbose=0)
+
+    # 先置換模型再寫入新的編號表：舊模型 + 新編號表的空窗期，新股票會被當成未知股票
+    save_model_version(model, GLOBAL_MODEL_NAME)
+    _save_vocab(vocab)
+
+    predictions = predict_global(stock_codes, model=model, vocab=vocab)
+    for stock_code, predicted_price in predictions.items():
+        if not isinstance(predicted_price, str):
+            save_last_prediction(stock_code, predicted_price)
+    return predictions
+
+
+def predict_global(stock_codes, model=None, vocab=None):
+    """
+    以共用模型一次預測多檔股票的下一個交易日收盤價
+    :return: {stock_code: 預測價格或錯誤訊息}
+    """
+    model = model or get_model(get_model_path(GLOBAL_MODEL_NAME))
+    vocab = vocab or load_vocab()
+
+    results = {}
+    windows = prepare_latest_windows(stock_codes)
+    codes = [code for code in stock_codes if isinstance(windows[code], tuple)]
+    results.update({code: windows[code] for code in stock_codes if code not in codes})
+
+    if codes:
+        X = np.stack([windows[code][1] for code in codes])
+        ids = np.array([vocab.get(code, UNKNOWN_TICKER) for code in codes], dtype="int32").reshape(-1, 1)
+        scaled_preds = model.predict({"window": X, "ticker": ids}, batch_size=len(X), verbose=0)[:, 0]
+        for stock_code, scaled_pred in zip(codes, scaled_preds):
+            results[stock_code] = round(inverse_close(windows[stock_code][0], scaled_pred)[0], 2)
+
+    return results
@@ -1,4 +1,3 @@
-import yfinance as yf
 import mplfinance as mpf
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -6,6 +5,7 @@ import matplotlib.font_manager as fm
 import datetime
 import os
 from handlers.stock_prediction import get_stock_name
+from handlers.market_data import get_price_history
 #from stock_prediction import get_stock_name    # 測試用
 
 
@@ -28,8 +28,7 @@ def plot_stock_chart(stock_code):
     """
     try:
         # 抓取股票數據（最近 3 個月）
-        stock = yf.Ticker(f"{stock_code}.TW")
-        df = stock.history(period="3mo")
+        df = get_price_history(stock_code, period="3mo")
 
         if df.empty:
             print(f"❌ 找不到 {stock_code} 的股票數據")
@@ -3,18 +3,20 @@
 """
 
 import os
+import json
+import shutil
 import datetime
-import twstock
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
-from tensorflow.keras.models import load_model, Sequential
-from tensorflow.keras.layers import LSTM, Dense, Dropout, Bidirectional
-import ta        # 技術指標庫
 import requests
-import yfinance as yf
-import pandas as pd
-import numpy as np
+from handlers.market_data import get_price_history
+from handlers.indicators import calculate_indicators, add_feature_columns
+from handlers.price_store import get_training_data
+from handlers.model_registry import get_model
+from handlers.inference_backend import INFERENCE_BACKEND, export_tflite, get_tflite_path
 
 
 def get_stock_name(stock_code):
@@ -34,51 +36,25 @@ def get_stock_name(stock_code):
 
 def get_technical_indicators(stock_code):
     """ 取得股票技術指標（均線、RSI、MACD） """
-    stock = yf.Ticker(f"{stock_code}.TW")
-    df = stock.history(period="6mo")
+    df = get_price_history(stock_code, period="6mo")
 
     if len(df) < 30:
-        df = stock.history(period="12mo")
+        df = get_price_history(stock_code, period="12mo")
 
     if df.empty:
         return {"error": "無法獲取股價數據"}
 
-    df["Close"] = df["Close"].ffill()
-
-    # 計算均線
-    df["MA5"] = df["Close"].rolling(window=5).mean()
-    df["MA20"] = df["Close"].rolling(window=20).mean()
-
-    # 計算 RSI
-    if len(df) >= 14:
-        delta = df["Close"].diff()
-        gain = delta.where(delta > 0, 0)
-        loss = -delta.where(delta < 0, 0)
-
-        avg_gain = gain.rolling(window=14, min_periods=14).mean()
-        avg_loss = loss.rolling(window=14, min_periods=14).mean()
-
-        rs = avg_gain / avg_loss
-        df["RSI"] = 100 - (100 / (1 + rs))
-
-        if df["RSI"].isna().all():
-            return {"error": "⚠️ RSI 計算失敗，數據異常"}
-
-    else:
+    if len(df) < 14:
         return {"error": "⚠️ 股票數據不足，無法計算 RSI"}
 
-    # 計算 MACD
-    short_ema = df["Close"].ewm(span=12, adjust=False).mean()
-    long_ema = df["Close"].ewm(span=26, adjust=False).mean()
-    df["MACD"] = short_ema - long_ema
-    df["MACD_SIGNAL"] = df["MACD"].ewm(span=9, adjust=False).mean()
-    df["MACD_HIST"] = df["MACD"] - df["MACD_SIGNAL"]  # 柱狀圖
+    df = calculate_indicators(df)
+    if df["RSI"].isna().all():
+        return {"error": "⚠️ RSI 計算失敗，數據異常"}
 
     latest = df.iloc[-1]
     prev = df.iloc[-2]
 
     # 計算成交量變化
-    df["Volume_MA5"] = df["Volume"].rolling(window=5).mean()
     volume_surge = latest["Volume"] > df["Volume_MA5"].iloc[-1] * 1.5  # 異常放量
 
     # 技術指標訊號
@@ -145,6 +121,9 @@ def get_technical_indicators(stock_code):
     }
 
     
+_holidays = {}      # 年份 -> 休市日期（每年只查詢一次，多檔股票各自預測時不必重複呼叫 API）
+
+
 def is_trading_day():
     """ 檢查今天是否為交易日（台灣證券交易所 API）"""
     today = datetime.date.today()
@@ -153,118 +132,286 @@ def is_trading_day():
     if weekday >= 5:  # 週六 & 週日不是交易日
         return False
 
+    if today.year in _holidays:
+        return today not in _holidays[today.year]
+
     url = f"https://www.twse.com.tw/holidaySchedule/holidaySchedule?response=json&year={today.year}"
     
     try:
         response = requests.get(url)
         data = response.json()
         if "data" in data:
-            holidays = [datetime.datetime.strptime(d[0], "%Y/%m/%d").date() for d in data["data"]]
+            holidays = {datetime.datetime.strptime(d[0], "%Y/%m/%d").date() for d in data["data"]}
+            _holidays[today.year] = holidays
             return today not in holidays
     except:
         return True  # 無法查詢時，預設為交易日
 
     return True
 
-# 一次查詢多支股票
-def predict_multiple_stocks(stock_codes):
-    predictions = {}
-    for stock_code in stock_codes:
-        try:
-            predictions[stock_code] = predict_stock_price(stock_code)
-        except Exception as e:
-            predictions[stock_code] = f"錯誤：{str(e)}"
-    return predictions
+MODEL_DIR = "models"
+TIME_STEP = 60              # 過去 60 天預測下一天
+FEATURE_COLUMNS = ['close', 'RSI', 'MACD', 'MACD_signal', 'Bollinger_High', 'Bollinger_Low']
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "3"))    # 每檔股票保留的模型版本數
+STOCK_MODEL_MODE = os.getenv("STOCK_MODEL_MODE", "per_ticker")      # per_ticker：每檔一個模型 / global：所有股票共用一個模型
+RECENT_QUERIES_PATH = os.path.join(MODEL_DIR, "recent_queries.json")
 
-def predict_stock_price(stock_code):
-    model_path = f"models/{stock_code}_lstm_model.h5"
+_recent_lock = threading.Lock()
+_recorded_today = {}        # 避免同一天重複寫檔
 
-    # 1️⃣ 檢查今天是否為交易日
-    if not is_trading_day():
-        # 今天不是交易日，直接返回最後一次預測的價格
-        if os.path.exists(model_path):
-            last_predicted_price = np.load(f"models/{stock_code}_last_pred.npy")
-            return last_predicted_price
-        return "⚠️ 今天非交易日，且無過去預測數據"
 
-    # 2️⃣ 檢查模型是否需要重新訓練
-    today = datetime.date.today()
-    last_training_date = None
-    if os.path.exists(model_path):
-        last_training_date = datetime.datetime.fromtimestamp(os.path.getmtime(model_path)).date()
-
-    need_retrain = last_training_date is None or (today - last_training_date).days >= 1
-
-    # 3️⃣ 取得最新股價數據
-    stock = twstock.Stock(stock_code)
-    start_year = today.year - 2
-    data = []
-    for year in range(start_year, today.year + 1):
-        for month in range(1, 13):
-            monthly_data = stock.fetch(year, month)
-            if monthly_data:
-                data.extend(monthly_data)
-
-    if not data:
-        return "⚠️ 無法取得股票數據，請檢查股票代碼是否正確。"
+def get_model_path(stock_code):
+    """目前使用中的模型檔（由離線訓練更新）"""
+    return os.path.join(MODEL_DIR, f"{stock_code}_lstm_model.h5")
+
+
+def record_query(stock_code):
+    """記錄近期被查詢的股票，供收盤後的離線訓練使用"""
+    today = datetime.date.today().isoformat()
+    if _recorded_today.get(stock_code) == today:
+        return
+
+    with _recent_lock:
+        try:
+            with open(RECENT_QUERIES_PATH, "r", encoding="utf-8") as f:
+                recent = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            recent = {}
+
+        recent[stock_code] = today
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        tmp_path = f"{RECENT_QUERIES_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(recent, f)
+        os.replace(tmp_path, RECENT_QUERIES_PATH)
+        _recorded_today[stock_code] = today
+
+
+def get_recent_queries(days=7):
+    """取得最近 N 天內被查詢過的股票代碼"""
+    try:
+        with open(RECENT_QUERIES_PATH, "r", encoding="utf-8") as f:
+            recent = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return []
+
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    return [code for code, date in recent.items() if datetime.date.fromisoformat(date) >= since]
 
-    df = pd.DataFrame(data, columns=['Date', 'capacity', 'turnover', 'open', 'high', 'low', 'close', 'change', 'transaction'])
-    df.set_index('Date', inplace=True)
 
-    # 4️⃣ 計算技術指標
-    df['RSI'] = ta.momentum.RSIIndicator(df['close'], window=14).rsi()
-    df['MACD'] = ta.trend.MACD(df['close']).macd()
-    df['MACD_signal'] = ta.trend.MACD(df['close']).macd_signal()
-    df['Bollinger_High'] = ta.volatility.BollingerBands(df['close']).bollinger_hband()
-    df['Bollinger_Low'] = ta.volatility.BollingerBands(df['close']).bollinger_lband()
+def prepare_features(stock_code):
+    """
+    取得股價數據並計算技術指標，回傳正規化後的特徵
+    :return: (features, scaler, scaled_data)，查無資料時回傳 None
+    """
+    df = get_training_data(stock_code)
+    if df.empty:
+        return None
+
+    # 計算技術指標
+    df = add_feature_columns(df)
 
     df.dropna(inplace=True)
+    if len(df) <= TIME_STEP:
+        return None
 
-    # 5️⃣ 特徵選擇
-    feature_columns = ['close', 'RSI', 'MACD', 'MACD_signal', 'Bollinger_High', 'Bollinger_Low']
-    features = df[feature_columns].values
+    # 特徵選擇
+    features = df[FEATURE_COLUMNS].values
 
     # 正規化數據
     scaler = MinMaxScaler(feature_range=(0, 1))
     scaled_data = scaler.fit_transform(features)
+    return features, scaler, scaled_data
+
+
+def build_model(input_shape):
+    """建立 LSTM 模型"""
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import LSTM, Dense, Dropout, Bidirectional
+
+    model = Sequential([
+        Bidirectional(LSTM(128, return_sequences=True, input_shape=input_shape)),
+        Dropout(0.2),
+        Bidirectional(LSTM(128, return_sequences=True)),
+        Dropout(0.2),
+        Bidirectional(LSTM(64, return_sequences=True)),
+        Dropout(0.2),
+        Bidirectional(LSTM(64, return_sequences=False)),
+        Dropout(0.2),
+        Dense(64, activation='relu'),
+        Dense(1)
+    ])
+    model.compile(optimizer='adam', loss='mean_squared_error')
+    return model
+
+
+def inverse_close(scaler, scaled_close):
+    """將模型輸出的收盤價反標準化"""
+    scaled_close = np.asarray(scaled_close, dtype=float).reshape(-1, 1)
+    padding = np.zeros((len(scaled_close), scaler.n_features_in_ - 1))
+    return scaler.inverse_transform(np.hstack((scaled_close, padding)))[:, 0]
+
+
+def _predict_next(model, features, scaler, scaled_data):
+    """以最近 60 天資料預測下一天收盤價（反標準化後）"""
+    last_60_days = scaled_data[-TIME_STEP:].reshape(1, TIME_STEP, features.shape[1])
+    predicted_price = model.predict(last_60_days, verbose=0)
+    return inverse_close(scaler, predicted_price[:, 0])[0]
+
+
+def _prune_versions(stock_code):
+    """只保留最近 MODEL_KEEP_VERSIONS 個版本"""
+    prefix = f"{stock_code}_lstm_model_"
+    versions = sorted(f for f in os.listdir(MODEL_DIR) if f.startswith(prefix) and f.endswith(".h5"))
+    for filename in versions[:-MODEL_KEEP_VERSIONS]:
+        os.remove(os.path.join(MODEL_DIR, filename))
+
+
+def make_windows(scaled_data):
+    """切出所有 60 天的訓練視窗"""
+    return np.array([scaled_data[i - TIME_STEP:i, :] for i in range(TIME_STEP, len(scaled_data))])
+
+
+def save_model_version(model, name):
+    """儲存版本化的模型檔（models/{name}_lstm_model_{版本}.h5），再置換為使用中的模型"""
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    version = datetime.datetime.now().strftime("%Y%m%d%H%M")
+    version_path = os.path.join(MODEL_DIR, f"{name}_lstm_model_{version}.h5")
+    model.save(version_path)
+
+    # tflite 推論模式：先匯出 .tflite，再置換 .h5（線上服務一律優先讀取 .tflite）
+    model_path = get_model_path(name)
+    if INFERENCE_BACKEND == "tflite":
+        export_tflite(version_path, get_tflite_path(model_path))
+
+    # 先複製成暫存檔再置換，線上服務不會讀到寫一半的模型
+    shutil.copyfile(version_path, f"{model_path}.tmp")
+    os.replace(f"{model_path}.tmp", model_path)
+    _prune_versions(name)
+
+
+def save_last_prediction(stock_code, predicted_price):
+    """存儲預測價格，假日時可以使用"""
+    np.save(os.path.join(MODEL_DIR, f"{stock_code}_last_pred.npy"), predicted_price)
+
+
+def train_model(stock_code, epochs=10):
+    """
+    離線訓練模型：儲存版本化的模型檔（models/{代碼}_lstm_model_{日期}.h5），
+    再置換為使用中的模型，並更新最後一次預測價格
+    """
+    prepared = prepare_features(stock_code)
+    if prepared is None:
+        raise ValueError(f"{stock_code} 股價數據不足，無法訓練")
+    features, scaler, scaled_data = prepared
+
+    X = make_windows(scaled_data)
+    model = build_model((X.shape[1], X.shape[2]))
+    model.fit(X, scaled_data[TIME_STEP:], epochs=epochs, batch_size=32, verbose=0)
+    save_model_version(model, stock_code)
+
+    predicted_price = _predict_next(model, features, scaler, scaled_data)
+    save_last_prediction(stock_code, predicted_price)
+    return round(predicted_price, 2)
+
+
+def _prepare_latest_window(stock_code):
+    """準備單檔股票最近 60 天的特徵視窗，失敗時回傳錯誤訊息"""
+    try:
+        prepared = prepare_features(stock_code)
+    except Exception as e:
+        return f"錯誤：{str(e)}"
+    if prepared is None:
+        return "⚠️ 無法取得股票數據，請檢查股票代碼是否正確。"
+    _, scaler, scaled_data = prepared
+    return scaler, scaled_data[-TIME_STEP:]
+
+
+def prepare_latest_windows(stock_codes):
+    """
+    平行準備多檔股票的 60 天視窗（取得股價、計算指標以 I/O 為主）
+    :return: {stock_code: (scaler, window) 或錯誤訊息}
+    """
+    if not stock_codes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(stock_codes), 8)) as executor:
+        return dict(zip(stock_codes, executor.map(_prepare_latest_window, stock_codes)))
+
+
+# 一次查詢多支股票
+def predict_multiple_stocks(stock_codes):
+    """
+    預測多檔股票：先平行準備所有股票的 60 天視窗，再依模型分組，每個模型只做一次 forward pass
+    - 共用模型（STOCK_MODEL_MODE=global）：所有股票合併成一個批次，只需一次 forward pass
+    - 每檔一個模型（per_ticker）：每個模型只對應一檔股票，仍是每檔各一次 batch=1 的預測，
+      省下的只有平行準備資料與模型常駐記憶體；需要批次加速時請使用共用模型
+    :return: {stock_code: 預測價格或提示訊息}
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    global_mode = STOCK_MODEL_MODE == "global"
+    trading_day = is_trading_day()
+    predictions = {}
+    groups = {}                 # model_path -> [stock_code, ...]
 
-    # 設定時間步長 (過去 60 天預測下一天)
-    time_step = 60
-    X = [scaled_data[i - time_step:i, :] for i in range(time_step, len(scaled_data))]
-    X = np.array(X)
+    for stock_code in stock_codes:
+        model_path = get_model_path("global" if global_mode else stock_code)
+        last_pred_path = os.path.join(MODEL_DIR, f"{stock_code}_last_pred.npy")
+        record_query(stock_code)
 
-    # 6️⃣ 如果模型已存在且數據是最新的，就直接載入模型
-    if os.path.exists(model_path) and not need_retrain:
-        model = load_model(model_path)
+        # 今天不是交易日，直接返回最後一次預測的價格
+        if not trading_day:
+            if os.path.exists(model_path) and os.path.exists(last_pred_path):
+                predictions[stock_code] = np.load(last_pred_path)
+            else:
+                predictions[stock_code] = "⚠️ 今天非交易日，且無過去預測數據"
+        # 尚未有模型時不在線上訓練，等收盤後的離線訓練
+        elif not os.path.exists(model_path):
+            predictions[stock_code] = "⏳ 尚未建立預測模型，將於今日收盤後訓練"
+        else:
+            groups.setdefault(model_path, []).append(stock_code)
+
+    if not groups:
+        return predictions
+
+    # 共用模型：任何股票（包含沒訓練過的）都用同一個模型一次預測
+    if global_mode:
+        from handlers.stock_global_model import predict_global
+        pending = [code for codes in groups.values() for code in codes]
+        try:
+            batch_results = predict_global(pending)
+        except Exception as e:
+            batch_results = {code: f"錯誤：{str(e)}" for code in pending}
     else:
-        # 重新訓練模型
-        model = Sequential([
-            Bidirectional(LSTM(128, return_sequences=True, input_shape=(X.shape[1], X.shape[2]))),
-            Dropout(0.2),
-            Bidirectional(LSTM(128, return_sequences=True)),
-            Dropout(0.2),
-            Bidirectional(LSTM(64, return_sequences=True)),
-            Dropout(0.2),
-            Bidirectional(LSTM(64, return_sequences=False)),
-            Dropout(0.2),
-            Dense(64, activation='relu'),
-            Dense(1)
-        ])
-
-        model.compile(optimizer='adam', loss='mean_squared_error')
-        model.fit(X, scaled_data[time_step:], epochs=10, batch_size=32)
-        model.save(model_path)
-
-    # 7️⃣ 預測未來一天的股價
-    last_60_days = scaled_data[-time_step:].reshape(1, time_step, X.shape[2])
-    predicted_price = model.predict(last_60_days)
-
-    # 反標準化
-    predicted_price = scaler.inverse_transform(
-        np.hstack((predicted_price, np.zeros((1, features.shape[1] - 1))))
-    )[0][0]
-
-    # 存儲預測價格，假日時可以使用
-    np.save(f"models/{stock_code}_last_pred.npy", predicted_price)
-
-    return round(predicted_price, 2)
\ No newline at end of file
+        batch_results = {}
+        windows = prepare_latest_windows([code for codes in groups.values() for code in codes])
+
+        for model_path, codes in groups.items():
+            ready = [code for code in codes if isinstance(windows[code], tuple)]
+            for code in codes:
+                if not isinstance(windows[code], tuple):
+                    batch_results[code] = windows[code]
+            if not ready:
+                continue
+
+            try:
+                model = get_model(model_path)   # 模型保留在記憶體中，檔案更新時才重新載入
+                X = np.stack([windows[code][1] for code in ready])
+                scaled_preds = model.predict(X, batch_size=len(X), verbose=0)[:, 0]
+            except Exception as e:
+                batch_results.update({code: f"錯誤：{str(e)}" for code in ready})
+                continue
+
+            for code, scaled_pred in zip(ready, scaled_preds):
+                batch_results[code] = round(inverse_close(windows[code][0], scaled_pred)[0], 2)
+
+    for stock_code, predicted_price in batch_results.items():
+        if not isinstance(predicted_price, str):
+            save_last_prediction(stock_code, predicted_price)   # 存儲預測價格，假日時可以使用
+        predictions[stock_code] = predicted_price
+
+    return {stock_code: predictions[stock_code] for stock_code in stock_codes}
+
+
+def predict_stock_price(stock_code):
+    """載入已訓練好的模型預測下一個交易日股價（不在線上訓練，模型由 train_models.py 收盤後更新）"""
+    return predict_multiple_stocks([stock_code])[stock_code]
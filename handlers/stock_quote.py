@@ -0,0 +1,114 @@
+"""
+多檔股票查詢：股票名稱、技術指標、股價預測對所有代碼同時進行
+
+- STOCK_QUERY_CONCURRENCY：同時進行的查詢上限
+- STOCK_QUERY_TIMEOUT：單次查詢逾時秒數（從該查詢開始執行時起算，排隊時間不計入）
+- 錯誤依查詢項目分別回報：只有預測失敗或逾時時，名稱與技術指標照常回傳
+- 每檔股票的預測各自一個查詢，單一股票失敗或逾時不影響其他股票；
+  共用模型（STOCK_MODEL_MODE=global）時所有股票一次批次預測，批次失敗再改為逐檔預測
+"""
+import os
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from handlers.stock_prediction import (
+    STOCK_MODEL_MODE, get_stock_name, get_technical_indicators, predict_multiple_stocks, predict_stock_price
+)
+
+STOCK_QUERY_CONCURRENCY = int(os.getenv("STOCK_QUERY_CONCURRENCY", "8"))
+STOCK_QUERY_TIMEOUT = float(os.getenv("STOCK_QUERY_TIMEOUT", "30"))
+TIMEOUT_ERROR = "查詢逾時"
+
+# 共用的執行緒池，限制整個程序同時進行的查詢數量
+executor = ThreadPoolExecutor(max_workers=STOCK_QUERY_CONCURRENCY, thread_name_prefix="stock-quote")
+
+QUERY_FUNCTIONS = {
+    "name": get_stock_name,
+    "tech": get_technical_indicators,
+    "prediction": predict_stock_price,
+}
+
+
+def _submit(func, *args):
+    """
+    送出查詢
+    :return: (future, started)，started["at"] 為開始執行的時間（排隊中時不存在）
+    """
+    started = {}
+
+    def run():
+        started["at"] = time.monotonic()
+        return func(*args)
+
+    return executor.submit(run), started
+
+
+def iter_stock_quotes(stock_codes, timeout=None):
+    """
+    同時查詢多檔股票，每檔股票的各項查詢都完成後立即回傳
+    :param stock_codes: 股票代碼列表
+    :param timeout: 單次查詢逾時秒數（預設 STOCK_QUERY_TIMEOUT）
+    :return: 產生 (stock_code, {"name": ..., "tech": ..., "prediction": ...}, {查詢項目: 錯誤訊息})，
+             失敗的項目值為 None，全部成功時錯誤為空 dict
+    """
+    timeout = timeout or STOCK_QUERY_TIMEOUT
+    stock_codes = list(dict.fromkeys(stock_codes))  # 重複代碼只查一次
+    futures = {}    # future -> (股票代碼, 查詢項目, started)；股票代碼為 None 表示批次預測
+
+    def add(stock_code, key, func, *args):
+        future, started = _submit(func, *args)
+        futures[future] = (stock_code, key, started)
+
+    for stock_code in stock_codes:
+        for key, func in QUERY_FUNCTIONS.items():
+            if key != "prediction" or STOCK_MODEL_MODE != "global":
+                add(stock_code, key, func, stock_code)
+    if STOCK_MODEL_MODE == "global":
+        add(None, "prediction", predict_multiple_stocks, stock_codes)  # 共用模型：所有股票一次 forward pass
+
+    # 排隊中的查詢尚未開始計時，另以排隊輪數設整體上限，避免執行緒池被占滿時無限等待
+    rounds = math.ceil(len(futures) / STOCK_QUERY_CONCURRENCY)
+    overall_deadline = time.monotonic() + timeout * (rounds + 1)
+
+    results = {stock_code: {} for stock_code in stock_codes}
+    errors = {}
+
+    def record(codes, key, values, error=None):
+        for code in codes:
+            if code not in results:
+                continue
+            results[code][key] = values.get(code)
+            if error:
+                errors.setdefault(code, {})[key] = error
+            if set(results[code]) == set(QUERY_FUNCTIONS):
+                yield code, results.pop(code), errors.pop(code, {})
+
+    while futures:
+        now = time.monotonic()
+        # 已執行超過 timeout 的查詢個別標記逾時，不影響其他查詢
+        for future, (stock_code, key, started) in list(futures.items()):
+            if not future.done() and (now >= overall_deadline or now - started.get("at", now) >= timeout):
+                future.cancel()
+                del futures[future]
+                yield from record(stock_codes if stock_code is None else [stock_code], key, {}, TIMEOUT_ERROR)
+        if not futures:
+            break
+
+        # 尚未開始的查詢最早也要 now + timeout 才會逾時
+        next_deadline = min([started["at"] + timeout for _, _, started in futures.values() if "at" in started]
+                            + [now + timeout, overall_deadline])
+        done, _ = wait(futures, timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            stock_code, key, _ = futures.pop(future)
+            try:
+                value = future.result()
+            except Exception as e:
+                if stock_code is None:
+                    # 批次預測失敗：改為逐檔預測，只有出錯的股票會失敗
+                    for code in stock_codes:
+                        add(code, key, predict_stock_price, code)
+                    continue
+                yield from record([stock_code], key, {}, str(e))
+                continue
+            yield from record(stock_codes if stock_code is None else [stock_code], key,
+                              value if stock_code is None else {stock_code: value})
@@ -1,10 +1,11 @@
-import yfinance as yf
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 import datetime
 import os
 from handlers.stock_prediction import get_stock_name  
+from handlers.market_data import get_price_history
+from handlers.indicators import sma
 
 # 設定字體
 font_path = "msjh.ttf"  # 微軟正黑體
@@ -24,8 +25,7 @@ def plot_stock_trend(stock_code):
     """
     try:
         # 抓取股票數據（最近 1 個月）
-        stock = yf.Ticker(f"{stock_code}.TW")
-        df = stock.history(period="3mo")
+        df = get_price_history(stock_code, period="3mo")
 
         if df.empty:
             print(f"❌ 找不到 {stock_code} 的股票數據")
@@ -35,8 +35,8 @@ def plot_stock_trend(stock_code):
         stock_name = get_stock_name(stock_code)
         
         # 計算 5 日、20 日均線
-        df["MA5"] = df["Close"].rolling(window=5).mean()
-        df["MA20"] = df["Close"].rolling(window=20).mean()
+        df["MA5"] = sma(df["Close"].to_numpy(), 5)
+        df["MA20"] = sma(df["Close"].to_numpy(), 20)
 
         # 取得最新日期
         last_date = df.index[-1].strftime("%Y-%m-%d")
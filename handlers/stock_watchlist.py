@@ -1,14 +1,25 @@
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from get_username import get_line_username
-import yfinance as yf
+from handlers.market_data import get_price_history, prefetch, taipei_now, is_market_open, last_market_close
 import datetime
 import numpy as np
+import pandas as pd
 
 # MongoDB 連接設定
 client = MongoClient(os.getenv('MONGO_URI'))
 db = client["linebot"]
 collection = db["watchlist"]
+quotes = db["quotes"]           # 所有關注股票共用的報價快照（由 handlers/quote_refresher.py 更新）
+
+QUOTE_SNAPSHOT_MAX_AGE = int(os.getenv("QUOTE_SNAPSHOT_MAX_AGE", "180"))   # 盤中快照超過此秒數視為過期
+
+# 同一使用者的同一檔股票只會有一筆（查詢、新增、刪除都使用這個索引）
+try:
+    collection.create_index([("user_id", ASCENDING), ("stock_code", ASCENDING)], unique=True, name="user_stock_unique")
+except PyMongoError as e:
+    print(f"⚠️ 建立關注清單索引失敗（可能有重複資料）: {e}")
 
 def add_watchlist(user_id, stock_code, stock_name):
     """
@@ -19,24 +30,21 @@ def add_watchlist(user_id, stock_code, stock_name):
     :return: 回傳成功或失敗訊息
     """
     try:
-        # 檢查用戶是否已經關注該股票
-        existing_stock = collection.find_one({"user_id": user_id, "stock_code": stock_code})
-
-        if existing_stock:  # 如果該股票已經在關注清單，直接回傳訊息
-            return f"⚠️ 你已經關注 {stock_code}（{stock_name}）了！"
-
-        # 取得用戶最新名稱
+        # 取得用戶名稱（有快取，不會每次呼叫 API）
         user_name = get_line_username(user_id)
 
-        # 插入新股票
-        collection.insert_one({
-            "user_id": user_id,
-            "user_name": user_name,  
-            "stock_code": stock_code,
-            "stock_name": stock_name
-        })
+        # 不存在時才新增（一次 upsert，不必先查詢）
+        result = collection.update_one(
+            {"user_id": user_id, "stock_code": stock_code},
+            {"$setOnInsert": {"user_name": user_name, "stock_name": stock_name}},
+            upsert=True
+        )
+        if result.upserted_id is None:  # 如果該股票已經在關注清單，直接回傳訊息
+            return f"⚠️ 你已經關注 {stock_code}（{stock_name}）了！"
         return f"✅ 成功關注 {stock_code}（{stock_name}）！"
 
+    except DuplicateKeyError:  # 同時送出兩次關注時，另一個請求已經新增
+        return f"⚠️ 你已經關注 {stock_code}（{stock_name}）了！"
     except Exception as e:
         return f"❌ 無法加入關注清單：{str(e)}"
 
@@ -59,13 +67,7 @@ def remove_watchlist(user_id, stock_code, stock_name):
     從 MongoDB 移除使用者關注的股票
     """
     try:
-        # 確認該股票是否存在於關注清單
-        existing_stock = collection.find_one({"user_id": user_id, "stock_code": stock_code})
-        
-        if not existing_stock:
-            return f"⚠️ 你尚未關注 {stock_name}（{stock_code}），無法取消！"
-
-        # 執行刪除
+        # 直接刪除，以刪除筆數判斷是否有關注
         result = collection.delete_one({"user_id": user_id, "stock_code": stock_code})
         if result.deleted_count > 0:
             return f"✅ 已成功將 {stock_name}（{stock_code}）從關注清單移除！"
@@ -76,6 +78,61 @@ def remove_watchlist(user_id, stock_code, stock_name):
         return f"❌ 無法取消關注：{str(e)}"
 
 
+def _round_or_na(value):
+    return round(float(value), 2) if not np.isnan(value) else "N/A"
+
+
+# 多檔股票基本資料
+def get_stockdata_bulk(stock_codes):
+    """
+    多檔股票一次下載（yf.download），漲跌、近五日平均價與標準差以矩陣一次計算
+    :return: {股票代碼: 與 get_stockdata 相同格式的 dict}
+    """
+    try:
+        prefetch(stock_codes)   # 缺少或過期的股票一次下載，以下皆從快取取得
+        frames = {code: get_price_history(code, period="6d") for code in dict.fromkeys(stock_codes)}
+    except Exception as e:
+        return {code: {"error": f"獲取股市數據失敗: {str(e)}"} for code in stock_codes}
+
+    results = {code: {"error": f"找不到 {code} 的股票數據"} for code, df in frames.items() if len(df) < 2}
+    codes = [code for code, df in frames.items() if len(df) >= 2]
+    if not codes:
+        return results
+
+    # 每檔最近 6 天收盤價排成矩陣（資料不足的天數補 NaN）
+    closes = np.full((len(codes), 6), np.nan)
+    for i, code in enumerate(codes):
+        values = frames[code]["Close"].to_numpy()[-6:]
+        closes[i, -len(values):] = values
+    last_rows = pd.DataFrame([frames[code].iloc[-1] for code in codes], index=codes)
+
+    # 計算漲跌 & 漲跌百分比
+    latest, prev = closes[:, -1], closes[:, -2]
+    price_change = latest - prev
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentage_change = np.where(prev > 0, price_change / prev * 100, np.nan)
+
+    # 計算近五日平均價 & 標準差（不足五日為 NaN → "N/A"）
+    last_5d = closes[:, -5:]
+    avg_price_5d = last_5d.mean(axis=1)
+    std_dev_5d = last_5d.std(axis=1)
+
+    today = datetime.datetime.today().strftime("%Y-%m-%d")
+    for i, code in enumerate(codes):
+        results[code] = {
+            "latest_price": float(last_rows["Close"].iat[i]),  # 最新收盤價
+            "open_price": float(last_rows["Open"].iat[i]),  # 開盤價
+            "high_price": float(last_rows["High"].iat[i]),  # 最高價
+            "low_price": float(last_rows["Low"].iat[i]),  # 最低價
+            "price_change": _round_or_na(price_change[i]),
+            "percentage_change": _round_or_na(percentage_change[i]),
+            "avg_price_5d": _round_or_na(avg_price_5d[i]),
+            "std_dev_5d": _round_or_na(std_dev_5d[i]),
+            "date": today
+        }
+    return results
+
+
 # 股票基本資料
 def get_stockdata(stock_code):
     """
@@ -84,40 +141,37 @@ def get_stockdata(stock_code):
     - 漲跌與漲跌百分比
     - 近五日平均價與標準差
     """
-    try:
-        # 抓取最近 6 天的數據（確保至少有 5 天交易數據）
-        stock = yf.Ticker(f"{stock_code}.TW")
-        df = stock.history(period="6d")  
-
-        if df.empty or len(df) < 2:
-            return {"error": f"找不到 {stock_code} 的股票數據"}
-
-        # 取得最新數據
-        last_data = df.iloc[-1]
-        prev_data = df.iloc[-2] if len(df) > 1 else last_data  # 前一天數據，避免數據缺失
-
-        # 計算漲跌 & 漲跌百分比
-        price_change = last_data["Close"] - prev_data["Close"]
-        percentage_change = (price_change / prev_data["Close"]) * 100 if prev_data["Close"] > 0 else "N/A"
-
-        # 計算近五日平均價 & 標準差
-        avg_price_5d = df["Close"].tail(5).mean() if len(df) >= 5 else "N/A"
-        std_dev_5d = np.std(df["Close"].tail(5)) if len(df) >= 5 else "N/A"
-
-        return {
-            "latest_price": last_data["Close"],  # 最新收盤價
-            "open_price": last_data["Open"],  # 開盤價
-            "high_price": last_data["High"],  # 最高價
-            "low_price": last_data["Low"],  # 最低價
-            "price_change": round(price_change, 2) if price_change != "N/A" else "N/A",
-            "percentage_change": round(percentage_change, 2) if percentage_change != "N/A" else "N/A",
-            "avg_price_5d": round(avg_price_5d, 2) if avg_price_5d != "N/A" else "N/A",
-            "std_dev_5d": round(std_dev_5d, 2) if std_dev_5d != "N/A" else "N/A",
-            "date": datetime.datetime.today().strftime("%Y-%m-%d") 
-        }
+    return get_stockdata_bulk([stock_code])[stock_code]
+
 
+def _is_snapshot_fresh(updated_at, now):
+    """盤中：未超過 QUOTE_SNAPSHOT_MAX_AGE 秒；盤後：在最近一次收盤後更新過"""
+    if updated_at.tzinfo is None:   # MongoDB 取回的時間為 UTC（不含時區）
+        updated_at = updated_at.replace(tzinfo=datetime.timezone.utc)
+    if is_market_open(now):
+        return (now - updated_at).total_seconds() <= QUOTE_SNAPSHOT_MAX_AGE
+    return updated_at >= last_market_close(now)
+
+
+# 從共用快照取得報價
+def get_quotes(stock_codes):
+    """
+    優先讀取共用報價快照，缺少或過期的股票才即時下載
+    :return: {股票代碼: 與 get_stockdata 相同格式的 dict}
+    """
+    now = taipei_now()
+    results = {}
+    try:
+        for snapshot in quotes.find({"_id": {"$in": list(stock_codes)}}):
+            if _is_snapshot_fresh(snapshot.pop("updated_at"), now):
+                results[snapshot.pop("_id")] = snapshot
     except Exception as e:
-        return {"error": f"獲取股市數據失敗: {str(e)}"}
+        print(f"⚠️ 讀取報價快照失敗: {e}")
+
+    missing = [code for code in stock_codes if code not in results]
+    if missing:
+        results.update(get_stockdata_bulk(missing))
+    return results
 
 
 # 查詢已關注的股票
@@ -126,19 +180,20 @@ def get_watchlist(user_id):
     查詢使用者關注的所有股票，包含完整技術指標資訊
     """
     try:
-        stocks = collection.find({"user_id": user_id})
+        stocks = collection.find({"user_id": user_id}, {"_id": 0, "stock_code": 1, "stock_name": 1})
         stock_list = list(stocks)
 
         if not stock_list:
             return "⚠️你目前沒有關注任何股票！"
 
         message = ""
+        all_stock_data = get_quotes([stock['stock_code'] for stock in stock_list])
 
         for stock in stock_list:
             stock_code = stock['stock_code']
             stock_name = stock['stock_name']
 
-            stock_data = get_stockdata(stock_code)
+            stock_data = all_stock_data[stock_code]
 
             if "error" in stock_data:
                 message += f"\n⚠️ {stock_name}（{stock_code}）資訊查詢失敗\n"
@@ -0,0 +1,143 @@
+"""
+記帳意圖的本地規則判斷：明確的輸入直接在本地解析，只有模稜兩可的內容才交給 Gemini
+
+回傳值：
+- NULL_INTENT：不是記帳 / 查詢（新聞、星座、股票代碼、一般聊天...），交給 app.py 的其他功能
+- dict：與 AI 回應相同格式的解析結果，例如 {"記帳": [{"類型": "支出", "類別": "餐飲", "金額": 120}]}
+- None：無法確定，需要交給 AI 判斷
+"""
+import re
+import threading
+
+NULL_INTENT = "null"
+
+# 既有指令（由 app.py 處理）
+COMMAND_PATTERNS = [
+    re.compile(r"^(新聞|news)$", re.IGNORECASE),
+    re.compile(r"^(今日星座運勢|星座|運勢)$"),
+    re.compile(r"^(牡羊|白羊|金牛|雙子|巨蟹|獅子|處女|天秤|天蠍|射手|人馬|摩羯|魔羯|水瓶|雙魚)座?$"),
+    re.compile(r"^地震$"),
+    re.compile(r"^\d{4,6}(,\d{4,6})*$"),                      # 股票代碼
+    re.compile(r"^(股票|查詢股票|查詢我的股票)$"),
+    re.compile(r"^(查詢今日支出|查詢本週支出|查詢本月支出|查詢本月收入)$"),
+    re.compile(r"^(提醒\d{4,6}|取消提醒\d{0,6}$|查詢提醒$|我的提醒$)"),     # 到價提醒
+]
+
+# 記帳類別關鍵字（類別名稱與 ai_expense.EXPENSE_CATEGORIES / INCOME_CATEGORIES 相同）
+CATEGORY_KEYWORDS = {
+    ("支出", "餐飲"): ["餐飲", "早餐", "午餐", "晚餐", "宵夜", "早午餐", "點心", "飲料", "咖啡", "手搖", "便當", "吃飯", "聚餐"],
+    ("支出", "交通"): ["交通", "捷運", "公車", "計程車", "小黃", "高鐵", "火車", "台鐵", "客運", "加油", "油錢", "停車", "uber", "悠遊卡"],
+    ("支出", "娛樂"): ["娛樂", "電影", "唱歌", "ktv", "遊戲", "演唱會", "旅遊", "門票", "訂閱"],
+    ("支出", "購物"): ["購物", "衣服", "褲子", "鞋子", "包包", "網購", "買東西", "3c"],
+    ("支出", "醫療"): ["醫療", "看醫生", "看病", "掛號", "藥", "牙醫", "診所", "健保"],
+    ("支出", "日常"): ["日常", "日用品", "房租", "水費", "電費", "瓦斯", "網路費", "電話費", "洗衣"],
+    ("收入", "薪水"): ["薪水", "薪資", "月薪", "工資"],
+    ("收入", "獎金"): ["獎金", "年終"],
+    ("收入", "投資"): ["股利", "股息", "利息"],
+    ("收入", "補助"): ["補助", "津貼", "補貼"],
+}
+# 收入或支出都有可能的字詞（收紅包 / 包紅包、投資收益 / 投入資金），一律交給 AI 判斷方向
+AMBIGUOUS_KEYWORDS = ["紅包", "投資"]
+
+# 只有「類別關鍵字 + 金額」（可加 元 / 塊）
+RECORD_PATTERN = re.compile(r"^(?P<item>[一-龥A-Za-z0-9]*?[一-龥A-Za-z])\s*(?P<amount>\d+(?:\.\d+)?)\s*(元|塊|塊錢)?$")
+
+# 查詢：整句必須是「時間 + 支出 / 收入 + 多少」的查詢句型（如「這週花多少？」「查詢本月收入」）
+# 只出現部分字詞的一般聊天（「今天的花很漂亮」「這個月花了好多時間」）不在本地判斷
+TODAY_WORDS = r"(今天|今日)"
+WEEK_WORDS = r"(這週|本週|這周|本周|這禮拜|這星期)"
+MONTH_WORDS = r"(這個月|本月|這月)"
+SPEND_WORDS = r"(花了?|花費|支出|消費|開銷)"
+INCOME_WORDS = r"(收入|賺了?)"
+
+
+def _query_pattern(time_words, money_words):
+    return re.compile(rf"^(查詢|查|看)?{time_words}的?(總共|一共)?{money_words}(了)?(多少錢?|幾塊錢?)?[?？!！。]*$")
+
+
+QUERY_RULES = [
+    ("今日支出", _query_pattern(TODAY_WORDS, SPEND_WORDS)),
+    ("本週支出", _query_pattern(WEEK_WORDS, SPEND_WORDS)),
+    ("本月支出", _query_pattern(MONTH_WORDS, SPEND_WORDS)),
+    ("本月收入", _query_pattern(MONTH_WORDS, INCOME_WORDS)),
+]
+
+# 出現這些字就可能與財務有關（需要金額或明確查詢才能在本地決定）
+FINANCE_WORDS = re.compile(r"花|支出|收入|賺|預算|建議|理財|記帳|錢|消費|開銷|多少")
+AMOUNT_LIKE = re.compile(r"\d|[一二兩三四五六七八九十百千萬]+\s*(元|塊|萬|千)")
+
+_lock = threading.Lock()
+_stats = {"command": 0, "no_finance": 0, "record": 0, "query": 0, "llm": 0}
+
+
+def _count(tier):
+    with _lock:
+        _stats[tier] += 1
+
+
+def _has_category_word(text):
+    """是否出現任何類別關鍵字（含收支方向不明的字詞）"""
+    text = text.lower()
+    return any(keyword in text for keywords in CATEGORY_KEYWORDS.values() for keyword in keywords) or \
+        any(keyword in text for keyword in AMBIGUOUS_KEYWORDS)
+
+
+def _match_category(item):
+    """比對類別關鍵字，只有唯一符合、且沒有方向不明字詞的類別才算明確"""
+    item = item.lower()
+    if any(keyword in item for keyword in AMBIGUOUS_KEYWORDS):
+        return None
+    matched = {key for key, keywords in CATEGORY_KEYWORDS.items() if any(keyword in item for keyword in keywords)}
+    return matched.pop() if len(matched) == 1 else None
+
+
+def classify_intent(text):
+    """
+    以本地規則判斷使用者輸入
+    :return: NULL_INTENT / 解析結果 dict / None（需要交給 AI）
+    """
+    text = text.strip()
+    compact = re.sub(r"\s+", "", text)
+
+    # 1️⃣ 既有指令
+    if any(pattern.match(compact) for pattern in COMMAND_PATTERNS):
+        _count("command")
+        return NULL_INTENT
+
+    # 2️⃣ 記帳：「午餐120」「搭捷運 30 元」
+    match = RECORD_PATTERN.match(text)
+    if match:
+        category = _match_category(match.group("item"))
+        if category:
+            record_type, category_name = category
+            amount = float(match.group("amount"))
+            _count("record")
+            return {"記帳": [{"類型": record_type, "類別": category_name, "金額": int(amount) if amount.is_integer() else amount}]}
+
+    has_amount = AMOUNT_LIKE.search(compact)
+    has_finance = FINANCE_WORDS.search(compact)
+
+    # 3️⃣ 查詢：「這週花多少？」（整句符合查詢句型，且只符合一種查詢）
+    matched = [query_type for query_type, pattern in QUERY_RULES if pattern.match(compact)]
+    if len(matched) == 1:
+        _count("query")
+        return {"查詢": [{"查詢類型": matched[0]}]}
+
+    # 4️⃣ 沒有金額、財務相關字詞或類別關鍵字：一般聊天或其他功能
+    # （出現類別關鍵字但金額不是阿拉伯數字，例如「午餐一百二」，交給 AI 解析）
+    if not has_amount and not has_finance and not _has_category_word(compact):
+        _count("no_finance")
+        return NULL_INTENT
+
+    # 5️⃣ 其餘交給 AI
+    _count("llm")
+    return None
+
+
+def get_intent_stats():
+    """各層判斷的次數，以及本地規則直接決定的比例"""
+    with _lock:
+        stats = dict(_stats)
+    total = sum(stats.values())
+    stats["local_rate"] = round((total - stats["llm"]) / total, 4) if total else 0.0
+    return stats
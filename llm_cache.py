@@ -0,0 +1,171 @@
+"""
+Gemini 回應快取：相同（正規化後）的輸入直接使用先前的回應，不必再呼叫 API
+
+- LLM_CACHE_BACKEND：memory（預設，單一行程）/ disk（SQLite，可跨行程、重啟後保留）
+- LLM_CACHE_TTL：快取秒數
+- LLM_CACHE_MAX_ENTRIES：最多保留筆數，超過時淘汰最久未使用的
+- LLM_CACHE_PATH：disk 模式的資料庫檔案
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory").lower()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+
+NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+TRAILING_PUNCTUATION = "?？!！。.~～ "
+
+
+def normalize_text(text):
+    """全形轉半形、轉小寫、合併空白並去掉結尾的標點"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(TRAILING_PUNCTUATION)
+
+
+def template_numbers(text):
+    """
+    將文字中的數字換成 {n0}、{n1}...，讓「午餐120」與「午餐80」共用同一筆快取
+    :return: (樣板文字, [數字, ...])
+    """
+    numbers = []
+
+    def replace(match):
+        numbers.append(float(match.group()))
+        return f"{{n{len(numbers) - 1}}}"
+
+    return NUMBER_PATTERN.sub(replace, text), numbers
+
+
+class MemoryBackend:
+    """行程內的 LRU + TTL 快取"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()      # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteBackend:
+    """SQLite 快取，多個 worker 可共用同一個檔案"""
+
+    EVICT_EVERY = 100   # 每寫入 N 筆檢查一次數量上限
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl, now)
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+def _create_backend():
+    if LLM_CACHE_BACKEND == "disk":
+        return SQLiteBackend(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES)
+    return MemoryBackend(LLM_CACHE_MAX_ENTRIES)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {}             # namespace -> {"hits", "misses"}
+
+
+def _get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _create_backend()
+        return _backend
+
+
+def lookup(namespace, key):
+    """取得快取（值為 JSON 可序列化的物件），沒有時回傳 None"""
+    raw = _get_backend().get(f"{namespace}:{key}")
+    with _backend_lock:
+        stats = _stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        stats["hits" if raw is not None else "misses"] += 1
+    return json.loads(raw) if raw is not None else None
+
+
+def store(namespace, key, value, ttl=None):
+    """寫入快取"""
+    _get_backend().set(f"{namespace}:{key}", json.dumps(value, ensure_ascii=False), ttl or LLM_CACHE_TTL)
+
+
+def get_stats():
+    """各類快取的命中率"""
+    with _backend_lock:
+        stats = {namespace: dict(values) for namespace, values in _stats.items()}
+    for values in stats.values():
+        lookups = values["hits"] + values["misses"]
+        values["hit_rate"] = round(values["hits"] / lookups, 4) if lookups else 0.0
+    stats["backend"] = LLM_CACHE_BACKEND
+    stats["entries"] = len(_backend) if _backend is not None else 0
+    return stats
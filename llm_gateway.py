@@ -0,0 +1,334 @@
+"""
+Gemini 呼叫閘道：所有 LLM 呼叫都經過這裡
+
+- 直接使用 google.ai.generativelanguage 的 GenerativeServiceClient，每個 API 金鑰一個 client，建立一次後重複使用；
+  asyncio 的 client 綁定建立時的 event loop，所以每個 event loop 各自建立
+- 各功能沿用自己的 API 金鑰與配額（記帳解析 GOOGLE_API_KEY1、聊天 GOOGLE_API_KEY2），
+  呼叫時以 api_key 指定；未指定時使用 GOOGLE_API_KEY。同時呼叫數與 token 預算由所有功能共用
+- 全域同時呼叫數上限（LLM_MAX_CONCURRENCY）與每分鐘 token 預算（LLM_TOKENS_PER_MINUTE，0 為不限制），
+  超過時排隊等待，最多等 LLM_QUEUE_TIMEOUT 秒
+- 每次呼叫的逾時（LLM_TIMEOUT），暫時性錯誤（429 / 5xx / 逾時）以指數退避重試 LLM_MAX_RETRIES 次
+- 記錄每次呼叫的延遲與 token 用量（/metrics 會顯示）
+
+同步：generate(prompt)；asyncio：await agenerate(prompt)；串流：for text in stream(prompt)，三者共用同一個額度
+"""
+import os
+import time
+import random
+import asyncio
+import weakref
+import threading
+from collections import deque
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as api_exceptions
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-pro")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")         # 未指定 api_key 的呼叫使用這個金鑰
+
+RETRYABLE_ERRORS = (
+    api_exceptions.ResourceExhausted,       # 429
+    api_exceptions.ServiceUnavailable,      # 503
+    api_exceptions.InternalServerError,     # 500
+    api_exceptions.DeadlineExceeded,        # 504 / 逾時
+    TimeoutError,
+)
+
+
+class LLMBusyError(RuntimeError):
+    """排隊超過 LLM_QUEUE_TIMEOUT 仍取不到額度"""
+
+
+class _Budget:
+    """同時呼叫數 + 每分鐘 token 預算，兩者都有餘裕時才放行"""
+
+    def __init__(self, max_concurrency, tokens_per_minute):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.waiting = 0
+        self._usage = deque()           # [時間, token 數]，只保留最近 60 秒
+        self._cond = threading.Condition()
+
+    def _used_tokens(self, now):
+        while self._usage and self._usage[0][0] <= now - 60:
+            self._usage.popleft()
+        return sum(tokens for _, tokens in self._usage)
+
+    def _has_room(self, tokens, now):
+        if self.in_flight >= self.max_concurrency:
+            return False
+        if not self.tokens_per_minute:
+            return True
+        used = self._used_tokens(now)
+        # 單次呼叫超過整個預算時，至少在預算空了之後放行
+        return used + tokens <= self.tokens_per_minute or used == 0
+
+    def acquire(self, tokens, timeout):
+        """取得額度，回傳預留的用量紀錄（呼叫結束後以實際用量更新）"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while not self._has_room(tokens, time.time()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMBusyError("⏳ AI 服務忙碌中，請稍後再試")
+                    # token 預算會隨時間釋放，所以最多等 1 秒就重新檢查
+                    self._cond.wait(min(remaining, 1.0))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            entry = [time.time(), tokens]
+            if self.tokens_per_minute:
+                self._usage.append(entry)
+            return entry
+
+    def release(self, entry, actual_tokens=None):
+        with self._cond:
+            self.in_flight -= 1
+            if actual_tokens is not None:
+                entry[1] = actual_tokens
+            self._cond.notify_all()
+
+
+_budget = _Budget(LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE)
+_clients = {}                                   # api_key -> GenerativeServiceClient
+_async_clients = weakref.WeakKeyDictionary()    # event loop -> {api_key: GenerativeServiceAsyncClient}
+_clients_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0, "errors": 0, "retries": 0, "busy": 0,
+    "prompt_tokens": 0, "output_tokens": 0,
+    "total_latency_ms": 0.0, "max_latency_ms": 0.0, "total_wait_ms": 0.0,
+    "streams": 0, "total_ttfb_ms": 0.0,
+}
+_latencies = deque(maxlen=1000)
+_ttfbs = deque(maxlen=1000)        # 串流呼叫收到第一段文字的時間
+
+
+def get_client(api_key=None):
+    """取得（並重複使用）該 API 金鑰的 GenerativeServiceClient"""
+    api_key = api_key or GOOGLE_API_KEY
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        return _clients[api_key]
+
+
+def _get_async_client(api_key=None):
+    """目前 event loop 的 GenerativeServiceAsyncClient（aio client 只能在建立它的 loop 使用，loop 關閉後一併釋放）"""
+    api_key = api_key or GOOGLE_API_KEY
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if api_key not in clients:
+            clients[api_key] = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        return clients[api_key]
+
+
+def _request(prompt, model_name):
+    model_name = model_name or LLM_MODEL
+    return {
+        "model": model_name if model_name.startswith("models/") else f"models/{model_name}",
+        "contents": [glm.Content(role="user", parts=[glm.Part(text=str(prompt))])],
+    }
+
+
+def _text(response):
+    """回應（或串流片段）中的文字；被安全機制擋下等沒有候選回答時為空字串"""
+    if not response.candidates:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts)
+
+
+def estimate_tokens(prompt):
+    """呼叫前粗估 token 數（中文約一字一個 token），只用於預算排隊"""
+    return max(1, len(str(prompt)))
+
+
+def _usage_tokens(response):
+    """回應中的實際 token 用量 (prompt, output)，沒有時回傳 None"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+def _record(started, waited, response=None, error=False):
+    latency_ms = (time.perf_counter() - started) * 1000
+    usage = _usage_tokens(response) if response is not None else None
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["errors"] += int(error)
+        _stats["total_latency_ms"] += latency_ms
+        _stats["max_latency_ms"] = max(_stats["max_latency_ms"], latency_ms)
+        _stats["total_wait_ms"] += waited * 1000
+        if usage:
+            _stats["prompt_tokens"] += usage[0]
+            _stats["output_tokens"] += usage[1]
+        _latencies.append(latency_ms)
+    return sum(usage) if usage else None
+
+
+def _record_ttfb(started):
+    ttfb_ms = (time.perf_counter() - started) * 1000
+    with _stats_lock:
+        _stats["streams"] += 1
+        _stats["total_ttfb_ms"] += ttfb_ms
+        _ttfbs.append(ttfb_ms)
+
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return round(values[max(0, int(len(values) * ratio) - 1)], 1) if values else 0.0
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _backoff(attempt):
+    """指數退避加上隨機抖動，避免同時重試"""
+    return LLM_RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random())
+
+
+def generate(prompt, model_name=None, timeout=None, api_key=None):
+    """
+    同步呼叫 Gemini，回傳去除頭尾空白的文字
+    排隊逾時拋出 LLMBusyError，重試後仍失敗時拋出最後一次的錯誤
+    """
+    client = get_client(api_key)
+    tokens = estimate_tokens(prompt)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        try:
+            entry = _budget.acquire(tokens, LLM_QUEUE_TIMEOUT)
+        except LLMBusyError:
+            _count("busy")
+            raise
+        started = time.perf_counter()
+        response, actual = None, None
+        try:
+            response = client.generate_content(**_request(prompt, model_name), timeout=timeout or LLM_TIMEOUT)
+            text = _text(response).strip()
+            actual = _record(started, started - queued, response)
+            return text
+        except RETRYABLE_ERRORS as e:
+            actual = _record(started, started - queued, response, error=True)
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            _count("retries")
+            print(f"⚠️ Gemini 暫時性錯誤（{type(e).__name__}），第 {attempt + 1} 次重試")
+        except Exception:
+            actual = _record(started, started - queued, response, error=True)
+            raise
+        finally:
+            _budget.release(entry, actual)
+        time.sleep(_backoff(attempt))
+
+
+async def agenerate(prompt, model_name=None, timeout=None, api_key=None):
+    """asyncio 版本的 generate，與同步呼叫共用同時呼叫數與 token 預算"""
+    client = _get_async_client(api_key)
+    tokens = estimate_tokens(prompt)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        try:
+            # 排隊在執行緒中等待，不會卡住 event loop
+            entry = await asyncio.to_thread(_budget.acquire, tokens, LLM_QUEUE_TIMEOUT)
+        except LLMBusyError:
+            _count("busy")
+            raise
+        started = time.perf_counter()
+        response, actual = None, None
+        try:
+            response = await client.generate_content(**_request(prompt, model_name), timeout=timeout or LLM_TIMEOUT)
+            text = _text(response).strip()
+            actual = _record(started, started - queued, response)
+            return text
+        except RETRYABLE_ERRORS as e:
+            actual = _record(started, started - queued, response, error=True)
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            _count("retries")
+            print(f"⚠️ Gemini 暫時性錯誤（{type(e).__name__}），第 {attempt + 1} 次重試")
+        except Exception:
+            actual = _record(started, started - queued, response, error=True)
+            raise
+        finally:
+            _budget.release(entry, actual)
+        await asyncio.sleep(_backoff(attempt))
+
+
+def stream(prompt, model_name=None, timeout=None, api_key=None):
+    """
+    串流呼叫 Gemini，邊產生邊回傳文字片段
+    只有在還沒收到任何片段前發生暫時性錯誤才會重試（已送出的內容無法收回）
+    """
+    client = get_client(api_key)
+    tokens = estimate_tokens(prompt)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        try:
+            entry = _budget.acquire(tokens, LLM_QUEUE_TIMEOUT)
+        except LLMBusyError:
+            _count("busy")
+            raise
+        started = time.perf_counter()
+        response, actual, received = None, None, False
+        try:
+            for chunk in client.stream_generate_content(**_request(prompt, model_name), timeout=timeout or LLM_TIMEOUT):
+                response = chunk        # 最後一個片段帶有整次呼叫的 token 用量
+                text = _text(chunk)
+                if not received:
+                    _record_ttfb(started)
+                    received = True
+                yield text
+            actual = _record(started, started - queued, response)
+            return
+        except RETRYABLE_ERRORS as e:
+            actual = _record(started, started - queued, response, error=True)
+            if received or attempt == LLM_MAX_RETRIES:
+                raise
+            _count("retries")
+            print(f"⚠️ Gemini 暫時性錯誤（{type(e).__name__}），第 {attempt + 1} 次重試")
+        except Exception:
+            actual = _record(started, started - queued, response, error=True)
+            raise
+        finally:
+            _budget.release(entry, actual)
+        time.sleep(_backoff(attempt))
+
+
+def get_stats():
+    """呼叫次數、延遲（平均 / p95 / 最大）、串流首段延遲、排隊時間與 token 用量"""
+    with _stats_lock:
+        stats = dict(_stats)
+        latencies = list(_latencies)
+        ttfbs = list(_ttfbs)
+    calls = stats.pop("calls")
+    total_latency = stats.pop("total_latency_ms")
+    total_wait = stats.pop("total_wait_ms")
+    total_ttfb = stats.pop("total_ttfb_ms")
+    stats.update({
+        "calls": calls,
+        "avg_latency_ms": round(total_latency / calls, 1) if calls else 0.0,
+        "p95_latency_ms": _percentile(latencies, 0.95),
+        "avg_ttfb_ms": round(total_ttfb / stats["streams"], 1) if stats["streams"] else 0.0,
+        "p95_ttfb_ms": _percentile(ttfbs, 0.95),
+        "max_latency_ms": round(stats["max_latency_ms"], 1),
+        "avg_wait_ms": round(total_wait / calls, 1) if calls else 0.0,
+        "in_flight": _budget.in_flight,
+        "waiting": _budget.waiting,
+        "max_concurrency": LLM_MAX_CONCURRENCY,
+        "tokens_per_minute": LLM_TOKENS_PER_MINUTE,
+    })
+    return stats
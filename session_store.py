@@ -0,0 +1,112 @@
+"""
+使用者對話狀態（例如等待輸入星座、等待位置、等待預算金額），取代 app.py 中的全域 user_state dict
+
+- SESSION_BACKEND：memory（預設，單一行程）/ redis（多個 worker、多台機器共用，重啟後保留）
+- SESSION_TTL：狀態保留秒數，逾時自動失效（使用者沒有完成多步驟操作時不會一直卡在某個狀態）
+- SESSION_MAX_USERS：memory 模式最多保留的使用者數，超過時淘汰最久沒有更新的
+- SESSION_REDIS_URL：redis 模式的連線位址（任何相容 Redis 協定的服務皆可）
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_TTL = int(os.getenv("SESSION_TTL", "600"))
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "10000"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = "linebot:state:"
+
+
+class MemoryBackend:
+    """
+    行程內的狀態表：所有狀態的 TTL 相同，依更新順序排列時也就是依到期時間排列，
+    清除過期狀態只需從最舊的一端檢查
+    """
+
+    def __init__(self, ttl, max_users):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._data = OrderedDict()      # user_id -> (expires_at, state)
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        while self._data:
+            user_id, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[user_id]
+
+    def get(self, user_id):
+        with self._lock:
+            self._sweep(time.time())
+            item = self._data.get(user_id)
+            return item[1] if item else None
+
+    def set(self, user_id, state):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._data[user_id] = (now + self.ttl, state)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_users:
+                self._data.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def __len__(self):
+        with self._lock:
+            self._sweep(time.time())
+            return len(self._data)
+
+
+class RedisBackend:
+    """Redis 狀態表：以 SET EX 寫入，到期由 Redis 自動刪除"""
+
+    def __init__(self, url, ttl):
+        import redis    # 只有 redis 模式需要安裝
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, user_id):
+        return self._client.get(REDIS_KEY_PREFIX + user_id)
+
+    def set(self, user_id, state):
+        self._client.set(REDIS_KEY_PREFIX + user_id, state, ex=self.ttl)
+
+    def delete(self, user_id):
+        self._client.delete(REDIS_KEY_PREFIX + user_id)
+
+
+def _create_backend():
+    if SESSION_BACKEND == "redis":
+        return RedisBackend(SESSION_REDIS_URL, SESSION_TTL)
+    return MemoryBackend(SESSION_TTL, SESSION_MAX_USERS)
+
+
+_backend = _create_backend()
+
+
+def get_state(user_id):
+    """取得使用者目前的狀態，沒有（或已過期）時回傳 None"""
+    return _backend.get(user_id)
+
+
+def set_state(user_id, state):
+    """設定使用者狀態（重新計算 TTL）"""
+    _backend.set(user_id, state)
+
+
+def clear_state(user_id):
+    """清除使用者狀態"""
+    _backend.delete(user_id)
+
+
+def get_stats():
+    stats = {"backend": SESSION_BACKEND, "ttl": SESSION_TTL}
+    # redis 模式計算使用者數需要 SCAN 所有 key，/metrics 不統計
+    if isinstance(_backend, MemoryBackend):
+        stats["users"] = len(_backend)
+    return stats
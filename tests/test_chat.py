@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("google.ai.generativelanguage")
+from handlers import chat
+
+
+def test_split_text_keeps_short_text():
+    assert chat.split_text("你好") == ["你好"]
+    assert chat.split_text("") == []
+
+
+def test_split_text_cuts_at_sentence_end_within_limit():
+    sentence = "這是一句話。" * 1000         # 6000 字
+    segments = chat.split_text(sentence)
+    assert all(len(segment) <= chat.LINE_TEXT_LIMIT for segment in segments)
+    assert segments[0].endswith("。")
+    assert "".join(segments) == sentence
+
+
+def test_split_text_hard_cuts_without_punctuation():
+    text = "字" * (chat.LINE_TEXT_LIMIT * 2 + 10)
+    assert [len(segment) for segment in chat.split_text(text)] == [chat.LINE_TEXT_LIMIT, chat.LINE_TEXT_LIMIT, 10]
+
+
+def test_stream_chat_segments(monkeypatch):
+    chunks = ["第一句話。", "第二句" * 400, "。", "結尾"]
+    monkeypatch.setattr(chat.llm_gateway, "stream", lambda prompt, api_key=None: iter(chunks))
+    monkeypatch.setattr(chat.llm_cache, "lookup", lambda namespace, key: None)
+    stored = {}
+    monkeypatch.setattr(chat.llm_cache, "store", lambda namespace, key, value: stored.update({key: value}))
+    monkeypatch.setattr(chat, "CHAT_FIRST_SEGMENT_CHARS", 5)
+    monkeypatch.setattr(chat, "CHAT_SEGMENT_CHARS", 1000)
+
+    segments = list(chat.stream_chat("問題"))
+    assert segments[0] == "第一句話。"
+    assert "".join(segments) == "".join(chunks)
+    assert stored == {"問題": "".join(chunks)}
+
+
+
+def test_busy_message_is_returned(monkeypatch):
+    def busy(*args, **kwargs):
+        raise chat.llm_gateway.LLMBusyError("⏳ AI 服務忙碌中，請稍後再試")
+
+    def busy_stream(*args, **kwargs):
+        busy()
+        yield
+
+    monkeypatch.setattr(chat.llm_cache, "lookup", lambda namespace, key: None)
+    monkeypatch.setattr(chat.llm_gateway, "generate", busy)
+    monkeypatch.setattr(chat.llm_gateway, "stream", busy_stream)
+    assert chat.chat_with_bard("問題") == "⏳ AI 服務忙碌中，請稍後再試"
+    assert list(chat.stream_chat("問題")) == ["⏳ AI 服務忙碌中，請稍後再試"]
@@ -0,0 +1,112 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("scipy")
+from handlers import indicators as ind
+
+DAYS = 200
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(0)
+    close = pd.Series(100 + rng.normal(0, 1, DAYS).cumsum())
+    close.iloc[50] = np.nan             # 停牌缺值
+    volume = pd.Series(rng.integers(1000, 5000, DAYS).astype(float))
+    return close, volume
+
+
+def pandas_indicators(df):
+    """原 get_technical_indicators 的 pandas 算法"""
+    close = df["Close"].ffill()
+    delta = close.diff()
+    gain, loss = delta.where(delta > 0, 0), -delta.where(delta < 0, 0)
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    return {
+        "MA5": close.rolling(5).mean(),
+        "MA20": close.rolling(20).mean(),
+        "RSI": 100 - 100 / (1 + gain.rolling(14).mean() / loss.rolling(14).mean()),
+        "MACD": macd,
+        "MACD_SIGNAL": macd.ewm(span=9, adjust=False).mean(),
+        "Volume_MA5": df["Volume"].rolling(5).mean(),
+    }
+
+
+def ta_features(close):
+    """ta 函式庫的 RSI / MACD / 布林通道算法（LSTM 特徵）"""
+    delta = close.diff()
+    gain, loss = delta.where(delta > 0, 0), -delta.where(delta < 0, 0)
+    avg_gain = gain.ewm(alpha=1 / 14, min_periods=14, adjust=False).mean()
+    avg_loss = loss.ewm(alpha=1 / 14, min_periods=14, adjust=False).mean()
+    macd = (close.ewm(span=12, min_periods=12, adjust=False).mean()
+            - close.ewm(span=26, min_periods=26, adjust=False).mean())
+    middle, std = close.rolling(20).mean(), close.rolling(20).std(ddof=0)
+    return {
+        "RSI": np.where(avg_loss == 0, 100, 100 - 100 / (1 + avg_gain / avg_loss)),
+        "MACD": macd,
+        "MACD_signal": macd.ewm(span=9, min_periods=9, adjust=False).mean(),
+        "Bollinger_High": middle + 2 * std,
+        "Bollinger_Low": middle - 2 * std,
+    }
+
+
+def assert_same(actual, expected, name):
+    np.testing.assert_allclose(np.asarray(actual, dtype=float), np.asarray(expected, dtype=float),
+                               rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=name)
+
+
+def test_ema_matches_pandas_ewm():
+    values = np.array([np.nan, np.nan, 3.0, 5.0, 4.0, -2.0, 7.0])
+    expected = pd.Series(values).ewm(alpha=0.3, adjust=False).mean()
+    assert_same(ind.ema(values, 0.3), expected, "ema")
+    assert np.isnan(ind.ema(np.full(3, np.nan), 0.3)).all()
+
+
+def test_calculate_indicators_matches_pandas(prices):
+    close, volume = prices
+    df = pd.DataFrame({"Close": close, "Volume": volume})
+    expected = pandas_indicators(df.copy())
+    result = ind.calculate_indicators(df)
+    for name, values in expected.items():
+        assert_same(result[name], values, name)
+
+
+def test_add_feature_columns_matches_ta(prices):
+    close = prices[0].ffill()
+    expected = ta_features(close)
+    result = ind.add_feature_columns(pd.DataFrame({"close": close}))
+    for name, values in expected.items():
+        assert_same(result[name], values, name)
+    assert result["MACD_signal"].first_valid_index() == 33
+
+
+@pytest.mark.parametrize("rsi_method, warmup", [("sma", False), ("wilder", True)])
+def test_matrix_matches_single_series(prices, rsi_method, warmup):
+    close = prices[0].to_numpy()
+    matrix = np.full((3, DAYS), np.nan)
+    matrix[0], matrix[1, 30:], matrix[2] = close, close[:DAYS - 30], close * 2     # 第二檔較晚上市
+    batch = ind.compute_all(matrix, rsi_method=rsi_method, warmup=warmup)
+    single = ind.compute_all(close[:DAYS - 30], rsi_method=rsi_method, warmup=warmup)
+    for name in ind.INDICATOR_COLUMNS[:-1]:
+        assert_same(batch[name][1, 30:], single[name], name)
+        assert np.isnan(batch[name][1, :30]).all()
+
+
+@pytest.mark.parametrize("rsi_method, warmup", [("sma", False), ("wilder", True)])
+def test_incremental_update_matches_batch(prices, rsi_method, warmup):
+    close, volume = prices[0].to_numpy(), prices[1].to_numpy()
+    matrix, volumes = np.vstack([close, close * 2]), np.vstack([volume, volume])
+    full = ind.compute_all(matrix, volumes, rsi_method, warmup)
+
+    state = ind.init_state(matrix[:, :150], volumes[:, :150], rsi_method, warmup)
+    for day in range(150, DAYS):
+        latest = state.update(matrix[:, day], volumes[:, day])
+        for name in ind.INDICATOR_COLUMNS:
+            assert_same(latest[name], full[name][:, day], f"{name} day {day}")
+
+    state = ind.init_state(close[:150], volume[:150], rsi_method, warmup)
+    for day in range(150, DAYS):
+        latest = state.update(close[day], volume[day])
+        for name in ind.INDICATOR_COLUMNS:
+            assert_same(latest[name], full[name][0, day], f"{name} day {day}")
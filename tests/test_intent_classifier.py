@@ -0,0 +1,50 @@
+import pytest
+from intent_classifier import classify_intent, NULL_INTENT
+
+
+def record(record_type, category, amount):
+    return {"記帳": [{"類型": record_type, "類別": category, "金額": amount}]}
+
+
+def query(query_type):
+    return {"查詢": [{"查詢類型": query_type}]}
+
+
+@pytest.mark.parametrize("text, expected", [
+    # 既有指令交給 app.py
+    ("新聞", NULL_INTENT),
+    ("2330", NULL_INTENT),
+    ("2330,2317", NULL_INTENT),
+    ("查詢本月收入", NULL_INTENT),
+    ("提醒 2330 > 600", NULL_INTENT),
+    # 類別關鍵字 + 阿拉伯數字金額
+    ("午餐120", record("支出", "餐飲", 120)),
+    ("搭捷運 30 元", record("支出", "交通", 30)),
+    ("咖啡 65.5", record("支出", "餐飲", 65.5)),
+    ("年終 30000", record("收入", "獎金", 30000)),
+    # 整句查詢
+    ("這週花多少？", query("本週支出")),
+    ("今天花了多少錢", query("今日支出")),
+    ("今天支出", query("今日支出")),
+    ("本月開銷", query("本月支出")),
+    ("這個月賺多少", query("本月收入")),
+    # 一般聊天
+    ("你好", NULL_INTENT),
+    ("明天會下雨嗎", NULL_INTENT),
+])
+def test_local_decisions(text, expected):
+    assert classify_intent(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "今天的花很漂亮",           # 只是出現「今天」「花」
+    "這個月花了好多時間",
+    "午餐一百二",               # 中文數字金額
+    "紅包 600",                 # 收紅包或包紅包
+    "投資5000",                 # 投資收益或投入資金
+    "午餐120 晚餐200",          # 多筆
+    "給我一些理財建議",
+    "這週花多少，下週要省一點",
+])
+def test_ambiguous_goes_to_llm(text):
+    assert classify_intent(text) is None
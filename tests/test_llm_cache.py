@@ -0,0 +1,45 @@
+import llm_cache
+from llm_cache import normalize_text, template_numbers, MemoryBackend, SQLiteBackend
+
+
+def test_normalize_text():
+    assert normalize_text("  午餐１２０元！ ") == "午餐120元"
+    assert normalize_text("Hello   World??") == "hello world"
+
+
+def test_template_numbers_shares_key_across_amounts():
+    key_a, numbers_a = template_numbers(normalize_text("午餐120 晚餐 80.5"))
+    key_b, numbers_b = template_numbers(normalize_text("午餐90 晚餐 200"))
+    assert key_a == key_b == "午餐{n0} 晚餐 {n1}"
+    assert numbers_a == [120.0, 80.5]
+    assert numbers_b == [90.0, 200.0]
+
+
+def test_memory_backend_lru_and_ttl():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", "1", ttl=60)
+    backend.set("b", "2", ttl=60)
+    assert backend.get("a") == "1"       # a 變成最近使用
+    backend.set("c", "3", ttl=60)        # 淘汰 b
+    assert backend.get("b") is None
+    assert backend.get("a") == "1"
+    backend.set("d", "4", ttl=-1)
+    assert backend.get("d") is None
+
+
+def test_sqlite_backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    backend.set("k", "v", ttl=60)
+    backend.set("old", "v", ttl=-1)
+    assert backend.get("k") == "v"
+    assert backend.get("old") is None
+
+
+def test_lookup_and_store(monkeypatch):
+    monkeypatch.setattr(llm_cache, "_backend", MemoryBackend(10))
+    monkeypatch.setattr(llm_cache, "_stats", {})
+    assert llm_cache.lookup("intent", "午餐{n0}") is None
+    llm_cache.store("intent", "午餐{n0}", {"記帳": [{"類型": "支出", "類別": "餐飲", "金額": "{n0}"}]})
+    assert llm_cache.lookup("intent", "午餐{n0}")["記帳"][0]["金額"] == "{n0}"
+    stats = llm_cache.get_stats()
+    assert stats["intent"]["hits"] == 1 and stats["intent"]["misses"] == 1
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+
+glm = pytest.importorskip("google.ai.generativelanguage")
+import llm_gateway
+
+
+def response(text, prompt_tokens=3, output_tokens=5):
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)]))],
+        usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens, candidates_token_count=output_tokens),
+    )
+
+
+class FakeClient:
+    created = []
+
+    def __init__(self, client_options=None):
+        self.api_key = client_options["api_key"]
+        FakeClient.created.append(self)
+
+    def generate_content(self, model=None, contents=None, timeout=None):
+        return response(f" {self.api_key}:{contents[0].parts[0].text} ")
+
+    def stream_generate_content(self, model=None, contents=None, timeout=None):
+        return iter([response("第一段"), response("第二段")])
+
+
+class FakeAsyncClient:
+    created = []
+
+    def __init__(self, client_options=None):
+        self.api_key = client_options["api_key"]
+        self.loop = asyncio.get_running_loop()
+        FakeAsyncClient.created.append(self)
+
+    async def generate_content(self, model=None, contents=None, timeout=None):
+        # aio client 只能在建立它的 event loop 使用
+        assert asyncio.get_running_loop() is self.loop
+        return response(f"{self.api_key}:{model}")
+
+
+@pytest.fixture(autouse=True)
+def fake_clients(monkeypatch):
+    monkeypatch.setattr(llm_gateway.glm, "GenerativeServiceClient", FakeClient)
+    monkeypatch.setattr(llm_gateway.glm, "GenerativeServiceAsyncClient", FakeAsyncClient)
+    monkeypatch.setattr(llm_gateway, "GOOGLE_API_KEY", "default-key")
+    monkeypatch.setattr(llm_gateway, "_clients", {})
+    FakeClient.created, FakeAsyncClient.created = [], []
+
+
+def test_generate_uses_one_client_per_key():
+    assert llm_gateway.generate("你好") == "default-key:你好"
+    assert llm_gateway.generate("記帳", api_key="key1") == "key1:記帳"
+    assert llm_gateway.generate("再一次", api_key="key1") == "key1:再一次"
+    assert [client.api_key for client in FakeClient.created] == ["default-key", "key1"]
+
+
+def test_stream_yields_chunk_text():
+    assert list(llm_gateway.stream("問題", api_key="key2")) == ["第一段", "第二段"]
+
+
+def test_agenerate_across_event_loops():
+    async def call():
+        return await llm_gateway.agenerate("問題", model_name="gemini-test", api_key="key2")
+
+    # 每次 asyncio.run 都是新的 event loop，需要各自的 aio client
+    assert asyncio.run(call()) == "key2:models/gemini-test"
+    assert asyncio.run(call()) == "key2:models/gemini-test"
+    assert len(FakeAsyncClient.created) == 2
+
+    async def twice():
+        return [await call(), await call()]
+
+    asyncio.run(twice())
+    assert len(FakeAsyncClient.created) == 3
+
+
+def test_busy_error_when_queue_times_out(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "_budget", llm_gateway._Budget(max_concurrency=0, tokens_per_minute=0))
+    monkeypatch.setattr(llm_gateway, "LLM_QUEUE_TIMEOUT", 0.01)
+    with pytest.raises(llm_gateway.LLMBusyError):
+        llm_gateway.generate("你好")
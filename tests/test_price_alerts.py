@@ -0,0 +1,78 @@
+import os
+import datetime
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("yfinance")
+pytest.importorskip("pymongo")
+pytest.importorskip("linebot.v3")
+
+# 測試環境沒有 MongoDB：建立索引時很快失敗（模組內已處理），不會卡住 30 秒
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:1/?serverSelectionTimeoutMS=100")
+from handlers.market_data import TAIPEI_TZ
+from handlers.price_alerts import parse_rule, find_triggered, drop_stale
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("提醒 2330 > 600", ("2330", "price_above", 600.0)),
+    ("提醒2330<550.5", ("2330", "price_below", 550.5)),
+    ("提醒 2330 漲 3%", ("2330", "change_up", 3.0)),
+    ("提醒 2330 跌 2.5", ("2330", "change_down", 2.5)),
+    ("提醒 2330 rsi > 70", ("2330", "rsi_above", 70.0)),
+    ("提醒 00878 RSI < 30", ("00878", "rsi_below", 30.0)),
+    ("提醒 2330 黃金交叉", ("2330", "ma_golden", None)),
+    ("提醒 2330 死亡交叉", ("2330", "ma_death", None)),
+    ("提醒 2330", None),
+    ("提醒 台積電 > 600", None),
+    ("提醒 2330 = 600", None),
+])
+def test_parse_rule(text, expected):
+    assert parse_rule(text) == expected
+
+
+def rule(rule_id, stock_code, name, threshold=None, last_triggered=None):
+    return {"_id": rule_id, "user_id": f"U{rule_id}", "stock_code": stock_code, "stock_name": stock_code,
+            "rule": name, "threshold": threshold, "last_triggered": last_triggered}
+
+
+def test_find_triggered():
+    rules = pd.DataFrame([
+        rule(1, "2330", "price_above", 600),
+        rule(2, "2330", "price_above", 700),
+        rule(3, "2330", "price_below", 650),
+        rule(4, "2330", "change_up", 3),
+        rule(5, "2317", "change_down", 2),
+        rule(6, "2317", "rsi_below", 30),
+        rule(7, "2330", "ma_golden"),
+        rule(8, "2317", "ma_death"),
+        rule(9, "2330", "price_above", 600, last_triggered="2026-01-05"),
+        rule(10, "9999", "price_above", 1),          # 沒有快照
+        rule(11, "2330", "rsi_above", 70),
+    ])
+    snapshot = pd.DataFrame([
+        {"stock_code": "2330", "latest_price": 650.0, "percentage_change": 3.5, "rsi": None,
+         "ma5": 610.0, "ma20": 600.0, "ma5_prev": 595.0, "ma20_prev": 598.0},
+        {"stock_code": "2317", "latest_price": 100.0, "percentage_change": -1.5, "rsi": 25.0,
+         "ma5": 101.0, "ma20": 100.0, "ma5_prev": 99.0, "ma20_prev": 100.0},
+    ])
+    triggered = find_triggered(rules, snapshot, "2026-01-05")
+    # 價格、漲幅、RSI、黃金交叉觸發；跌幅未達、今天已提醒、沒有快照、RSI 資料不足（NaN）不觸發
+    assert sorted(triggered["_id"]) == [1, 3, 4, 6, 7]
+
+
+def test_find_triggered_without_snapshot():
+    rules = pd.DataFrame([rule(1, "2330", "price_above", 600)])
+    snapshot = pd.DataFrame([{"stock_code": "2317", "latest_price": 100.0}])
+    assert find_triggered(rules, snapshot, "2026-01-05").empty
+
+
+def test_drop_stale():
+    now = datetime.datetime(2026, 1, 6, 10, 0, tzinfo=TAIPEI_TZ)      # 週二盤中，上次收盤為週一 13:30
+    snapshot = pd.DataFrame([
+        # MongoDB 讀出不含時區的 UTC 時間
+        {"stock_code": "2330", "updated_at": datetime.datetime(2026, 1, 6, 1, 55)},    # 今天 09:55
+        {"stock_code": "2317", "updated_at": datetime.datetime(2026, 1, 5, 5, 35)},    # 週一 13:35
+        {"stock_code": "2454", "updated_at": datetime.datetime(2026, 1, 5, 3, 0)},     # 週一 11:00
+    ])
+    assert drop_stale(snapshot, now)["stock_code"].tolist() == ["2330", "2317"]
+    assert drop_stale(snapshot.drop(columns="updated_at"), now).empty
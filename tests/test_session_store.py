@@ -0,0 +1,47 @@
+import time
+from session_store import MemoryBackend
+
+
+def test_set_get_delete():
+    backend = MemoryBackend(ttl=60, max_users=10)
+    assert backend.get("u1") is None
+    backend.set("u1", "awaiting_budget")
+    assert backend.get("u1") == "awaiting_budget"
+    backend.delete("u1")
+    assert backend.get("u1") is None
+    backend.delete("missing")       # 不存在時不會出錯
+
+
+def test_expired_states_are_dropped(monkeypatch):
+    backend = MemoryBackend(ttl=10, max_users=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    backend.set("u1", "a")
+    monkeypatch.setattr(time, "time", lambda: now + 5)
+    backend.set("u2", "b")
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert backend.get("u1") is None
+    assert backend.get("u2") == "b"
+    assert len(backend) == 1
+
+
+def test_update_refreshes_ttl_and_order(monkeypatch):
+    backend = MemoryBackend(ttl=10, max_users=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    backend.set("u1", "a")
+    backend.set("u2", "b")
+    monkeypatch.setattr(time, "time", lambda: now + 8)
+    backend.set("u1", "c")          # 重新計算 TTL，排到最後
+    monkeypatch.setattr(time, "time", lambda: now + 12)
+    assert backend.get("u1") == "c"
+    assert backend.get("u2") is None
+
+
+def test_max_users_evicts_oldest():
+    backend = MemoryBackend(ttl=60, max_users=2)
+    backend.set("u1", "a")
+    backend.set("u2", "b")
+    backend.set("u3", "c")
+    assert backend.get("u1") is None
+    assert backend.get("u2") == "b" and backend.get("u3") == "c"
@@ -0,0 +1,138 @@
+"""
+離線訓練 LSTM 股價預測模型（收盤後執行，線上服務只載入模型做預測）
+
+訓練對象：所有使用者關注中的股票 + 最近 TRAIN_RECENT_DAYS 天內被查詢過的股票
+
+使用方式：
+    python train_models.py                  # 立即訓練一次
+    python train_models.py 2330 2317        # 只訓練指定股票
+    python train_models.py --schedule       # 常駐，每個交易日 TRAIN_AT（預設 14:30）後自動訓練
+    python train_models.py --workers 4      # 平行訓練的行程數
+    python train_models.py --global         # 訓練所有股票共用的模型（STOCK_MODEL_MODE=global 時排程也會訓練共用模型）
+"""
+import os
+import time
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from handlers.market_data import taipei_now, TAIPEI_TZ
+from handlers.stock_prediction import train_model, get_recent_queries, is_trading_day, STOCK_MODEL_MODE
+
+TRAIN_AT = os.getenv("TRAIN_AT", "14:30")                      # 台北時間
+TRAIN_RECENT_DAYS = int(os.getenv("TRAIN_RECENT_DAYS", "7"))
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", "2"))
+
+
+def get_watched_stocks():
+    """從 MongoDB 取得所有使用者關注中的股票代碼"""
+    try:
+        from handlers.stock_watchlist import collection
+        return collection.distinct("stock_code")
+    except Exception as e:
+        print(f"⚠️ 無法取得關注清單: {e}")
+        return []
+
+
+def get_training_targets():
+    """關注中 + 近期查詢過的股票（去除重複）"""
+    codes = get_watched_stocks() + get_recent_queries(TRAIN_RECENT_DAYS)
+    return sorted(set(codes))
+
+
+def _train_one(stock_code):
+    """在子行程中訓練單一股票"""
+    started = time.perf_counter()
+    try:
+        predicted_price = train_model(stock_code)
+        return stock_code, predicted_price, None, time.perf_counter() - started
+    except Exception as e:
+        return stock_code, None, str(e), time.perf_counter() - started
+
+
+def train_all(stock_codes=None, workers=TRAIN_WORKERS):
+    """以行程池平行訓練所有目標股票"""
+    stock_codes = stock_codes or get_training_targets()
+    if not stock_codes:
+        print("📭 沒有需要訓練的股票")
+        return {}
+
+    print(f"🚀 開始訓練 {len(stock_codes)} 檔股票：{', '.join(stock_codes)}")
+    results = {}
+    # TensorFlow 不適合 fork，使用 spawn 建立子行程
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_train_one, code) for code in stock_codes]
+        for future in as_completed(futures):
+            stock_code, predicted_price, error, elapsed = future.result()
+            if error:
+                print(f"❌ {stock_code} 訓練失敗（{elapsed:.1f} 秒）：{error}")
+            else:
+                print(f"✅ {stock_code} 訓練完成（{elapsed:.1f} 秒），預測股價 {predicted_price}")
+            results[stock_code] = error or predicted_price
+    return results
+
+
+def _train_global(stock_codes):
+    """在子行程中訓練共用模型"""
+    from handlers.stock_global_model import train_global_model
+    return train_global_model(stock_codes)
+
+
+def train_global(stock_codes=None):
+    """以所有目標股票訓練一個共用模型"""
+    stock_codes = stock_codes or get_training_targets()
+    if not stock_codes:
+        print("📭 沒有需要訓練的股票")
+        return {}
+
+    print(f"🚀 開始訓練共用模型，共 {len(stock_codes)} 檔股票")
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        predictions = executor.submit(_train_global, stock_codes).result()
+    print(f"✅ 共用模型訓練完成（{time.perf_counter() - started:.1f} 秒）：{predictions}")
+    return predictions
+
+
+def next_run_time(now=None):
+    """下一次訓練時間（週一至週五 TRAIN_AT）"""
+    now = now or taipei_now()
+    hour, minute = map(int, TRAIN_AT.split(":"))
+    run_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += datetime.timedelta(days=1)
+    while run_at.weekday() >= 5:
+        run_at += datetime.timedelta(days=1)
+    return run_at
+
+
+def run_schedule(workers=TRAIN_WORKERS, use_global=False):
+    """常駐排程：每個交易日收盤後訓練一次"""
+    while True:
+        run_at = next_run_time()
+        print(f"⏰ 下一次訓練時間：{run_at.astimezone(TAIPEI_TZ):%Y-%m-%d %H:%M}")
+        time.sleep(max((run_at - taipei_now()).total_seconds(), 0))
+
+        if not is_trading_day():
+            print("📅 今天非交易日，略過訓練")
+            continue
+        if use_global:
+            train_global()
+        else:
+            train_all(workers=workers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="離線訓練 LSTM 股價預測模型")
+    parser.add_argument("codes", nargs="*", help="指定股票代碼（預設為關注中與近期查詢的股票）")
+    parser.add_argument("--schedule", action="store_true", help="常駐並於每個交易日收盤後訓練")
+    parser.add_argument("--workers", type=int, default=TRAIN_WORKERS, help="平行訓練的行程數")
+    parser.add_argument("--global", dest="use_global", action="store_true", default=STOCK_MODEL_MODE == "global",
+                        help="訓練所有股票共用的模型")
+    args = parser.parse_args()
+
+    if args.schedule:
+        run_schedule(args.workers, args.use_global)
+    elif args.use_global:
+        train_global(args.codes)
+    else:
+        train_all(args.codes, args.workers)